@@ -0,0 +1,450 @@
+"""قياس أداء البوت بدون شبكة: تيليجرام و Aladhan وهميان على localhost.
+
+    python bench_prayer_bot.py --users 500 --updates 5000 --concurrency 64
+    python bench_prayer_bot.py --aladhan-latency 0.3 --remote-ratio 0.2 --json
+    python bench_prayer_bot.py --subscriptions 100000
+    python bench_prayer_bot.py --webhook
+
+يمرّر تحديثات مصطنعة (مواقيت اليوم، اختيار مدينة، موقع، تنبيهات، جدول أسبوع)
+على الـ handlers الحقيقية عبر build_application، ويطبع تحديث/ثانية و p50/p99
+والذاكرة. --max-p99 يجعل الخروج بخطأ إن تجاوز p99 الحد (لاكتشاف التراجع قبل النشر).
+--subscriptions يقيس أيضًا استعادة اشتراكات التنبيهات وإعادة جدولتها كلها عند منتصف الليل.
+--webhook يرسل التحديثات بـ POST لخادم الويب هوك الحقيقي فتمر بطابور الاستقبال
+(UpdateIngestor) كما في النشر، والزمن من الإرسال حتى انتهاء المعالجة، مع زمن الرد 200.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+import tornado.netutil
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+
+# ================ الخوادم الوهمية ================
+class FakeServers:
+    """تيليجرام و Aladhan وهميان في خيط وحلقة مستقلين، حتى لا يُحسب عملهما على البوت."""
+
+    def __init__(self, telegram_latency: float, aladhan_latency: float):
+        self.telegram_latency = telegram_latency
+        self.aladhan_latency = aladhan_latency
+        self.calls: Dict[str, int] = {}
+        self.port: Optional[int] = None
+        self._ready = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self._thread, daemon=True).start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _thread(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = tornado.web.Application(
+            [
+                (r"/bot[^/]+/(\w+)", FakeTelegramHandler, {"servers": self}),
+                (r"/aladhan/(\w+)(?:/(\d+)/(\d+))?", FakeAladhanHandler, {"servers": self}),
+            ]
+        )
+        server = HTTPServer(app)
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        server.add_sockets(sockets)
+        self._ready.set()
+        self._loop.run_forever()
+
+
+class FakeTelegramHandler(tornado.web.RequestHandler):
+    def initialize(self, servers: FakeServers):
+        self.servers = servers
+
+    def log_exception(self, *args):
+        pass
+
+    async def post(self, method: str):
+        self.servers.count(f"telegram.{method}")
+        await asyncio.sleep(self.servers.telegram_latency)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(self.get_body_argument("chat_id", "1"))
+            result = {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": self.get_body_argument("text", ""),
+            }
+        else:
+            result = True
+        self.write({"ok": True, "result": result})
+
+
+def _fake_day(day: date, suffix: str = "") -> Dict:
+    timings = {"Fajr": "04:55", "Dhuhr": "11:52", "Asr": "15:10", "Maghrib": "17:35", "Isha": "18:52"}
+    return {
+        "timings": {key: value + suffix for key, value in timings.items()},
+        "date": {
+            "readable": day.strftime("%d %b %Y"),
+            "gregorian": {"date": day.strftime("%d-%m-%Y")},
+            "hijri": {"date": "01-05-1448"},
+        },
+        "meta": {"timezone": "UTC"},
+    }
+
+
+class FakeAladhanHandler(tornado.web.RequestHandler):
+    def initialize(self, servers: FakeServers):
+        self.servers = servers
+
+    async def get(self, endpoint: str, year: Optional[str], month: Optional[str]):
+        self.servers.count(f"aladhan.{endpoint}")
+        await asyncio.sleep(self.servers.aladhan_latency)
+        if year and month:
+            day = date(int(year), int(month), 1)
+            days = []
+            while day.month == int(month):
+                days.append(_fake_day(day, " (UTC)"))
+                day += timedelta(days=1)
+            self.write({"code": 200, "data": days})
+        else:
+            self.write({"code": 200, "data": _fake_day(date.today())})
+
+
+# ================ التحديثات المصطنعة ================
+class UpdateFactory:
+    def __init__(self, pb, seed: int, remote_ratio: float):
+        self.pb = pb
+        self.random = random.Random(seed)
+        self.remote_ratio = remote_ratio
+        self.next_id = 1
+        self.cities = [(country, city) for country, cities in pb.COUNTRY_CITIES.items() for city in cities]
+        self.local_cities = [
+            (country, city) for country, city in self.cities if pb.CITY_API_NAMES.get((country, city), city) in pb.CITY_COORDS
+        ]
+
+    def _id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def _user(self, user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"}
+
+    def message(self, user_id: int, text: Optional[str] = None, location=None) -> Dict:
+        msg = {
+            "message_id": self._id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+        }
+        if text is not None:
+            msg["text"] = text
+            if text.startswith("/"):
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if location is not None:
+            msg["location"] = {"latitude": location[0], "longitude": location[1]}
+        return {"update_id": self._id(), "message": msg}
+
+    def callback(self, user_id: int, data: str) -> Dict:
+        return {
+            "update_id": self._id(),
+            "callback_query": {
+                "id": str(self._id()),
+                "chat_instance": "bench",
+                "data": data,
+                "from": self._user(user_id),
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "-",
+                },
+            },
+        }
+
+    def location(self) -> tuple:
+        if self.random.random() < self.remote_ratio:
+            # بعيد عن أي مدينة معروفة. القريب منها أيضًا يطلب Aladhan مرة لكل مربع
+            # (المنطقة الزمنية)، ثم يُحسب محليًا
+            return self.random.uniform(55, 65), self.random.uniform(90, 120)
+        lat, lon, _ = self.random.choice(list(self.pb.CITY_COORDS.values()))
+        return lat + self.random.uniform(-0.1, 0.1), lon + self.random.uniform(-0.1, 0.1)
+
+    def local_place(self) -> Dict:
+        """مكان تُحسب مواقيته محليًا من أول طلب: مدينة معروفة (الموقع ينتظر منطقته الزمنية من Aladhan)."""
+        country, city = self.random.choice(self.local_cities)
+        return {"country": country, "city": city, "lat": None, "lon": None}
+
+    def setup(self, user_id: int) -> List[Dict]:
+        """اختيار مدينة أولًا (من القائمة أو باسم غير معروف محليًا)."""
+        country, city = self.random.choice(self.cities)
+        if self.random.random() < self.remote_ratio:
+            name = "Qx" + "".join(self.random.choice("bdfgkmnprstvz") for _ in range(6))
+            return [self.callback(user_id, f"city|{country}|غير ذلك"), self.message(user_id, name)]
+        return [self.callback(user_id, f"country|{country}"), self.callback(user_id, f"city|{country}|{city}")]
+
+    def action(self, user_id: int) -> Dict:
+        roll = self.random.random()
+        if roll < 0.5:
+            return self.message(user_id, "مواقيت اليوم 🕌")
+        if roll < 0.65:
+            return self.callback(user_id, "repeat_last")
+        if roll < 0.75:
+            country, city = self.random.choice(self.cities)
+            return self.callback(user_id, f"city|{country}|{city}")
+        if roll < 0.9:
+            return self.message(user_id, location=self.location())
+        if roll < 0.95:
+            return self.message(user_id, "تنبيهات الأذان 🔔")
+        return self.message(user_id, "/week")
+
+
+# ================ التشغيل ================
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _drive(application, updates: List[Dict], concurrency: int) -> List[float]:
+    from telegram import Update
+
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(data: Dict):
+        async with slots:
+            update = Update.de_json(data, application.bot)
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(data) for data in updates))
+    return latencies
+
+
+class _CompletionTap:
+    """يقف مكان Application عند UpdateIngestor ليعرف متى انتهت معالجة كل تحديث."""
+
+    def __init__(self, application, done):
+        self.application = application
+        self.bot = application.bot
+        self.done = done
+
+    async def process_update(self, update):
+        try:
+            await self.application.process_update(update)
+        finally:
+            self.done(update.update_id)
+
+
+class WebhookDriver:
+    """يرسل التحديثات لخادم الويب هوك الحقيقي (build_web_app + WebhookHandler) على localhost."""
+
+    def __init__(self, pb, application, concurrency: int):
+        self.pb = pb
+        self.concurrency = concurrency
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.ack_latencies: List[float] = []
+        self.rejected = 0
+        self.server = HTTPServer(pb.build_web_app(pb.WebhookHandler, {"ingestor": pb.ingestor}))
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.server.add_sockets(sockets)
+        self.url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/{pb.WEBHOOK_PATH}"
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency))
+        pb.ingestor.start(_CompletionTap(application, self._done))
+
+    def _done(self, update_id: int):
+        future = self._pending.pop(update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def close(self):
+        await self.pb.ingestor.stop()
+        await self.client.aclose()
+        self.server.stop()
+
+    async def drive(self, updates: List[Dict]) -> List[float]:
+        slots = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        latencies: List[float] = []
+
+        async def one(data: Dict):
+            async with slots:
+                done = self._pending[data["update_id"]] = loop.create_future()
+                started = time.perf_counter()
+                while True:
+                    response = await self.client.post(self.url, json=data)
+                    self.ack_latencies.append(time.perf_counter() - started)
+                    if response.status_code == 200:
+                        break
+                    # 503 (طابور ممتلئ): تيليجرام يعيد الإرسال، ونحن كذلك
+                    self.rejected += 1
+                    await asyncio.sleep(0.05)
+                latencies.append(await done - started)
+
+        await asyncio.gather(*(one(data) for data in updates))
+        return latencies
+
+
+async def _bench_alerts(pb, application, factory: UpdateFactory, count: int, places: int) -> Dict:
+    """استعادة count اشتراكًا موزعة على places مكانًا، ثم حساب التنبيه التالي لكل
+    مكان قبيل منتصف ليله المحلي (ما يحدث عند انتقال كل المشتركين لليوم التالي)."""
+    store = pb.MemoryUserStore()
+    chosen = [factory.local_place() for _ in range(places)]
+    for chat_id in range(count):
+        store.save_subscription(chat_id, chosen[chat_id % places])
+    scheduler = pb.AlertScheduler(store, pb.AlertSender(pb.ALERT_GLOBAL_RATE, 1, 1))
+
+    started = time.perf_counter()
+    await scheduler.start(application.bot)
+    restore_seconds = time.perf_counter() - started
+
+    groups = []
+    for group in scheduler.places.values():
+        times = await pb.get_place_times(group["place"])
+        if times:
+            midnight = pb._next_local_midnight(times["timezone"], pb._local_date(times["timezone"]))
+            groups.append((group["place"], midnight - 60))
+    started = time.perf_counter()
+    for place, after in groups:
+        await pb.next_prayer_alert(place, after)
+    rollover_seconds = time.perf_counter() - started
+    await scheduler.stop()
+
+    return {
+        "alert_subscriptions": count,
+        "alert_places": len(scheduler.places),
+        "alert_restore_seconds": round(restore_seconds, 3),
+        "alert_rollover_seconds": round(rollover_seconds, 3),
+    }
+
+
+async def run(args) -> Dict:
+    import prayer_bot as pb
+
+    application = pb.build_application(base_url=f"http://127.0.0.1:{args.port}/bot")
+    factory = UpdateFactory(pb, args.seed, args.remote_ratio)
+    users = list(range(1000, 1000 + args.users))
+
+    async with application:
+        await pb.post_init(application)
+        await application.start()
+        webhook = WebhookDriver(pb, application, args.concurrency) if args.webhook else None
+        drive = webhook.drive if webhook else lambda updates: _drive(application, updates, args.concurrency)
+
+        setup = [factory.setup(user_id) for user_id in users]
+        setup_started = time.perf_counter()
+        # الخطوة الأولى لكل المستخدمين بالتوازي ثم الثانية، فيبقى ترتيب كل مستخدم
+        for step in zip(*setup):
+            await drive(list(step))
+        setup_seconds = time.perf_counter() - setup_started
+
+        updates = [factory.action(factory.random.choice(users)) for _ in range(args.updates)]
+        if webhook:
+            webhook.ack_latencies.clear()
+        started = time.perf_counter()
+        latencies = await drive(updates)
+        elapsed = time.perf_counter() - started
+
+        ingestion = {}
+        if webhook:
+            await webhook.close()
+            ingestion = {
+                "ack_p50_ms": round(_percentile(webhook.ack_latencies, 0.50) * 1000, 2),
+                "ack_p99_ms": round(_percentile(webhook.ack_latencies, 0.99) * 1000, 2),
+                "rejected_503": webhook.rejected,
+                "ingest_batches": pb.ingestor.batches,
+            }
+
+        alerts = {}
+        if args.subscriptions:
+            alerts = await _bench_alerts(pb, application, factory, args.subscriptions, args.alert_places)
+
+        await application.stop()
+        await pb.post_shutdown(application)
+
+    return {
+        "updates": len(latencies),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+        "setup_seconds": round(setup_seconds, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **ingestion,
+        **alerts,
+        "cache": pb.prayer_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="ثوانٍ لكل طلب Bot API")
+    parser.add_argument("--aladhan-latency", type=float, default=0.15, help="ثوانٍ لكل طلب Aladhan")
+    parser.add_argument("--remote-ratio", type=float, default=0.1, help="نسبة المدن/المواقع غير المعروفة محليًا")
+    parser.add_argument("--subscriptions", type=int, default=0, help="اشتراكات تنبيهات لقياس إعادة الجدولة")
+    parser.add_argument("--alert-places", type=int, default=2000, help="عدد الأماكن المختلفة للمشتركين")
+    parser.add_argument("--webhook", action="store_true", help="عبر خادم الويب هوك وطابور الاستقبال")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="طباعة النتيجة JSON فقط")
+    parser.add_argument("--max-p99", type=float, default=None, help="حد p99 بالمللي ثانية")
+    args = parser.parse_args()
+
+    servers = FakeServers(args.telegram_latency, args.aladhan_latency)
+    servers.start()
+    args.port = servers.port
+
+    # قبل استيراد البوت: كل شيء محلي وفي الذاكرة
+    os.environ.setdefault("TELEGRAM_TOKEN", "1:bench")
+    os.environ["ALADHAN_BASE_URL"] = f"http://127.0.0.1:{servers.port}/aladhan"
+    os.environ["USER_STORE_URL"] = "memory://"
+    # نقيس الـ handlers نفسها، لا ردود حد الطلبات لكل محادثة
+    os.environ.setdefault("CHAT_RATE_BURST", str(args.updates))
+    if args.subscriptions:
+        # مكان المشترك يبقى في الكاش، كما في نشر حجمه على قدر مشتركيه
+        os.environ.setdefault("PRAYER_CACHE_SIZE", str(4 * (args.alert_places + args.users)))
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("tornado.access").setLevel(logging.WARNING)
+    if args.json:
+        logging.disable(logging.WARNING)
+
+    result = asyncio.run(run(args))
+    result["upstream_calls"] = dict(sorted(servers.calls.items()))
+    servers.stop()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        for key, value in result.items():
+            print(f"{key:>20}: {value}")
+
+    if args.max_p99 is not None and result["p99_ms"] > args.max_p99:
+        print(f"p99 {result['p99_ms']} ms exceeds {args.max_p99} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""قياس زمن الإقلاع البارد: الاستيراد، ربط البورت، وأول رد على الويب هوك.
+
+    python bench_startup.py --runs 5
+    python bench_startup.py --runs 10 --json --max-import-ms 800 --max-ack-ms 300
+    python bench_startup.py --module          # python -m prayer_bot بدل python prayer_bot.py
+
+import: `python -c "import prayer_bot"` في عملية جديدة، مطروحًا منه زمن مفسّر فارغ.
+cold start: يشغّل البوت كما في النشر أمام تيليجرام و Aladhan الوهميين (من
+bench_prayer_bot)، ويرسل /start حتى يرد الويب هوك 200 (ack)، ثم ينتظر رسالة البوت
+للمستخدم في تيليجرام الوهمي (reply)، ويطبع تفصيل المراحل من سطر "Startup:" في لوج البوت.
+--max-import-ms و --max-ack-ms يجعلان الخروج بخطأ عند التراجع.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+from typing import Dict, List, Optional
+
+from bench_prayer_bot import FakeServers, _percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "1:bench"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _bot_env(port: int, servers: FakeServers) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        TELEGRAM_TOKEN=TOKEN,
+        PORT=str(port),
+        BASE_URL="http://127.0.0.1",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{servers.port}/bot",
+        ALADHAN_BASE_URL=f"http://127.0.0.1:{servers.port}/aladhan",
+        USER_STORE_URL="memory://",
+    )
+    return env
+
+
+def _wall(command: List[str], env: Dict[str, str]) -> float:
+    started = time.perf_counter()
+    subprocess.run(command, env=env, cwd=HERE, check=True)
+    return time.perf_counter() - started
+
+
+def bench_import(runs: int, env: Dict[str, str]) -> Dict:
+    baseline = [_wall([sys.executable, "-c", "pass"], env) for _ in range(runs)]
+    imports = [_wall([sys.executable, "-c", "import prayer_bot"], env) for _ in range(runs)]
+    return {
+        "interpreter_ms": round(_percentile(baseline, 0.5) * 1000, 1),
+        "import_ms": round((_percentile(imports, 0.5) - _percentile(baseline, 0.5)) * 1000, 1),
+    }
+
+
+def _post(port: int, path: str, body: bytes) -> Optional[int]:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        return conn.getresponse().status
+    except OSError:
+        return None
+    finally:
+        conn.close()
+
+
+def _update(update_id: int) -> bytes:
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": 1, "type": "private"},
+                "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+                "text": "/start",
+            },
+        }
+    ).encode()
+
+
+def cold_start(run: int, command: List[str], servers: FakeServers, timeout: float) -> Dict:
+    port = _free_port()
+    with tempfile.TemporaryFile() as log:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, env=_bot_env(port, servers), cwd=HERE, stdout=log, stderr=log)
+        sent = servers.calls.get("telegram.sendMessage", 0)
+        bound = acked = replied = None
+        try:
+            deadline = started + timeout
+            while acked is None and time.perf_counter() < deadline:
+                status = _post(port, f"/{TOKEN}", _update(run + 1))
+                if status is not None and bound is None:
+                    bound = time.perf_counter()
+                if status == 200:
+                    acked = time.perf_counter()
+                else:
+                    time.sleep(0.002)
+            while replied is None and time.perf_counter() < deadline:
+                if servers.calls.get("telegram.sendMessage", 0) > sent:
+                    replied = time.perf_counter()
+                else:
+                    time.sleep(0.002)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.seek(0)
+        summary = next(
+            (line.split("Startup: ", 1)[1] for line in log.read().decode(errors="replace").splitlines() if "Startup: " in line),
+            None,
+        )
+
+    def ms(at: Optional[float]) -> Optional[float]:
+        return None if at is None else round((at - started) * 1000, 1)
+
+    return {"bind_ms": ms(bound), "ack_ms": ms(acked), "reply_ms": ms(replied), "phases": summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", action="store_true", help="تشغيل البوت بـ python -m prayer_bot")
+    parser.add_argument("--timeout", type=float, default=30, help="ثوانٍ لكل تشغيل")
+    parser.add_argument("--json", action="store_true", help="طباعة النتيجة JSON فقط")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="حد زمن الاستيراد بالمللي ثانية")
+    parser.add_argument("--max-ack-ms", type=float, default=None, help="حد زمن أول رد على الويب هوك")
+    args = parser.parse_args()
+
+    servers = FakeServers(0.0, 0.0)
+    servers.start()
+    env = _bot_env(_free_port(), servers)
+    result = bench_import(args.runs, env)
+
+    command = [sys.executable, "-m", "prayer_bot"] if args.module else [sys.executable, os.path.join(HERE, "prayer_bot.py")]
+    runs = [cold_start(run, command, servers, args.timeout) for run in range(args.runs)]
+    servers.stop()
+    for key in ("bind_ms", "ack_ms", "reply_ms"):
+        values = [run[key] for run in runs if run[key] is not None]
+        result[key] = _percentile(values, 0.5) if len(values) == len(runs) else None
+    result["phases"] = runs[-1]["phases"]
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        for key, value in result.items():
+            print(f"{key:>15}: {value}")
+
+    failed = False
+    if args.max_import_ms is not None and result["import_ms"] > args.max_import_ms:
+        print(f"import {result['import_ms']} ms exceeds {args.max_import_ms} ms", file=sys.stderr)
+        failed = True
+    if args.max_ack_ms is not None and (result["ack_ms"] is None or result["ack_ms"] > args.max_ack_ms):
+        print(f"first ack {result['ack_ms']} ms exceeds {args.max_ack_ms} ms", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
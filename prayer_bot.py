@@ -1,724 +1,4487 @@
-import os
-import logging
-from typing import Optional, Dict, Tuple
-
-from datetime import datetime
-import requests
-import pytz
-
-from telegram import (
-    Update,
-    InlineKeyboardButton,
-    InlineKeyboardMarkup,
-    ReplyKeyboardMarkup,
-    KeyboardButton,
-)
-from telegram.ext import (
-    Updater,
-    CallbackContext,
-    CommandHandler,
-    MessageHandler,
-    Filters,
-    CallbackQueryHandler,
-)
-
-# ================= إعداد اللوج =================
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
-logger = logging.getLogger(__name__)
-
-# ================= متغيرات البيئة =================
-TELEGRAM_TOKEN = os.environ["TELEGRAM_TOKEN"]
-BASE_URL = os.environ.get("BASE_URL", "https://t1prayerbot.onrender.com").rstrip("/")
-PORT = int(os.environ.get("PORT", "10000"))
-
-WEBHOOK_PATH = TELEGRAM_TOKEN
-WEBHOOK_URL = f"{BASE_URL}/{WEBHOOK_PATH}"  # بدون رقم بورت في الرابط
-
-# ================= الدول / المدن =================
-ARAB_COUNTRIES = [
-    "لبنان",
-    "سوريا",
-    "الأردن",
-    "فلسطين",
-    "مصر",
-    "السعودية",
-    "الإمارات",
-    "قطر",
-    "الكويت",
-    "البحرين",
-    "عُمان",
-    "العراق",
-    "اليمن",
-    "السودان",
-    "تونس",
-    "المغرب",
-    "الجزائر",
-]
-
-COUNTRY_CITIES = {
-    "لبنان": ["بيروت", "طرابلس", "صيدا", "صور", "غير ذلك"],
-    "سوريا": ["دمشق", "حلب", "حمص", "حماة", "غير ذلك"],
-    "الأردن": ["عمّان", "إربد", "الزرقاء", "العقبة", "غير ذلك"],
-    "فلسطين": ["القدس", "غزة", "الخليل", "نابلس", "غير ذلك"],
-    "مصر": ["القاهرة", "الإسكندرية", "الجيزة", "أسيوط", "غير ذلك"],
-    "السعودية": ["الرياض", "مكة", "المدينة", "جدة", "غير ذلك"],
-    "الإمارات": ["دبي", "أبوظبي", "الشارقة", "عجمان", "غير ذلك"],
-    "قطر": ["الدوحة", "الريان", "الوكرة", "غير ذلك"],
-    "الكويت": ["مدينة الكويت", "حولي", "الفروانية", "الجهراء", "غير ذلك"],
-    "البحرين": ["المنامة", "المحرق", "سترة", "غير ذلك"],
-    "عُمان": ["مسقط", "صلالة", "نزوى", "صحار", "غير ذلك"],
-    "العراق": ["بغداد", "البصرة", "أربيل", "الموصل", "غير ذلك"],
-    "اليمن": ["صنعاء", "عدن", "تعز", "الحديدة", "غير ذلك"],
-    "السودان": ["الخرطوم", "أم درمان", "بحري", "بور سودان", "غير ذلك"],
-    "تونس": ["تونس", "صفاقس", "سوسة", "بنزرت", "غير ذلك"],
-    "المغرب": ["الرباط", "الدار البيضاء", "فاس", "مراكش", "غير ذلك"],
-    "الجزائر": ["الجزائر", "وهران", "قسنطينة", "عنابة", "غير ذلك"],
-}
-
-COUNTRY_API_NAMES = {
-    "لبنان": "Lebanon",
-    "سوريا": "Syria",
-    "الأردن": "Jordan",
-    "فلسطين": "Palestine",
-    "مصر": "Egypt",
-    "السعودية": "Saudi Arabia",
-    "الإمارات": "United Arab Emirates",
-    "قطر": "Qatar",
-    "الكويت": "Kuwait",
-    "البحرين": "Bahrain",
-    "عُمان": "Oman",
-    "العراق": "Iraq",
-    "اليمن": "Yemen",
-    "السودان": "Sudan",
-    "تونس": "Tunisia",
-    "المغرب": "Morocco",
-    "الجزائر": "Algeria",
-}
-
-CITY_API_NAMES: Dict[Tuple[str, str], str] = {
-    ("لبنان", "بيروت"): "Beirut",
-    ("لبنان", "طرابلس"): "Tripoli",
-    ("لبنان", "صيدا"): "Sidon",
-    ("لبنان", "صور"): "Tyre",
-
-    ("سوريا", "دمشق"): "Damascus",
-    ("سوريا", "حلب"): "Aleppo",
-    ("سوريا", "حمص"): "Homs",
-    ("سوريا", "حماة"): "Hama",
-
-    ("الأردن", "عمّان"): "Amman",
-    ("الأردن", "عمان"): "Amman",
-    ("الأردن", "إربد"): "Irbid",
-    ("الأردن", "الزرقاء"): "Zarqa",
-    ("الأردن", "العقبة"): "Aqaba",
-
-    ("فلسطين", "القدس"): "Jerusalem",
-    ("فلسطين", "غزة"): "Gaza",
-    ("فلسطين", "الخليل"): "Hebron",
-    ("فلسطين", "نابلس"): "Nablus",
-
-    ("مصر", "القاهرة"): "Cairo",
-    ("مصر", "الإسكندرية"): "Alexandria",
-    ("مصر", "الاسكندرية"): "Alexandria",
-    ("مصر", "الجيزة"): "Giza",
-
-    ("السعودية", "الرياض"): "Riyadh",
-    ("السعودية", "مكة"): "Mecca",
-    ("السعودية", "المدينة"): "Medina",
-    ("السعودية", "جدة"): "Jeddah",
-
-    ("الإمارات", "دبي"): "Dubai",
-    ("الإمارات", "أبوظبي"): "Abu Dhabi",
-    ("الإمارات", "ابوظبي"): "Abu Dhabi",
-
-    ("قطر", "الدوحة"): "Doha",
-
-    ("الكويت", "مدينة الكويت"): "Kuwait City",
-
-    ("البحرين", "المنامة"): "Manama",
-
-    ("عُمان", "مسقط"): "Muscat",
-
-    ("العراق", "بغداد"): "Baghdad",
-    ("العراق", "البصرة"): "Basra",
-    ("العراق", "أربيل"): "Erbil",
-    ("العراق", "الموصل"): "Mosul",
-
-    ("اليمن", "صنعاء"): "Sanaa",
-    ("اليمن", "عدن"): "Aden",
-
-    ("السودان", "الخرطوم"): "Khartoum",
-
-    ("تونس", "تونس"): "Tunis",
-
-    ("المغرب", "الرباط"): "Rabat",
-    ("المغرب", "الدار البيضاء"): "Casablanca",
-    ("المغرب", "فاس"): "Fes",
-    ("المغرب", "مراكش"): "Marrakesh",
-
-    ("الجزائر", "الجزائر"): "Algiers",
-    ("الجزائر", "وهران"): "Oran",
-    ("الجزائر", "قسنطينة"): "Constantine",
-    ("الجزائر", "عنابة"): "Annaba",
-}
-
-# ================ كيبورد الكوماند الأساسية ================
-def main_reply_keyboard() -> ReplyKeyboardMarkup:
-    keyboard = [
-        [
-            KeyboardButton("مواقيت اليوم 🕌"),
-            KeyboardButton("تغيير المدينة 🧭"),
-        ],
-        [
-            KeyboardButton("إرسال موقعي 📍", request_location=True),
-            KeyboardButton("تنبيهات الأذان 🔔"),
-        ],
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-
-# ================ كيبورد الدول / المدن (Inline) ================
-def build_countries_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    row = []
-    for i, country in enumerate(ARAB_COUNTRIES, start=1):
-        row.append(InlineKeyboardButton(country, callback_data=f"country|{country}"))
-        if i % 2 == 0:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    return InlineKeyboardMarkup(buttons)
-
-
-def build_cities_keyboard(country: str) -> InlineKeyboardMarkup:
-    cities = COUNTRY_CITIES.get(country, [])
-    buttons = []
-    row = []
-    for i, city in enumerate(cities, start=1):
-        row.append(
-            InlineKeyboardButton(
-                city,
-                callback_data=f"city|{country}|{city}",
-            )
-        )
-        if i % 2 == 0:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    return InlineKeyboardMarkup(buttons)
-
-
-# ================ استدعاء API ================
-def get_prayer_times(country_ar: str, city_ar: str) -> Optional[Dict]:
-    """عن طريق الدولة / المدينة."""
-    country_en = COUNTRY_API_NAMES.get(country_ar, country_ar)
-    city_en = CITY_API_NAMES.get((country_ar, city_ar), city_ar)
-
-    try:
-        url = "http://api.aladhan.com/v1/timingsByCity"
-        params = {
-            "city": city_en,
-            "country": country_en,
-            "method": 2,
-            "school": 0,
-        }
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("code") != 200:
-            logger.warning(f"API error: {data}")
-            return None
-
-        timings = data["data"]["timings"]
-        date_info = data["data"]["date"]
-        gregorian = date_info["readable"]
-        hijri = date_info["hijri"]["date"]
-        timezone = data["data"]["meta"]["timezone"]
-
-        return {
-            "Fajr": timings.get("Fajr"),
-            "Dhuhr": timings.get("Dhuhr"),
-            "Asr": timings.get("Asr"),
-            "Maghrib": timings.get("Maghrib"),
-            "Isha": timings.get("Isha"),
-            "gregorian": gregorian,
-            "hijri": hijri,
-            "timezone": timezone,
-            "country_ar": country_ar,
-            "city_ar": city_ar,
-        }
-    except Exception as e:
-        logger.exception(f"Error fetching prayer times by city: {e}")
-        return None
-
-
-def get_prayer_times_by_coords(lat: float, lon: float) -> Optional[Dict]:
-    """عن طريق الإحداثيات (GPS)."""
-    try:
-        url = "http://api.aladhan.com/v1/timings"
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "method": 2,
-            "school": 0,
-        }
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("code") != 200:
-            logger.warning(f"API error: {data}")
-            return None
-
-        timings = data["data"]["timings"]
-        date_info = data["data"]["date"]
-        gregorian = date_info["readable"]
-        hijri = date_info["hijri"]["date"]
-        timezone = data["data"]["meta"]["timezone"]
-
-        # لا نعرف المدينة بالضبط، فنكتب وصف عام
-        country_ar = "حسب موقعك"
-        city_ar = "موقعك الحالي"
-
-        return {
-            "Fajr": timings.get("Fajr"),
-            "Dhuhr": timings.get("Dhuhr"),
-            "Asr": timings.get("Asr"),
-            "Maghrib": timings.get("Maghrib"),
-            "Isha": timings.get("Isha"),
-            "gregorian": gregorian,
-            "hijri": hijri,
-            "timezone": timezone,
-            "country_ar": country_ar,
-            "city_ar": city_ar,
-        }
-    except Exception as e:
-        logger.exception(f"Error fetching prayer times by coords: {e}")
-        return None
-
-
-# ================ تنسيق الرسالة ================
-def format_prayer_message(country_ar: str, city_ar: str, times: Dict) -> str:
-    return (
-        f"🕌 *مواقيت الصلاة اليوم*\n"
-        f"📍 *المدينة:* {city_ar}\n"
-        f"🌍 *الدولة:* {country_ar}\n\n"
-        f"📅 *التاريخ الميلادي:* {times['gregorian']}\n"
-        f"🗓 *التاريخ الهجري:* {times['hijri']}\n\n"
-        f"الفجر: {times['Fajr']}\n"
-        f"الظهر: {times['Dhuhr']}\n"
-        f"العصر: {times['Asr']}\n"
-        f"المغرب: {times['Maghrib']}\n"
-        f"العشاء: {times['Isha']}\n\n"
-        f"🤍 نسأل الله أن يتقبّل منّا ومنكم."
-    )
-
-
-# ================ تنبيهات الأذان (JobQueue) ================
-def cancel_alert_jobs(context: CallbackContext, chat_id: int):
-    for job in context.job_queue.jobs():
-        if str(job.name).startswith(f"alert-{chat_id}-"):
-            job.schedule_removal()
-
-
-def send_adhan_alert(context: CallbackContext):
-    job = context.job
-    data = job.context or {}
-    chat_id = data.get("chat_id")
-    prayer_name = data.get("prayer_name_ar", "أحد الأوقات")
-    if not chat_id:
-        return
-    context.bot.send_message(
-        chat_id=chat_id,
-        text=f"🕌 حان الآن وقت صلاة *{prayer_name}*.\n\nتقبّل الله طاعتكم 🤍",
-        parse_mode="Markdown",
-    )
-
-
-def schedule_prayer_alerts(context: CallbackContext, chat_id: int, user_data: Dict) -> bool:
-    """تفعيل التنبيهات لباقي أوقات اليوم فقط."""
-    # نحدد المصدر: إحداثيات أو مدينة
-    times = None
-    if user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None:
-        times = get_prayer_times_by_coords(user_data["saved_lat"], user_data["saved_lon"])
-    elif user_data.get("saved_country") and user_data.get("saved_city"):
-        times = get_prayer_times(user_data["saved_country"], user_data["saved_city"])
-
-    if not times:
-        return False
-
-    tz = pytz.timezone(times["timezone"])
-    now_local = datetime.now(tz)
-    today = now_local.date()
-
-    # حذف أي تنبيهات قديمة
-    cancel_alert_jobs(context, chat_id)
-
-    prayers = [
-        ("الفجر", "Fajr"),
-        ("الظهر", "Dhuhr"),
-        ("العصر", "Asr"),
-        ("المغرب", "Maghrib"),
-        ("العشاء", "Isha"),
-    ]
-
-    scheduled_any = False
-
-    for label_ar, key in prayers:
-        t_str = times.get(key)
-        if not t_str:
-            continue
-        try:
-            hour, minute = map(int, t_str.split(":")[:2])
-        except Exception:
-            continue
-
-        prayer_dt_local = tz.localize(datetime(today.year, today.month, today.day, hour, minute))
-        if prayer_dt_local <= now_local:
-            # هذا الوقت مرّ
-            continue
-
-        run_time_utc = prayer_dt_local.astimezone(pytz.UTC)
-
-        context.job_queue.run_once(
-            send_adhan_alert,
-            when=run_time_utc,
-            context={
-                "chat_id": chat_id,
-                "prayer_name_ar": label_ar,
-            },
-            name=f"alert-{chat_id}-{key}",
-        )
-
-        scheduled_any = True
-
-    return scheduled_any
-
-
-# ================ Handlers ================
-def send_country_menu(update: Update, context: CallbackContext):
-    text = (
-        "اختَر الدولة أولًا من القائمة التالية، ثم اختر مدينتك للحصول على مواقيت الصلاة.\n\n"
-        "بعد اختيار المدينة سيتم تثبيتها تلقائيًا لك."
-    )
-
-    if update.message:
-        update.message.reply_text(
-            text,
-            reply_markup=build_countries_keyboard(),
-        )
-    else:
-        query = update.callback_query
-        query.answer()
-        query.edit_message_text(
-            text,
-            reply_markup=build_countries_keyboard(),
-        )
-
-
-def start_command(update: Update, context: CallbackContext):
-    welcome = (
-        "👋 أهلًا بك.\n\n"
-        "اكتب *السلام عليكم* أو استخدم الأزرار بالأسفل:\n"
-        "• مواقيت اليوم 🕌\n"
-        "• تغيير المدينة 🧭\n"
-        "• إرسال موقعي 📍\n"
-        "• تنبيهات الأذان 🔔"
-    )
-    update.message.reply_text(
-        welcome,
-        reply_markup=main_reply_keyboard(),
-        parse_mode="Markdown",
-    )
-
-
-def text_handler(update: Update, context: CallbackContext):
-    text = (update.message.text or "").strip()
-
-    # تحية = نفس /start
-    lowered = text.lower()
-    if (
-        "السلام" in lowered
-        or "سلام" in lowered
-        or "/start" in lowered
-        or lowered in ("hi", "hello")
-    ):
-        start_command(update, context)
-        return
-
-    user_data = context.user_data
-    chat_id = update.message.chat_id
-
-    # لو كان ينتظر اسم مدينة غير موجودة في القائمة
-    if user_data.get("awaiting_city_name"):
-        country_ar = user_data["awaiting_city_name"]["country"]
-        city_ar = text.strip()
-
-        times = get_prayer_times(country_ar, city_ar)
-        if not times:
-            update.message.reply_text(
-                "❌ لم أستطع العثور على مواقيت الصلاة لهذه المدينة.\n"
-                "حاول كتابة الاسم بطريقة أخرى أو اختر مدينة من القائمة."
-            )
-            return
-
-        user_data["saved_country"] = country_ar
-        user_data["saved_city"] = city_ar
-        user_data["saved_lat"] = None
-        user_data["saved_lon"] = None
-        user_data["awaiting_city_name"] = None
-
-        msg = format_prayer_message(country_ar, city_ar, times)
-        keyboard = InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
-                [InlineKeyboardButton("🌍 تغيير الدولة", callback_data="change_country")],
-            ]
-        )
-        update.message.reply_markdown(msg, reply_markup=keyboard)
-        return
-
-    # زر مواقيت اليوم
-    if "مواقيت" in text:
-        # عنده موقع محفوظ؟
-        times = None
-        if user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None:
-            times = get_prayer_times_by_coords(user_data["saved_lat"], user_data["saved_lon"])
-        elif user_data.get("saved_country") and user_data.get("saved_city"):
-            times = get_prayer_times(user_data["saved_country"], user_data["saved_city"])
-
-        if not times:
-            # لم يتم تعيين مدينة بعد
-            send_country_menu(update, context)
-            return
-
-        msg = format_prayer_message(times["country_ar"], times["city_ar"], times)
-        keyboard = InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
-                [InlineKeyboardButton("🌍 تغيير الدولة", callback_data="change_country")],
-            ]
-        )
-        update.message.reply_markdown(msg, reply_markup=keyboard)
-        return
-
-    # زر تغيير المدينة
-    if "تغيير المدينة" in text:
-        # مسح المكان المحفوظ
-        user_data.pop("saved_country", None)
-        user_data.pop("saved_city", None)
-        user_data.pop("saved_lat", None)
-        user_data.pop("saved_lon", None)
-        send_country_menu(update, context)
-        return
-
-    # زر تنبيهات الأذان
-    if "تنبيهات" in text:
-        if not (
-            user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None
-        ) and not (user_data.get("saved_country") and user_data.get("saved_city")):
-            update.message.reply_text(
-                "⚠️ من فضلك حدِّد مدينتك أو أرسل موقعك أولًا، ثم فعِّل تنبيهات الأذان."
-            )
-            return
-
-        alerts_on = user_data.get("alerts_on", False)
-        if alerts_on:
-            user_data["alerts_on"] = False
-            cancel_alert_jobs(context, chat_id)
-            update.message.reply_text("🔕 تم إيقاف تنبيهات الأذان لليوم.")
-        else:
-            ok = schedule_prayer_alerts(context, chat_id, user_data)
-            if ok:
-                user_data["alerts_on"] = True
-                update.message.reply_text(
-                    "🔔 تم تفعيل تنبيهات الأذان لباقي أوقات *اليوم الحالي*.\n"
-                    "غدًا يمكنك الضغط على الزر مرة أخرى لتجديد التنبيهات.",
-                    parse_mode="Markdown",
-                )
-            else:
-                update.message.reply_text(
-                    "❌ لم أستطع جدولة التنبيهات. حاول لاحقًا أو غيّر المدينة."
-                )
-        return
-
-    # أي نص آخر
-    update.message.reply_text(
-        "👋 استخدم الأزرار بالأسفل للحصول على مواقيت الصلاة أو تغيير المدينة.",
-        reply_markup=main_reply_keyboard(),
-    )
-
-
-def location_handler(update: Update, context: CallbackContext):
-    """عند إرسال الموقع من زر (إرسال موقعي 📍)."""
-    loc = update.message.location
-    lat, lon = loc.latitude, loc.longitude
-
-    user_data = context.user_data
-    user_data["saved_lat"] = lat
-    user_data["saved_lon"] = lon
-    user_data["saved_country"] = None
-    user_data["saved_city"] = None
-
-    times = get_prayer_times_by_coords(lat, lon)
-    if not times:
-        update.message.reply_text(
-            "❌ حدث خطأ أثناء جلب مواقيت الصلاة حسب موقعك.\nحاول مرة أخرى لاحقًا."
-        )
-        return
-
-    msg = format_prayer_message(times["country_ar"], times["city_ar"], times)
-    keyboard = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
-            [InlineKeyboardButton("🌍 اختيار دولة/مدينة يدويًا", callback_data="change_country")],
-        ]
-    )
-    update.message.reply_markdown(msg, reply_markup=keyboard)
-
-
-def callback_handler(update: Update, context: CallbackContext):
-    query = update.callback_query
-    data = query.data
-    chat_id = query.message.chat.id
-    user_data = context.user_data
-
-    # اختيار دولة
-    if data.startswith("country|"):
-        _, country_ar = data.split("|", 1)
-        user_data["selected_country"] = country_ar
-
-        cities_keyboard = build_cities_keyboard(country_ar)
-        query.answer()
-        query.edit_message_text(
-            f"🌍 الدولة المختارة: *{country_ar}*\n\n"
-            f"✅ اختر مدينتك من القائمة:",
-            reply_markup=cities_keyboard,
-            parse_mode="Markdown",
-        )
-        return
-
-    # اختيار مدينة
-    if data.startswith("city|"):
-        _, country_ar, city_ar = data.split("|", 2)
-        if city_ar == "غير ذلك":
-            user_data["awaiting_city_name"] = {"country": country_ar}
-            query.answer()
-            query.edit_message_text(
-                f"✏️ اكتب الآن اسم المدينة داخل *{country_ar}*:",
-                parse_mode="Markdown",
-            )
-            return
-
-        times = get_prayer_times(country_ar, city_ar)
-        if not times:
-            query.answer()
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="❌ لم أستطع العثور على مواقيت الصلاة لهذه المدينة.\n"
-                     "اختر (غير ذلك) وادخل الاسم يدويًا."
-            )
-            return
-
-        # حفظ المدينة
-        user_data["saved_country"] = country_ar
-        user_data["saved_city"] = city_ar
-        user_data["saved_lat"] = None
-        user_data["saved_lon"] = None
-
-        msg = format_prayer_message(country_ar, city_ar, times)
-        keyboard = InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
-                [InlineKeyboardButton("🌍 تغيير الدولة", callback_data="change_country")],
-            ]
-        )
-        query.answer()
-        context.bot.send_message(
-            chat_id=chat_id,
-            text=msg,
-            parse_mode="Markdown",
-            reply_markup=keyboard,
-        )
-        return
-
-    # إعادة آخر مدينة/موقع
-    if data == "repeat_last":
-        times = None
-        if user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None:
-            times = get_prayer_times_by_coords(user_data["saved_lat"], user_data["saved_lon"])
-        elif user_data.get("saved_country") and user_data.get("saved_city"):
-            times = get_prayer_times(user_data["saved_country"], user_data["saved_city"])
-
-        if not times:
-            query.answer()
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="⚠️ لا توجد مدينة أو موقع محفوظ.\n"
-                     "استخدم زر (مواقيت اليوم 🕌) لتحديد المدينة أولًا."
-            )
-            return
-
-        msg = format_prayer_message(times["country_ar"], times["city_ar"], times)
-        keyboard = InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
-                [InlineKeyboardButton("🌍 تغيير الدولة", callback_data="change_country")],
-            ]
-        )
-        query.answer()
-        context.bot.send_message(
-            chat_id=chat_id,
-            text=msg,
-            parse_mode="Markdown",
-            reply_markup=keyboard,
-        )
-        return
-
-    # تغيير الدولة من جديد
-    if data == "change_country":
-        user_data.pop("saved_country", None)
-        user_data.pop("saved_city", None)
-        user_data.pop("saved_lat", None)
-        user_data.pop("saved_lon", None)
-        user_data.pop("selected_country", None)
-
-        query.answer()
-        query.edit_message_text(
-            "اختر الدولة من جديد 🌍:",
-            reply_markup=build_countries_keyboard(),
-        )
-        return
-
-
-# ================ Main =================
-def main():
-    logger.info("Starting bot with webhook mode...")
-
-    updater = Updater(TELEGRAM_TOKEN, use_context=True)
-    dp = updater.dispatcher
-
-    dp.add_handler(CommandHandler("start", start_command))
-    dp.add_handler(CallbackQueryHandler(callback_handler))
-    dp.add_handler(MessageHandler(Filters.location, location_handler))
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, text_handler))
-
-    logger.info(f"Using BASE_URL={BASE_URL}, PORT={PORT}")
-    logger.info(f"Setting webhook to {WEBHOOK_URL}")
-
-    updater.start_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        url_path=WEBHOOK_PATH,
-        webhook_url=WEBHOOK_URL,
-    )
-
-    updater.idle()
-
-
-if __name__ == "__main__":
-    main()
+import os
+import sys
+import time
+import socket
+import threading
+from typing import Optional, Dict, List, Tuple, Type
+
+
+# ================= الإقلاع السريع =================
+# المضيف يوقف العملية عند الخمول، وأول تحديث بعد الإيقاظ كان ينتظر استيراد telegram.ext
+# و numpy و tornado وبناء الجداول قبل ربط البورت. هذا القسم يعتمد على stdlib فقط
+# ويعمل قبل بقية الاستيرادات: يربط البورت ويرد 200 على الويب هوك فورًا.
+def _process_age() -> Optional[float]:
+    """عمر العملية بالثواني (المفسّر + ترجمة الملف قبل أول سطر)، من /proc إن وُجد."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupClock:
+    """مراحل الإقلاع بالترتيب، كل مرحلة = الزمن منذ المرحلة التي قبلها."""
+
+    def __init__(self):
+        self.prelude = _process_age()
+        self._started = self._last = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def elapsed(self, at: Optional[float] = None) -> float:
+        """ثوانٍ منذ بدء العملية (أو منذ أول سطر إن لم يُعرف عمرها)."""
+        return (self.prelude or 0.0) + (at if at is not None else time.perf_counter()) - self._started
+
+    def summary(self) -> str:
+        parts = [f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases]
+        if self.prelude is not None:
+            parts.insert(0, f"interpreter {self.prelude * 1000:.0f} ms")
+        return ", ".join(parts) + f"; total {self.elapsed() * 1000:.0f} ms"
+
+
+class BootAcceptor:
+    """يقبل الويب هوك على البورت الحقيقي إلى أن يجهز خادم tornado.
+
+    خيط جانبي يقبل الاتصالات ويخدم كل اتصال في خيطه بمهلة قراءة قصيرة (فعميل بطيء
+    لا يؤخر غيره)، يحفظ جسم كل تحديث كما هو ويرد 200، فلا يعيد تيليجرام الإرسال ولا
+    يرى مهلة. بقية المسارات (/metrics مثلًا) ترد 503.
+    عند الجاهزية يُسلَّم المقبس نفسه لـ tornado (ما ينتظر في backlog لا يضيع)
+    وتُسلَّم التحديثات المحفوظة لطابور الاستقبال.
+    """
+
+    MAX_BODY = 1 << 20
+    MAX_PENDING = 1000
+    READ_TIMEOUT = 1.0  # ثوانٍ للاتصال كله، من القبول حتى آخر بايت
+
+    def __init__(self, port: int, path: str):
+        self.path = "/" + path
+        self.sock = socket.create_server(("0.0.0.0", port), backlog=128)
+        self.sock.settimeout(0.05)
+        self.bodies: List[bytes] = []
+        self.acked = 0
+        self.rejected = 0
+        self.first_ack: Optional[float] = None  # perf_counter عند أول تحديث مقبول
+        self._lock = threading.Lock()
+        self._connections: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="boot-acceptor", daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self._connections = [thread for thread in self._connections if thread.is_alive()]
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), daemon=True)
+            self._connections.append(thread)
+            thread.start()
+
+    def _serve_connection(self, conn: socket.socket):
+        with conn:
+            try:
+                self._handle(conn, time.monotonic() + self.READ_TIMEOUT)
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def _recv(conn: socket.socket, deadline: float) -> bytes:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("read deadline")
+        conn.settimeout(remaining)
+        return conn.recv(65536)
+
+    def _handle(self, conn: socket.socket, deadline: float):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self._recv(conn, deadline)
+            if not chunk or len(data) > self.MAX_BODY:
+                return
+            data += chunk
+        head, body = data.split(b"\r\n\r\n", 1)
+        lines = head.decode("latin-1").split("\r\n")
+        method, target = lines[0].split(" ")[:2]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+
+        if length > self.MAX_BODY:
+            status = "413 Payload Too Large"
+        elif method != "POST" or target.split("?")[0].rstrip("/") != self.path:
+            status = "503 Service Unavailable"
+        else:
+            while len(body) < length:
+                chunk = self._recv(conn, deadline)
+                if not chunk:
+                    return
+                body += chunk
+            with self._lock:
+                if len(self.bodies) >= self.MAX_PENDING:
+                    self.rejected += 1
+                    status = "503 Service Unavailable"
+                else:
+                    self.bodies.append(body[:length])
+                    self.acked += 1
+                    if self.first_ack is None:
+                        self.first_ack = time.perf_counter()
+                    status = "200 OK"
+        retry = "Retry-After: 1\r\n" if status.startswith("503") else ""
+        conn.sendall(f"HTTP/1.1 {status}\r\n{retry}Content-Length: 0\r\nConnection: close\r\n\r\n".encode())
+
+    def handover(self) -> Tuple[socket.socket, List[bytes]]:
+        """يوقف الخيط ويعيد المقبس (جاهزًا لـ tornado) والتحديثات المحفوظة بترتيب وصولها."""
+        self._stop.set()
+        self._thread.join()
+        for thread in self._connections:
+            thread.join()  # READ_TIMEOUT على الأكثر
+        self.sock.setblocking(False)
+        bodies, self.bodies = self.bodies, []
+        return self.sock, bodies
+
+
+startup = StartupClock()
+_boot: Optional[BootAcceptor] = None
+# FAST_START=0 يعطّل الربط المبكر (مثلًا خلف خادم لا يعيد محاولة 503)
+if __name__ == "__main__" and len(sys.argv) == 1 and os.environ.get("FAST_START", "1") == "1":
+    try:
+        _boot = BootAcceptor(int(os.environ.get("PORT", "10000")), os.environ["TELEGRAM_TOKEN"])
+        startup.mark("bind")
+    except (KeyError, ValueError, OSError):
+        pass  # الإعداد العادي بعد الاستيرادات يفشل برسالة أوضح
+
+import json
+import signal
+import asyncio
+import functools
+import heapq
+import bisect
+import re
+from collections import deque
+import mmap
+import math
+import random
+import sqlite3
+import struct
+import zlib
+import logging
+import logging.handlers
+import multiprocessing
+from abc import ABC, abstractmethod
+from queue import SimpleQueue
+from contextvars import Context, ContextVar
+from contextlib import nullcontext
+from collections import OrderedDict
+
+from datetime import datetime, date, timedelta
+import numpy as np
+import httpx
+import pytz
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from telegram import (
+    Bot,
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+)
+from telegram.ext import (
+    Application,
+    ContextTypes,
+    CommandHandler,
+    MessageHandler,
+    filters,
+    CallbackQueryHandler,
+)
+
+startup.mark("imports")
+
+# ================= إعداد اللوج =================
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger(__name__)
+
+# ================= متغيرات البيئة =================
+TELEGRAM_TOKEN = os.environ["TELEGRAM_TOKEN"]
+BASE_URL = os.environ.get("BASE_URL", "https://t1prayerbot.onrender.com").rstrip("/")
+PORT = int(os.environ.get("PORT", "10000"))
+
+WEBHOOK_PATH = TELEGRAM_TOKEN
+WEBHOOK_URL = f"{BASE_URL}/{WEBHOOK_PATH}"  # بدون رقم بورت في الرابط
+# خادم Bot API (لخادم محلي أو للاختبار)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# مخزن حالة المستخدمين (المدينة/الموقع/التنبيهات): sqlite:///path أو memory://
+USER_STORE_URL = os.environ.get(
+    "USER_STORE_URL",
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "prayer_bot.db"),
+)
+USER_STORE_FLUSH_INTERVAL = float(os.environ.get("USER_STORE_FLUSH_INTERVAL", "2"))
+
+# إرسال التنبيهات: حد تيليجرام العام ~30 رسالة/ثانية، ورسالة/ثانية لكل محادثة
+ALERT_GLOBAL_RATE = float(os.environ.get("ALERT_GLOBAL_RATE", "25"))
+ALERT_PER_CHAT_INTERVAL = float(os.environ.get("ALERT_PER_CHAT_INTERVAL", "1"))
+ALERT_MAX_IN_FLIGHT = int(os.environ.get("ALERT_MAX_IN_FLIGHT", "32"))
+ALERT_RETRY_SECONDS = 600  # إعادة حساب مكان تعذّر حساب صلاته القادمة
+
+# عمليات معالجة متعددة: العملية الأمامية توزّع التحديثات على WORKERS عاملًا حسب chat_id
+WORKERS = int(os.environ.get("WORKERS", "1"))
+
+# عدد التحديثات التي تُعالج بالتوازي على حلقة asyncio
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "256"))
+
+# طابور الاستقبال: الحد الأقصى قبل الرد بـ 503، وعدد التحديثات المأخوذة في كل دفعة
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "2000"))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "64"))
+
+# حد لكل محادثة: طلبات/دقيقة مع رصيد أولي (burst)
+CHAT_RATE_PER_MINUTE = float(os.environ.get("CHAT_RATE_PER_MINUTE", "20"))
+CHAT_RATE_BURST = float(os.environ.get("CHAT_RATE_BURST", "8"))
+# الضغط العالي: امتلاء طابور الاستقبال بهذه النسبة أو هذا العدد من طلبات Aladhan الجارية
+# يوقف الطلبات الجديدة لـ Aladhan من المستخدمين (الكاش والحساب المحلي يستمران)
+SHED_QUEUE_RATIO = float(os.environ.get("SHED_QUEUE_RATIO", "0.8"))
+SHED_UPSTREAM_PENDING = int(os.environ.get("SHED_UPSTREAM_PENDING", "64"))
+# أقصى انتظار (ثوانٍ) لـ Aladhan في طلب مستخدم؛ الطلب يكمل في الخلفية ويملأ الكاش
+LOOKUP_DEADLINE = float(os.environ.get("LOOKUP_DEADLINE", "4"))
+
+# طريقة الحساب والمذهب (2 = ISNA، 0 = شافعي) كما كانت ثابتة في الطلبات
+PRAYER_METHOD = int(os.environ.get("PRAYER_METHOD", "2"))
+PRAYER_SCHOOL = int(os.environ.get("PRAYER_SCHOOL", "0"))
+
+# تعديل التاريخ الهجري بالأيام (مثل adjustment في Aladhan)
+HIJRI_ADJUSTMENT = int(os.environ.get("HIJRI_ADJUSTMENT", "0"))
+
+# مجلد ملفات الجداول الثنائية (تُبنى بـ: python prayer_bot.py build-timetable)
+TIMETABLE_DIR = os.environ.get("TIMETABLE_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+# عميل Aladhan: عنوان، مهلة، محاولات، حد الطلبات المتزامنة، وقاطع الدائرة
+ALADHAN_BASE_URL = os.environ.get("ALADHAN_BASE_URL", "https://api.aladhan.com/v1").rstrip("/")
+ALADHAN_TIMEOUT = float(os.environ.get("ALADHAN_TIMEOUT", "10"))
+ALADHAN_RETRIES = int(os.environ.get("ALADHAN_RETRIES", "3"))
+ALADHAN_MAX_CONCURRENCY = int(os.environ.get("ALADHAN_MAX_CONCURRENCY", "8"))
+ALADHAN_BREAKER_THRESHOLD = int(os.environ.get("ALADHAN_BREAKER_THRESHOLD", "5"))
+ALADHAN_BREAKER_COOLDOWN = float(os.environ.get("ALADHAN_BREAKER_COOLDOWN", "30"))
+
+# شبكة تقريب الإحداثيات بالدرجات (0.02 ≈ 2 كم، والفرق في المواقيت أقل من دقيقة)
+COORD_GRID_DEG = float(os.environ.get("COORD_GRID_DEG", "0.02"))
+# أقصى مسافة (كم) لتسمية الموقع باسم أقرب مدينة معروفة (المنطقة الزمنية تأتي من Aladhan)
+NEAREST_CITY_MAX_KM = float(os.environ.get("NEAREST_CITY_MAX_KM", "40"))
+
+# البحث التقريبي عن المدن: فوق القبول نصحح الاسم تلقائيًا (بنفس عدد الكلمات)، وبين الحدّين نقترح
+GAZETTEER_ACCEPT_SCORE = float(os.environ.get("GAZETTEER_ACCEPT_SCORE", "0.75"))
+GAZETTEER_SUGGEST_SCORE = float(os.environ.get("GAZETTEER_SUGGEST_SCORE", "0.4"))
+
+# مقارنة الحساب المحلي مع Aladhan في الخلفية وتسجيل الفروقات (اختياري)
+PRAYER_API_CROSSCHECK = os.environ.get("PRAYER_API_CROSSCHECK", "0") == "1"
+
+# التحميل المسبق لمواقيت الغد: قبل منتصف الليل المحلي بكم ثانية، ومدة اعتبار المستخدم نشطًا
+PREFETCH_LEAD_SECONDS = float(os.environ.get("PREFETCH_LEAD_SECONDS", "1800"))
+PREFETCH_ACTIVE_DAYS = float(os.environ.get("PREFETCH_ACTIVE_DAYS", "7"))
+PREFETCH_CHECK_INTERVAL = 60
+
+# مقاييس Prometheus على نفس بورت الويب هوك (METRICS_TOKEN اختياري لحمايتها)
+METRICS_PATH = os.environ.get("METRICS_PATH", "metrics").strip("/")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# بروفايلر بالعينات عبر /debug/profile (معطل افتراضيًا)
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL = float(os.environ.get("PROFILER_INTERVAL", "0.005"))
+
+# حجم كاش المواقيت بعدد المدخلات، والمدخل = (مدينة/موقع، يوم): مواقيت اليوم مدخل واحد
+# لكل مكان، وجدول الشهر يضيف حتى 31 مدخلًا للمكان نفسه
+PRAYER_CACHE_SIZE = int(os.environ.get("PRAYER_CACHE_SIZE", "2048"))
+
+# تتبّع التحديثات: نسبة العينة (0 = معطل)، حد الطلب البطيء (ms) الذي يُسجَّل تفصيله، وملف JSONL اختياري
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "1000"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+
+# ================= الدول / المدن =================
+ARAB_COUNTRIES = [
+    "لبنان",
+    "سوريا",
+    "الأردن",
+    "فلسطين",
+    "مصر",
+    "السعودية",
+    "الإمارات",
+    "قطر",
+    "الكويت",
+    "البحرين",
+    "عُمان",
+    "العراق",
+    "اليمن",
+    "السودان",
+    "تونس",
+    "المغرب",
+    "الجزائر",
+]
+
+COUNTRY_CITIES = {
+    "لبنان": ["بيروت", "طرابلس", "صيدا", "صور", "غير ذلك"],
+    "سوريا": ["دمشق", "حلب", "حمص", "حماة", "غير ذلك"],
+    "الأردن": ["عمّان", "إربد", "الزرقاء", "العقبة", "غير ذلك"],
+    "فلسطين": ["القدس", "غزة", "الخليل", "نابلس", "غير ذلك"],
+    "مصر": ["القاهرة", "الإسكندرية", "الجيزة", "أسيوط", "غير ذلك"],
+    "السعودية": ["الرياض", "مكة", "المدينة", "جدة", "غير ذلك"],
+    "الإمارات": ["دبي", "أبوظبي", "الشارقة", "عجمان", "غير ذلك"],
+    "قطر": ["الدوحة", "الريان", "الوكرة", "غير ذلك"],
+    "الكويت": ["مدينة الكويت", "حولي", "الفروانية", "الجهراء", "غير ذلك"],
+    "البحرين": ["المنامة", "المحرق", "سترة", "غير ذلك"],
+    "عُمان": ["مسقط", "صلالة", "نزوى", "صحار", "غير ذلك"],
+    "العراق": ["بغداد", "البصرة", "أربيل", "الموصل", "غير ذلك"],
+    "اليمن": ["صنعاء", "عدن", "تعز", "الحديدة", "غير ذلك"],
+    "السودان": ["الخرطوم", "أم درمان", "بحري", "بور سودان", "غير ذلك"],
+    "تونس": ["تونس", "صفاقس", "سوسة", "بنزرت", "غير ذلك"],
+    "المغرب": ["الرباط", "الدار البيضاء", "فاس", "مراكش", "غير ذلك"],
+    "الجزائر": ["الجزائر", "وهران", "قسنطينة", "عنابة", "غير ذلك"],
+}
+
+COUNTRY_API_NAMES = {
+    "لبنان": "Lebanon",
+    "سوريا": "Syria",
+    "الأردن": "Jordan",
+    "فلسطين": "Palestine",
+    "مصر": "Egypt",
+    "السعودية": "Saudi Arabia",
+    "الإمارات": "United Arab Emirates",
+    "قطر": "Qatar",
+    "الكويت": "Kuwait",
+    "البحرين": "Bahrain",
+    "عُمان": "Oman",
+    "العراق": "Iraq",
+    "اليمن": "Yemen",
+    "السودان": "Sudan",
+    "تونس": "Tunisia",
+    "المغرب": "Morocco",
+    "الجزائر": "Algeria",
+}
+
+CITY_API_NAMES: Dict[Tuple[str, str], str] = {
+    ("لبنان", "بيروت"): "Beirut",
+    ("لبنان", "طرابلس"): "Tripoli",
+    ("لبنان", "صيدا"): "Sidon",
+    ("لبنان", "صور"): "Tyre",
+
+    ("سوريا", "دمشق"): "Damascus",
+    ("سوريا", "حلب"): "Aleppo",
+    ("سوريا", "حمص"): "Homs",
+    ("سوريا", "حماة"): "Hama",
+
+    ("الأردن", "عمّان"): "Amman",
+    ("الأردن", "عمان"): "Amman",
+    ("الأردن", "إربد"): "Irbid",
+    ("الأردن", "الزرقاء"): "Zarqa",
+    ("الأردن", "العقبة"): "Aqaba",
+
+    ("فلسطين", "القدس"): "Jerusalem",
+    ("فلسطين", "غزة"): "Gaza",
+    ("فلسطين", "الخليل"): "Hebron",
+    ("فلسطين", "نابلس"): "Nablus",
+
+    ("مصر", "القاهرة"): "Cairo",
+    ("مصر", "الإسكندرية"): "Alexandria",
+    ("مصر", "الاسكندرية"): "Alexandria",
+    ("مصر", "الجيزة"): "Giza",
+    ("مصر", "أسيوط"): "Asyut",
+
+    ("السعودية", "الرياض"): "Riyadh",
+    ("السعودية", "مكة"): "Mecca",
+    ("السعودية", "المدينة"): "Medina",
+    ("السعودية", "جدة"): "Jeddah",
+
+    ("الإمارات", "دبي"): "Dubai",
+    ("الإمارات", "أبوظبي"): "Abu Dhabi",
+    ("الإمارات", "ابوظبي"): "Abu Dhabi",
+    ("الإمارات", "الشارقة"): "Sharjah",
+    ("الإمارات", "عجمان"): "Ajman",
+
+    ("قطر", "الدوحة"): "Doha",
+    ("قطر", "الريان"): "Al Rayyan",
+    ("قطر", "الوكرة"): "Al Wakrah",
+
+    ("الكويت", "مدينة الكويت"): "Kuwait City",
+    ("الكويت", "حولي"): "Hawalli",
+    ("الكويت", "الفروانية"): "Al Farwaniyah",
+    ("الكويت", "الجهراء"): "Al Jahra",
+
+    ("البحرين", "المنامة"): "Manama",
+    ("البحرين", "المحرق"): "Muharraq",
+    ("البحرين", "سترة"): "Sitra",
+
+    ("عُمان", "مسقط"): "Muscat",
+    ("عُمان", "صلالة"): "Salalah",
+    ("عُمان", "نزوى"): "Nizwa",
+    ("عُمان", "صحار"): "Sohar",
+
+    ("العراق", "بغداد"): "Baghdad",
+    ("العراق", "البصرة"): "Basra",
+    ("العراق", "أربيل"): "Erbil",
+    ("العراق", "الموصل"): "Mosul",
+
+    ("اليمن", "صنعاء"): "Sanaa",
+    ("اليمن", "عدن"): "Aden",
+    ("اليمن", "تعز"): "Taiz",
+    ("اليمن", "الحديدة"): "Hodeidah",
+
+    ("السودان", "الخرطوم"): "Khartoum",
+    ("السودان", "أم درمان"): "Omdurman",
+    ("السودان", "بحري"): "Khartoum North",
+    ("السودان", "بور سودان"): "Port Sudan",
+
+    ("تونس", "تونس"): "Tunis",
+    ("تونس", "صفاقس"): "Sfax",
+    ("تونس", "سوسة"): "Sousse",
+    ("تونس", "بنزرت"): "Bizerte",
+
+    ("المغرب", "الرباط"): "Rabat",
+    ("المغرب", "الدار البيضاء"): "Casablanca",
+    ("المغرب", "فاس"): "Fes",
+    ("المغرب", "مراكش"): "Marrakesh",
+
+    ("الجزائر", "الجزائر"): "Algiers",
+    ("الجزائر", "وهران"): "Oran",
+    ("الجزائر", "قسنطينة"): "Constantine",
+    ("الجزائر", "عنابة"): "Annaba",
+}
+
+# إحداثيات ومنطقة زمنية لكل مدينة معروفة (للحساب المحلي بدون API)
+CITY_COORDS: Dict[str, Tuple[float, float, str]] = {
+    "Beirut": (33.8938, 35.5018, "Asia/Beirut"),
+    "Tripoli": (34.4367, 35.8497, "Asia/Beirut"),
+    "Sidon": (33.5571, 35.3729, "Asia/Beirut"),
+    "Tyre": (33.2704, 35.2038, "Asia/Beirut"),
+
+    "Damascus": (33.5138, 36.2765, "Asia/Damascus"),
+    "Aleppo": (36.2021, 37.1343, "Asia/Damascus"),
+    "Homs": (34.7324, 36.7137, "Asia/Damascus"),
+    "Hama": (35.1318, 36.7578, "Asia/Damascus"),
+
+    "Amman": (31.9539, 35.9106, "Asia/Amman"),
+    "Irbid": (32.5556, 35.8500, "Asia/Amman"),
+    "Zarqa": (32.0728, 36.0880, "Asia/Amman"),
+    "Aqaba": (29.5321, 35.0063, "Asia/Amman"),
+
+    "Jerusalem": (31.7683, 35.2137, "Asia/Jerusalem"),
+    "Gaza": (31.5017, 34.4668, "Asia/Gaza"),
+    "Hebron": (31.5326, 35.0998, "Asia/Hebron"),
+    "Nablus": (32.2211, 35.2544, "Asia/Hebron"),
+
+    "Cairo": (30.0444, 31.2357, "Africa/Cairo"),
+    "Alexandria": (31.2001, 29.9187, "Africa/Cairo"),
+    "Giza": (30.0131, 31.2089, "Africa/Cairo"),
+    "Asyut": (27.1783, 31.1859, "Africa/Cairo"),
+
+    "Riyadh": (24.7136, 46.6753, "Asia/Riyadh"),
+    "Mecca": (21.3891, 39.8579, "Asia/Riyadh"),
+    "Medina": (24.5247, 39.5692, "Asia/Riyadh"),
+    "Jeddah": (21.4858, 39.1925, "Asia/Riyadh"),
+
+    "Dubai": (25.2048, 55.2708, "Asia/Dubai"),
+    "Abu Dhabi": (24.4539, 54.3773, "Asia/Dubai"),
+    "Sharjah": (25.3463, 55.4209, "Asia/Dubai"),
+    "Ajman": (25.4052, 55.5136, "Asia/Dubai"),
+
+    "Doha": (25.2854, 51.5310, "Asia/Qatar"),
+    "Al Rayyan": (25.2919, 51.4244, "Asia/Qatar"),
+    "Al Wakrah": (25.1659, 51.5976, "Asia/Qatar"),
+
+    "Kuwait City": (29.3759, 47.9774, "Asia/Kuwait"),
+    "Hawalli": (29.3328, 48.0286, "Asia/Kuwait"),
+    "Al Farwaniyah": (29.2775, 47.9586, "Asia/Kuwait"),
+    "Al Jahra": (29.3375, 47.6581, "Asia/Kuwait"),
+
+    "Manama": (26.2285, 50.5860, "Asia/Bahrain"),
+    "Muharraq": (26.2572, 50.6119, "Asia/Bahrain"),
+    "Sitra": (26.1547, 50.6206, "Asia/Bahrain"),
+
+    "Muscat": (23.5880, 58.3829, "Asia/Muscat"),
+    "Salalah": (17.0151, 54.0924, "Asia/Muscat"),
+    "Nizwa": (22.9333, 57.5333, "Asia/Muscat"),
+    "Sohar": (24.3474, 56.7094, "Asia/Muscat"),
+
+    "Baghdad": (33.3152, 44.3661, "Asia/Baghdad"),
+    "Basra": (30.5085, 47.7804, "Asia/Baghdad"),
+    "Erbil": (36.1911, 44.0092, "Asia/Baghdad"),
+    "Mosul": (36.3489, 43.1577, "Asia/Baghdad"),
+
+    "Sanaa": (15.3694, 44.1910, "Asia/Aden"),
+    "Aden": (12.7855, 45.0187, "Asia/Aden"),
+    "Taiz": (13.5795, 44.0209, "Asia/Aden"),
+    "Hodeidah": (14.7978, 42.9545, "Asia/Aden"),
+
+    "Khartoum": (15.5007, 32.5599, "Africa/Khartoum"),
+    "Omdurman": (15.6445, 32.4777, "Africa/Khartoum"),
+    "Khartoum North": (15.6333, 32.6333, "Africa/Khartoum"),
+    "Port Sudan": (19.6158, 37.2164, "Africa/Khartoum"),
+
+    "Tunis": (36.8065, 10.1815, "Africa/Tunis"),
+    "Sfax": (34.7406, 10.7603, "Africa/Tunis"),
+    "Sousse": (35.8256, 10.6084, "Africa/Tunis"),
+    "Bizerte": (37.2744, 9.8739, "Africa/Tunis"),
+
+    "Rabat": (34.0209, -6.8416, "Africa/Casablanca"),
+    "Casablanca": (33.5731, -7.5898, "Africa/Casablanca"),
+    "Fes": (34.0181, -5.0078, "Africa/Casablanca"),
+    "Marrakesh": (31.6295, -7.9811, "Africa/Casablanca"),
+
+    "Algiers": (36.7538, 3.0588, "Africa/Algiers"),
+    "Oran": (35.6971, -0.6308, "Africa/Algiers"),
+    "Constantine": (36.3650, 6.6147, "Africa/Algiers"),
+    "Annaba": (36.9000, 7.7667, "Africa/Algiers"),
+}
+
+# مدن إضافية خارج القوائم: يبحث فيها المطابق التقريبي عند اختيار "غير ذلك"،
+# ولها إحداثيات فتُحسب محليًا مثل مدن القوائم.
+EXTRA_CITIES: Dict[str, List[Tuple[str, str, float, float, str]]] = {
+    "لبنان": [
+        ("زحلة", "Zahle", 33.8463, 35.9020, "Asia/Beirut"),
+        ("بعلبك", "Baalbek", 34.0047, 36.2110, "Asia/Beirut"),
+        ("جونية", "Jounieh", 33.9808, 35.6178, "Asia/Beirut"),
+        ("النبطية", "Nabatieh", 33.3789, 35.4839, "Asia/Beirut"),
+        ("جبيل", "Byblos", 34.1230, 35.6519, "Asia/Beirut"),
+    ],
+    "سوريا": [
+        ("اللاذقية", "Latakia", 35.5317, 35.7901, "Asia/Damascus"),
+        ("طرطوس", "Tartus", 34.8890, 35.8866, "Asia/Damascus"),
+        ("دير الزور", "Deir ez-Zor", 35.3359, 40.1408, "Asia/Damascus"),
+        ("الرقة", "Raqqa", 35.9594, 39.0079, "Asia/Damascus"),
+        ("إدلب", "Idlib", 35.9306, 36.6339, "Asia/Damascus"),
+        ("درعا", "Daraa", 32.6189, 36.1021, "Asia/Damascus"),
+        ("الحسكة", "Al-Hasakah", 36.5024, 40.7477, "Asia/Damascus"),
+        ("السويداء", "As-Suwayda", 32.7090, 36.5695, "Asia/Damascus"),
+    ],
+    "الأردن": [
+        ("السلط", "Salt", 32.0392, 35.7272, "Asia/Amman"),
+        ("مادبا", "Madaba", 31.7160, 35.7939, "Asia/Amman"),
+        ("الكرك", "Karak", 31.1853, 35.7048, "Asia/Amman"),
+        ("جرش", "Jerash", 32.2747, 35.8961, "Asia/Amman"),
+        ("المفرق", "Mafraq", 32.3429, 36.2080, "Asia/Amman"),
+        ("معان", "Ma'an", 30.1962, 35.7341, "Asia/Amman"),
+    ],
+    "فلسطين": [
+        ("رام الله", "Ramallah", 31.9038, 35.2034, "Asia/Hebron"),
+        ("بيت لحم", "Bethlehem", 31.7054, 35.2024, "Asia/Hebron"),
+        ("جنين", "Jenin", 32.4605, 35.2956, "Asia/Hebron"),
+        ("طولكرم", "Tulkarm", 32.3104, 35.0286, "Asia/Hebron"),
+        ("أريحا", "Jericho", 31.8667, 35.4500, "Asia/Hebron"),
+        ("خان يونس", "Khan Yunis", 31.3402, 34.3063, "Asia/Gaza"),
+        ("رفح", "Rafah", 31.2969, 34.2455, "Asia/Gaza"),
+    ],
+    "مصر": [
+        ("المنصورة", "Mansoura", 31.0409, 31.3785, "Africa/Cairo"),
+        ("طنطا", "Tanta", 30.7865, 31.0004, "Africa/Cairo"),
+        ("الأقصر", "Luxor", 25.6872, 32.6396, "Africa/Cairo"),
+        ("أسوان", "Aswan", 24.0889, 32.8998, "Africa/Cairo"),
+        ("بورسعيد", "Port Said", 31.2653, 32.3019, "Africa/Cairo"),
+        ("السويس", "Suez", 29.9668, 32.5498, "Africa/Cairo"),
+        ("الزقازيق", "Zagazig", 30.5877, 31.5020, "Africa/Cairo"),
+        ("الإسماعيلية", "Ismailia", 30.5965, 32.2715, "Africa/Cairo"),
+        ("المنيا", "Minya", 28.1099, 30.7503, "Africa/Cairo"),
+        ("سوهاج", "Sohag", 26.5591, 31.6957, "Africa/Cairo"),
+    ],
+    "السعودية": [
+        ("الدمام", "Dammam", 26.4207, 50.0888, "Asia/Riyadh"),
+        ("الخبر", "Khobar", 26.2172, 50.1971, "Asia/Riyadh"),
+        ("الطائف", "Taif", 21.2703, 40.4158, "Asia/Riyadh"),
+        ("تبوك", "Tabuk", 28.3838, 36.5550, "Asia/Riyadh"),
+        ("أبها", "Abha", 18.2164, 42.5053, "Asia/Riyadh"),
+        ("خميس مشيط", "Khamis Mushait", 18.3060, 42.7290, "Asia/Riyadh"),
+        ("بريدة", "Buraydah", 26.3592, 43.9818, "Asia/Riyadh"),
+        ("حائل", "Hail", 27.5114, 41.7208, "Asia/Riyadh"),
+        ("جازان", "Jazan", 16.8892, 42.5511, "Asia/Riyadh"),
+        ("نجران", "Najran", 17.5650, 44.2289, "Asia/Riyadh"),
+        ("ينبع", "Yanbu", 24.0895, 38.0618, "Asia/Riyadh"),
+    ],
+    "الإمارات": [
+        ("رأس الخيمة", "Ras Al Khaimah", 25.8007, 55.9762, "Asia/Dubai"),
+        ("الفجيرة", "Fujairah", 25.1288, 56.3265, "Asia/Dubai"),
+        ("العين", "Al Ain", 24.2075, 55.7447, "Asia/Dubai"),
+        ("أم القيوين", "Umm Al Quwain", 25.5647, 55.5552, "Asia/Dubai"),
+    ],
+    "قطر": [
+        ("الخور", "Al Khor", 25.6804, 51.4969, "Asia/Qatar"),
+        ("أم صلال", "Umm Salal", 25.4106, 51.4040, "Asia/Qatar"),
+        ("دخان", "Dukhan", 25.4290, 50.7856, "Asia/Qatar"),
+    ],
+    "الكويت": [
+        ("الأحمدي", "Ahmadi", 29.0769, 48.0838, "Asia/Kuwait"),
+        ("مبارك الكبير", "Mubarak Al-Kabeer", 29.1869, 48.0651, "Asia/Kuwait"),
+    ],
+    "البحرين": [
+        ("الرفاع", "Riffa", 26.1300, 50.5550, "Asia/Bahrain"),
+        ("مدينة عيسى", "Isa Town", 26.1736, 50.5478, "Asia/Bahrain"),
+        ("مدينة حمد", "Hamad Town", 26.1153, 50.5069, "Asia/Bahrain"),
+    ],
+    "عُمان": [
+        ("صور", "Sur", 22.5667, 59.5289, "Asia/Muscat"),
+        ("البريمي", "Al Buraimi", 24.2500, 55.7933, "Asia/Muscat"),
+        ("عبري", "Ibri", 23.2257, 56.5157, "Asia/Muscat"),
+        ("الرستاق", "Rustaq", 23.3908, 57.4244, "Asia/Muscat"),
+        ("خصب", "Khasab", 26.1799, 56.2477, "Asia/Muscat"),
+    ],
+    "العراق": [
+        ("النجف", "Najaf", 32.0259, 44.3462, "Asia/Baghdad"),
+        ("كربلاء", "Karbala", 32.6160, 44.0249, "Asia/Baghdad"),
+        ("كركوك", "Kirkuk", 35.4681, 44.3922, "Asia/Baghdad"),
+        ("السليمانية", "Sulaymaniyah", 35.5613, 45.4306, "Asia/Baghdad"),
+        ("الناصرية", "Nasiriyah", 31.0439, 46.2576, "Asia/Baghdad"),
+        ("الحلة", "Hillah", 32.4637, 44.4199, "Asia/Baghdad"),
+        ("الرمادي", "Ramadi", 33.4206, 43.3078, "Asia/Baghdad"),
+        ("دهوك", "Duhok", 36.8669, 42.9503, "Asia/Baghdad"),
+        ("العمارة", "Amarah", 31.8356, 47.1449, "Asia/Baghdad"),
+    ],
+    "اليمن": [
+        ("المكلا", "Mukalla", 14.5425, 49.1242, "Asia/Aden"),
+        ("إب", "Ibb", 13.9667, 44.1833, "Asia/Aden"),
+        ("ذمار", "Dhamar", 14.5427, 44.4051, "Asia/Aden"),
+        ("سيئون", "Seiyun", 15.9430, 48.7873, "Asia/Aden"),
+        ("صعدة", "Saada", 16.9402, 43.7639, "Asia/Aden"),
+    ],
+    "السودان": [
+        ("كسلا", "Kassala", 15.4510, 36.4000, "Africa/Khartoum"),
+        ("الأبيض", "El Obeid", 13.1843, 30.2167, "Africa/Khartoum"),
+        ("ود مدني", "Wad Madani", 14.4012, 33.5199, "Africa/Khartoum"),
+        ("نيالا", "Nyala", 12.0489, 24.8807, "Africa/Khartoum"),
+        ("القضارف", "Gedaref", 14.0350, 35.3833, "Africa/Khartoum"),
+        ("الفاشر", "El Fasher", 13.6288, 25.3493, "Africa/Khartoum"),
+    ],
+    "تونس": [
+        ("القيروان", "Kairouan", 35.6781, 10.0963, "Africa/Tunis"),
+        ("قابس", "Gabes", 33.8815, 10.0982, "Africa/Tunis"),
+        ("المنستير", "Monastir", 35.7643, 10.8113, "Africa/Tunis"),
+        ("نابل", "Nabeul", 36.4513, 10.7357, "Africa/Tunis"),
+        ("قفصة", "Gafsa", 34.4250, 8.7842, "Africa/Tunis"),
+        ("توزر", "Tozeur", 33.9197, 8.1335, "Africa/Tunis"),
+        ("جربة", "Djerba", 33.8750, 10.8575, "Africa/Tunis"),
+    ],
+    "المغرب": [
+        ("طنجة", "Tangier", 35.7595, -5.8340, "Africa/Casablanca"),
+        ("أكادير", "Agadir", 30.4278, -9.5981, "Africa/Casablanca"),
+        ("مكناس", "Meknes", 33.8935, -5.5473, "Africa/Casablanca"),
+        ("وجدة", "Oujda", 34.6814, -1.9086, "Africa/Casablanca"),
+        ("تطوان", "Tetouan", 35.5785, -5.3684, "Africa/Casablanca"),
+        ("القنيطرة", "Kenitra", 34.2610, -6.5802, "Africa/Casablanca"),
+    ],
+    "الجزائر": [
+        ("سطيف", "Setif", 36.1911, 5.4137, "Africa/Algiers"),
+        ("البليدة", "Blida", 36.4700, 2.8277, "Africa/Algiers"),
+        ("باتنة", "Batna", 35.5559, 6.1741, "Africa/Algiers"),
+        ("تلمسان", "Tlemcen", 34.8783, -1.3150, "Africa/Algiers"),
+        ("بجاية", "Bejaia", 36.7509, 5.0567, "Africa/Algiers"),
+        ("بسكرة", "Biskra", 34.8500, 5.7333, "Africa/Algiers"),
+        ("ورقلة", "Ouargla", 31.9493, 5.3250, "Africa/Algiers"),
+        ("تيزي وزو", "Tizi Ouzou", 36.7118, 4.0459, "Africa/Algiers"),
+    ],
+}
+
+for _country_ar, _entries in EXTRA_CITIES.items():
+    for _city_ar, _city_en, _lat, _lon, _tz_name in _entries:
+        CITY_API_NAMES.setdefault((_country_ar, _city_ar), _city_en)
+        CITY_COORDS.setdefault(_city_en, (_lat, _lon, _tz_name))
+
+# ================ كيبورد الكوماند الأساسية ================
+def _build_main_reply_keyboard() -> ReplyKeyboardMarkup:
+    keyboard = [
+        [
+            KeyboardButton("مواقيت اليوم 🕌"),
+            KeyboardButton("تغيير المدينة 🧭"),
+        ],
+        [
+            KeyboardButton("إرسال موقعي 📍", request_location=True),
+            KeyboardButton("تنبيهات الأذان 🔔"),
+        ],
+    ]
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
+# ================ كيبورد الدول / المدن (Inline) ================
+def _build_countries_keyboard() -> InlineKeyboardMarkup:
+    buttons = []
+    row = []
+    for i, country in enumerate(ARAB_COUNTRIES, start=1):
+        row.append(InlineKeyboardButton(country, callback_data=f"country|{country}"))
+        if i % 2 == 0:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    return InlineKeyboardMarkup(buttons)
+
+
+def _build_cities_keyboard(country: str) -> InlineKeyboardMarkup:
+    cities = COUNTRY_CITIES.get(country, [])
+    buttons = []
+    row = []
+    for i, city in enumerate(cities, start=1):
+        row.append(
+            InlineKeyboardButton(
+                city,
+                callback_data=f"city|{country}|{city}",
+            )
+        )
+        if i % 2 == 0:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    return InlineKeyboardMarkup(buttons)
+
+
+# كائنات تيليجرام غير قابلة للتعديل، فتُبنى مرة واحدة عند الاستيراد وتُشارك
+MAIN_REPLY_KEYBOARD = _build_main_reply_keyboard()
+COUNTRIES_KEYBOARD = _build_countries_keyboard()
+CITIES_KEYBOARDS: Dict[str, InlineKeyboardMarkup] = {
+    country: _build_cities_keyboard(country) for country in COUNTRY_CITIES
+}
+TIMES_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
+        [
+            InlineKeyboardButton("📅 مواقيت الأسبوع", callback_data="calendar|7"),
+            InlineKeyboardButton("🗓 مواقيت الشهر", callback_data="calendar|30"),
+        ],
+        [InlineKeyboardButton("🌍 تغيير الدولة", callback_data="change_country")],
+    ]
+)
+LOCATION_TIMES_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("🔁 مواقيت اليوم من جديد", callback_data="repeat_last")],
+        [
+            InlineKeyboardButton("📅 مواقيت الأسبوع", callback_data="calendar|7"),
+            InlineKeyboardButton("🗓 مواقيت الشهر", callback_data="calendar|30"),
+        ],
+        [InlineKeyboardButton("🌍 اختيار دولة/مدينة يدويًا", callback_data="change_country")],
+    ]
+)
+
+
+def main_reply_keyboard() -> ReplyKeyboardMarkup:
+    return MAIN_REPLY_KEYBOARD
+
+
+def build_countries_keyboard() -> InlineKeyboardMarkup:
+    return COUNTRIES_KEYBOARD
+
+
+def build_cities_keyboard(country: str) -> InlineKeyboardMarkup:
+    keyboard = CITIES_KEYBOARDS.get(country)
+    return keyboard if keyboard is not None else _build_cities_keyboard(country)
+
+
+# ================ الحساب الفلكي المحلي ================
+# زوايا الفجر والعشاء لكل طريقة بنفس أرقام Aladhan.
+# isha_minutes = العشاء بعد المغرب بعدد ثابت من الدقائق بدل الزاوية.
+CALCULATION_METHODS: Dict[int, Dict] = {
+    1: {"name": "Karachi", "fajr": 18.0, "isha": 18.0},
+    2: {"name": "ISNA", "fajr": 15.0, "isha": 15.0},
+    3: {"name": "MWL", "fajr": 18.0, "isha": 17.0},
+    4: {"name": "Makkah", "fajr": 18.5, "isha_minutes": 90},
+    5: {"name": "Egypt", "fajr": 19.5, "isha": 17.5},
+    8: {"name": "Gulf", "fajr": 19.5, "isha_minutes": 90},
+    9: {"name": "Kuwait", "fajr": 18.0, "isha": 17.5},
+    10: {"name": "Qatar", "fajr": 18.0, "isha_minutes": 90},
+    11: {"name": "Singapore", "fajr": 20.0, "isha": 18.0},
+    12: {"name": "France", "fajr": 12.0, "isha": 12.0},
+    14: {"name": "Russia", "fajr": 16.0, "isha": 15.0},
+}
+
+SUNRISE_ANGLE = 0.833
+PRAYER_KEYS = ("Fajr", "Dhuhr", "Asr", "Maghrib", "Isha")
+
+
+def _dsin(d: float) -> float:
+    return math.sin(math.radians(d))
+
+
+def _dcos(d: float) -> float:
+    return math.cos(math.radians(d))
+
+
+def _dtan(d: float) -> float:
+    return math.tan(math.radians(d))
+
+
+def _darccos(x: float) -> float:
+    if x < -1.0 or x > 1.0:
+        return math.nan  # الشمس لا تصل لهذه الزاوية (عرض مرتفع)
+    return math.degrees(math.acos(x))
+
+
+def _fix(a: float, b: float) -> float:
+    a = a - b * math.floor(a / b)
+    return a + b if a < 0 else a
+
+
+def _julian_day(day: date) -> float:
+    year, month = day.year, day.month
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = year // 100
+    b = 2 - a + a // 4
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + day.day + b - 1524.5
+
+
+def _sun_position(jd: float) -> Tuple[float, float]:
+    """ميل الشمس ومعادلة الزمن (بالساعات) ليوم جولياني."""
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360)
+    q = _fix(280.459 + 0.98564736 * d, 360)
+    lam = _fix(q + 1.915 * _dsin(g) + 0.020 * _dsin(2 * g), 360)
+    e = 23.439 - 0.00000036 * d
+    ra = math.degrees(math.atan2(_dcos(e) * _dsin(lam), _dcos(lam))) / 15
+    eqt = q / 15 - _fix(ra, 24)
+    decl = math.degrees(math.asin(_dsin(e) * _dsin(lam)))
+    return decl, eqt
+
+
+@functools.lru_cache(maxsize=None)
+def _tz(tz_name: str):
+    """كائن المنطقة الزمنية، مرة واحدة لكل اسم."""
+    return pytz.timezone(tz_name)
+
+
+@functools.lru_cache(maxsize=8192)
+def _day_bounds(tz_name: str, day: date) -> Tuple[float, float]:
+    """بداية ونهاية اليوم المحلي (epoch). طوله ليس 86400 في أيام تغيير التوقيت الصيفي."""
+    tz = _tz(tz_name)
+    next_day = day + timedelta(days=1)
+    start = tz.localize(datetime(day.year, day.month, day.day)).timestamp()
+    end = tz.localize(datetime(next_day.year, next_day.month, next_day.day)).timestamp()
+    return start, end
+
+
+def _local_instant(tz_name: str, day: date, hour: int, minute: int) -> float:
+    """epoch لساعة محلية: جمع بسيط على بداية اليوم، و localize فقط في أيام التغيير."""
+    start, end = _day_bounds(tz_name, day)
+    if end - start == 86400:
+        return start + hour * 3600 + minute * 60
+    return _tz(tz_name).localize(datetime(day.year, day.month, day.day, hour, minute)).timestamp()
+
+
+@functools.lru_cache(maxsize=8192)
+def _utc_offset_hours(tz_name: str, day: date) -> float:
+    noon = _tz(tz_name).localize(datetime(day.year, day.month, day.day, 12))
+    return noon.utcoffset().total_seconds() / 3600
+
+
+def _format_hour(t: float) -> Optional[str]:
+    if math.isnan(t):
+        return None
+    t = _fix(t + 0.5 / 60, 24)  # تقريب لأقرب دقيقة
+    hours = int(t)
+    minutes = int((t - hours) * 60)
+    return f"{hours:02d}:{minutes:02d}"
+
+
+def compute_prayer_times(
+    lat: float,
+    lon: float,
+    tz_name: str,
+    day: date,
+    method: int = PRAYER_METHOD,
+    school: int = PRAYER_SCHOOL,
+) -> Dict[str, str]:
+    """حساب أوقات الصلوات الخمس محليًا بنفس خوارزمية Aladhan (PrayTimes)."""
+    params = CALCULATION_METHODS[method]
+    jdate = _julian_day(day) - lon / (15 * 24)
+
+    def mid_day(t: float) -> float:
+        return _fix(12 - _sun_position(jdate + t)[1], 24)
+
+    def sun_angle_time(angle: float, t: float, ccw: bool = False) -> float:
+        decl = _sun_position(jdate + t)[0]
+        noon = mid_day(t)
+        h = _darccos(
+            (-_dsin(angle) - _dsin(decl) * _dsin(lat)) / (_dcos(decl) * _dcos(lat))
+        ) / 15
+        return noon - h if ccw else noon + h
+
+    def asr_time(factor: int, t: float) -> float:
+        decl = _sun_position(jdate + t)[0]
+        angle = -math.degrees(math.atan(1 / (factor + _dtan(abs(lat - decl)))))
+        return sun_angle_time(angle, t)
+
+    # تقديرات أولية (كنسبة من اليوم) ثم حساب واحد كما في Aladhan
+    fajr = sun_angle_time(params["fajr"], 5 / 24, ccw=True)
+    sunrise = sun_angle_time(SUNRISE_ANGLE, 6 / 24, ccw=True)
+    dhuhr = mid_day(12 / 24)
+    asr = asr_time(1 + school, 13 / 24)
+    sunset = sun_angle_time(SUNRISE_ANGLE, 18 / 24)
+    isha = sun_angle_time(params.get("isha", 0.0), 18 / 24)
+
+    shift = _utc_offset_hours(tz_name, day) - lon / 15
+    fajr, sunrise, dhuhr, asr, sunset, isha = (
+        x + shift for x in (fajr, sunrise, dhuhr, asr, sunset, isha)
+    )
+
+    # تعديل خطوط العرض المرتفعة (Angle Based، الافتراضي في Aladhan)
+    night = _fix(sunrise - sunset, 24)
+    portion = params["fajr"] / 60 * night
+    if math.isnan(fajr) or _fix(sunrise - fajr, 24) > portion:
+        fajr = sunrise - portion
+    maghrib = sunset
+    if "isha_minutes" in params:
+        minutes = params["isha_minutes"]
+        if method == 4 and _hijri_parts(day)[1] == 9:
+            minutes = 120  # أم القرى: ساعتان بعد المغرب في رمضان
+        isha = maghrib + minutes / 60
+    else:
+        portion = params["isha"] / 60 * night
+        if math.isnan(isha) or _fix(isha - sunset, 24) > portion:
+            isha = sunset + portion
+
+    values = dict(zip(PRAYER_KEYS, (fajr, dhuhr, asr, maghrib, isha)))
+    return {key: _format_hour(value) for key, value in values.items()}
+
+
+def _hijri_parts(day: date) -> Tuple[int, int, int]:
+    """التقويم الهجري الحسابي (اليوم، الشهر، السنة)."""
+    day = day + timedelta(days=HIJRI_ADJUSTMENT)
+    jd = int(_julian_day(day) + 0.5)
+    l = jd - 1948440 + 10632
+    n = (l - 1) // 10631
+    l = l - 10631 * n + 354
+    j = ((10985 - l) // 5316) * ((50 * l) // 17719) + (l // 5670) * ((43 * l) // 15238)
+    l = l - ((30 - j) // 15) * ((17719 * j) // 50) - (j // 16) * ((15238 * j) // 43) + 29
+    month = (24 * l) // 709
+    hday = l - (709 * month) // 24
+    year = 30 * n + j - 30
+    return hday, month, year
+
+
+def hijri_date(day: date) -> str:
+    hday, month, year = _hijri_parts(day)
+    return f"{hday:02d}-{month:02d}-{year}"
+
+
+def gregorian_readable(day: date) -> str:
+    return day.strftime("%d %b %Y")
+
+
+def _compute_city_times(country_ar: str, city_ar: str) -> Optional[Dict]:
+    """مواقيت مدينة معروفة الإحداثيات بدون أي طلب شبكة."""
+    city_en = CITY_API_NAMES.get((country_ar, city_ar), city_ar)
+    place = CITY_COORDS.get(city_en)
+    if not place or PRAYER_METHOD not in CALCULATION_METHODS:
+        return None
+    lat, lon, tz_name = place
+    return _compute_times_at(lat, lon, tz_name, country_ar, city_ar, city_en)
+
+
+def _compute_times_at(
+    lat: float,
+    lon: float,
+    tz_name: str,
+    country_ar: str,
+    city_ar: str,
+    city_en: Optional[str] = None,
+    day: Optional[date] = None,
+) -> Dict:
+    day = day or _local_date(tz_name)
+    table = get_timetable(day) if city_en else None
+    times = table.lookup(city_en, day) if table else None
+    if times is None:
+        times = compute_prayer_times(lat, lon, tz_name, day)
+        times["hijri"] = hijri_date(day)
+    times.update(
+        {
+            "gregorian": gregorian_readable(day),
+            "timezone": tz_name,
+            "country_ar": country_ar,
+            "city_ar": city_ar,
+            "source": "local",
+        }
+    )
+    return times
+
+
+_background_tasks: set = set()
+
+
+def _spawn(coro):
+    """تشغيل مهمة خلفية مع الاحتفاظ بمرجع لها حتى تنتهي.
+
+    في سياق فارغ: لا ترث تتبع التحديث الذي بدأها (جلب مشترك عبر SingleFlight
+    لا يُنسب لأول تحديث طلبه) ولا _interactive.
+    """
+    task = asyncio.get_running_loop().create_task(coro, context=Context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _crosscheck_with_api(local: Dict, fetch):
+    """يقارن الحساب المحلي مع Aladhan ويسجل أي فرق يتجاوز دقيقة."""
+    remote = await fetch()
+    if not remote:
+        return
+    for key in PRAYER_KEYS:
+        try:
+            h1, m1 = map(int, local[key].split(":")[:2])
+            h2, m2 = map(int, remote[key].split(":")[:2])
+        except Exception:
+            continue
+        if abs((h1 * 60 + m1) - (h2 * 60 + m2)) > 1:
+            logger.warning(
+                f"Local/API mismatch for {local['city_ar']} {key}: "
+                f"{local[key]} vs {remote[key]}"
+            )
+
+
+# ================ جدول سنوي محسوب مسبقًا (NumPy) ================
+# نفس خوارزمية compute_prayer_times لكن على مصفوفات (مدن × أيام) دفعة واحدة.
+# النتيجة: دقائق منذ منتصف الليل (uint16) لكل صلاة، فالبحث مجرد فهرسة.
+NO_TIME = np.uint16(0xFFFF)  # لا يوجد وقت (لا يحدث في مدننا)
+
+
+def _np_fix(a: np.ndarray, b: float) -> np.ndarray:
+    return np.mod(a, b)
+
+
+def _np_sun_position(jd: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    d = jd - 2451545.0
+    g = _np_fix(357.529 + 0.98560028 * d, 360)
+    q = _np_fix(280.459 + 0.98564736 * d, 360)
+    lam = np.radians(_np_fix(q + 1.915 * np.sin(np.radians(g)) + 0.020 * np.sin(np.radians(2 * g)), 360))
+    e = np.radians(23.439 - 0.00000036 * d)
+    ra = np.degrees(np.arctan2(np.cos(e) * np.sin(lam), np.cos(lam))) / 15
+    eqt = q / 15 - _np_fix(ra, 24)
+    decl = np.degrees(np.arcsin(np.sin(e) * np.sin(lam)))
+    return decl, eqt
+
+
+class Timetable:
+    """مواقيت كل المدن المعروفة لكل أيام سنة واحدة."""
+
+    def __init__(
+        self,
+        year: int,
+        method: int,
+        school: int,
+        cities: List[str],
+        minutes: np.ndarray,
+        offsets: np.ndarray,
+        hijri: np.ndarray,
+    ):
+        self.year = year
+        self.method = method
+        self.school = school
+        self.cities = cities
+        self.city_index = {name: i for i, name in enumerate(cities)}
+        self.minutes = minutes  # (مدن، أيام، 5) uint16
+        self.offsets = offsets  # (مدن، أيام) فرق التوقيت بالدقائق int16
+        self.hijri = hijri  # (أيام، 3) يوم/شهر/سنة uint16
+
+    def covers(self, day: date, method: int, school: int) -> bool:
+        return day.year == self.year and method == self.method and school == self.school
+
+    def lookup(self, city_en: str, day: date) -> Optional[Dict]:
+        """أوقات مدينة ليوم معيّن كنصوص HH:MM، أو None إن لم تكن في الجدول."""
+        i = self.city_index.get(city_en)
+        if i is None or day.year != self.year:
+            return None
+        d = day.timetuple().tm_yday - 1
+        row = self.minutes[i, d]
+        times = {}
+        for key, value in zip(PRAYER_KEYS, row.tolist()):
+            times[key] = None if value == NO_TIME else f"{value // 60:02d}:{value % 60:02d}"
+        hday, month, year = self.hijri[d].tolist()
+        times["hijri"] = f"{hday:02d}-{month:02d}-{year}"
+        return times
+
+
+def _timezone_offsets(tz_names: List[str], days: List[date]) -> np.ndarray:
+    """فرق التوقيت (بالدقائق) لكل منطقة زمنية ولكل يوم.
+
+    الفرق يتغير مرتين في السنة على الأكثر تقريبًا، فنقسم المدة نصفين حتى
+    تتساوى الأطراف بدل سؤال pytz عن كل يوم.
+    """
+    per_zone: Dict[str, np.ndarray] = {}
+    for tz_name in set(tz_names):
+        values = np.zeros(len(days), dtype=np.int16)
+        known: Dict[int, int] = {}
+
+        def offset(i: int) -> int:
+            if i not in known:
+                known[i] = int(_utc_offset_hours(tz_name, days[i]) * 60)
+            return known[i]
+
+        stack = [(0, len(days) - 1)]
+        while stack:
+            lo, hi = stack.pop()
+            if offset(lo) == offset(hi) and hi - lo <= 16:
+                values[lo:hi + 1] = known[lo]
+            elif hi - lo <= 1:
+                values[lo], values[hi] = known[lo], known[hi]
+            else:
+                mid = (lo + hi) // 2
+                stack.extend([(lo, mid), (mid, hi)])
+        per_zone[tz_name] = values
+    return np.stack([per_zone[name] for name in tz_names])
+
+
+def compute_year_timetable(year: int, method: int = PRAYER_METHOD, school: int = PRAYER_SCHOOL) -> Timetable:
+    """حساب جدول سنة كاملة لكل مدن CITY_COORDS في تمريرة واحدة."""
+    params = CALCULATION_METHODS[method]
+    cities = list(CITY_COORDS)
+    first = date(year, 1, 1)
+    days = [first + timedelta(days=i) for i in range((date(year + 1, 1, 1) - first).days)]
+
+    lat = np.array([CITY_COORDS[c][0] for c in cities])[:, None]
+    lon = np.array([CITY_COORDS[c][1] for c in cities])[:, None]
+    offsets = _timezone_offsets([CITY_COORDS[c][2] for c in cities], days)
+    hijri = np.array([_hijri_parts(d) for d in days], dtype=np.uint16)
+
+    jdate = (_julian_day(first) + np.arange(len(days)))[None, :] - lon / (15 * 24)
+    sin_lat, cos_lat = np.sin(np.radians(lat)), np.cos(np.radians(lat))
+
+    def mid_day(t: float) -> np.ndarray:
+        return _np_fix(12 - _np_sun_position(jdate + t)[1], 24)
+
+    def sun_angle_time(angle, t: float, ccw: bool = False) -> np.ndarray:
+        decl = np.radians(_np_sun_position(jdate + t)[0])
+        cos_h = (-np.sin(np.radians(angle)) - np.sin(decl) * sin_lat) / (np.cos(decl) * cos_lat)
+        with np.errstate(invalid="ignore"):
+            h = np.degrees(np.arccos(cos_h)) / 15  # NaN خارج [-1, 1]
+        noon = mid_day(t)
+        return noon - h if ccw else noon + h
+
+    def asr_time(factor: int, t: float) -> np.ndarray:
+        decl = _np_sun_position(jdate + t)[0]
+        angle = -np.degrees(np.arctan(1 / (factor + np.tan(np.radians(np.abs(lat - decl))))))
+        return sun_angle_time(angle, t)
+
+    fajr = sun_angle_time(params["fajr"], 5 / 24, ccw=True)
+    sunrise = sun_angle_time(SUNRISE_ANGLE, 6 / 24, ccw=True)
+    dhuhr = mid_day(12 / 24)
+    asr = asr_time(1 + school, 13 / 24)
+    sunset = sun_angle_time(SUNRISE_ANGLE, 18 / 24)
+    isha = sun_angle_time(params.get("isha", 0.0), 18 / 24)
+
+    shift = offsets / 60 - lon / 15
+    fajr, sunrise, dhuhr, asr, sunset, isha = (
+        x + shift for x in (fajr, sunrise, dhuhr, asr, sunset, isha)
+    )
+
+    night = _np_fix(sunrise - sunset, 24)
+    portion = params["fajr"] / 60 * night
+    fajr = np.where(np.isnan(fajr) | (_np_fix(sunrise - fajr, 24) > portion), sunrise - portion, fajr)
+    maghrib = sunset
+    if "isha_minutes" in params:
+        minutes = np.full(len(days), params["isha_minutes"], dtype=float)
+        if method == 4:
+            minutes[hijri[:, 1] == 9] = 120
+        isha = maghrib + minutes[None, :] / 60
+    else:
+        portion = params["isha"] / 60 * night
+        isha = np.where(np.isnan(isha) | (_np_fix(isha - sunset, 24) > portion), sunset + portion, isha)
+
+    stacked = np.stack([fajr, dhuhr, asr, maghrib, isha], axis=-1)
+    t = _np_fix(stacked + 0.5 / 60, 24)
+    hours = np.floor(t)
+    total = hours * 60 + np.floor((t - hours) * 60)
+    minutes_table = np.where(np.isnan(total), NO_TIME, total).astype(np.uint16)
+
+    return Timetable(year, method, school, cities, minutes_table, offsets, hijri)
+
+
+# ================ ملف الجدول الثنائي (mmap) ================
+# الترويسة ثم أسماء المدن ثم المصفوفات كما هي في الذاكرة، فالتحميل مجرد mmap
+# بدون أي تحليل، وكل العمليات (workers) تتشارك نفس الصفحات من الـ page cache.
+TIMETABLE_MAGIC = b"PTT1"
+TIMETABLE_VERSION = 2
+# magic, version, year, method, school, HIJRI_ADJUSTMENT, مدن, أيام, crc
+TIMETABLE_HEADER = struct.Struct("<4sHHHHhHHI")
+
+
+def _timetable_checksum() -> int:
+    """بصمة جدول المدن وتعديل الهجري، فلا نستخدم ملفًا قديمًا بعد تعديل أي منهما
+    (التعديل يغيّر التاريخ الهجري وعشاء رمضان في طريقة أم القرى)."""
+    return zlib.crc32(repr((sorted(CITY_COORDS.items()), HIJRI_ADJUSTMENT)).encode("utf-8"))
+
+
+def timetable_path(year: int, method: int = PRAYER_METHOD, school: int = PRAYER_SCHOOL) -> str:
+    return os.path.join(TIMETABLE_DIR, f"timetable-{year}-m{method}-s{school}.bin")
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def write_timetable(table: Timetable, path: str):
+    names = "\n".join(table.cities).encode("utf-8")
+    header = TIMETABLE_HEADER.pack(
+        TIMETABLE_MAGIC,
+        TIMETABLE_VERSION,
+        table.year,
+        table.method,
+        table.school,
+        HIJRI_ADJUSTMENT,
+        len(table.cities),
+        table.minutes.shape[1],
+        _timetable_checksum(),
+    )
+    head = header + struct.pack("<I", len(names)) + names
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(head + b"\0" * (_align8(len(head)) - len(head)))
+        for array in (table.minutes, table.offsets, table.hijri):
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)  # لا يرى أي worker ملفًا نصف مكتوب
+
+
+def load_timetable(
+    path: str, year: int, method: int = PRAYER_METHOD, school: int = PRAYER_SCHOOL
+) -> Optional[Timetable]:
+    """تحميل الجدول من الملف عبر mmap (قراءة فقط، بدون نسخ).
+
+    None إن لم يوجد الملف، أو كان مقطوعًا/تالفًا، أو بُني لسنة أو إعدادات غير الحالية.
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        header = TIMETABLE_HEADER.unpack_from(mm, 0)
+        n_cities, n_days, crc = header[6:]
+        expected = (TIMETABLE_MAGIC, TIMETABLE_VERSION, year, method, school, HIJRI_ADJUSTMENT)
+        if header[:6] != expected or crc != _timetable_checksum() or n_days != (date(year + 1, 1, 1) - date(year, 1, 1)).days:
+            logger.warning(f"Ignoring stale timetable file {path}")
+            return None
+
+        pos = TIMETABLE_HEADER.size
+        (names_len,) = struct.unpack_from("<I", mm, pos)
+        pos += 4
+        cities = bytes(mm[pos:pos + names_len]).decode("utf-8").split("\n")
+        pos = _align8(pos + names_len)
+        # uint16 × 5 صلوات + int16 إزاحة لكل (مدينة، يوم)، ثم 3 × uint16 هجري لكل يوم
+        if len(cities) != n_cities or len(mm) != pos + n_cities * n_days * 12 + n_days * 6:
+            raise ValueError("size does not match the header")
+
+        minutes = np.frombuffer(mm, dtype=np.uint16, count=n_cities * n_days * 5, offset=pos)
+        pos += minutes.nbytes
+        offsets = np.frombuffer(mm, dtype=np.int16, count=n_cities * n_days, offset=pos)
+        pos += offsets.nbytes
+        hijri = np.frombuffer(mm, dtype=np.uint16, count=n_days * 3, offset=pos)
+    except (struct.error, ValueError) as e:
+        logger.warning(f"Ignoring invalid timetable file {path}: {e}")
+        return None
+
+    return Timetable(
+        year,
+        method,
+        school,
+        cities,
+        minutes.reshape(n_cities, n_days, 5),
+        offsets.reshape(n_cities, n_days),
+        hijri.reshape(n_days, 3),
+    )
+
+
+def build_timetable_files(years: List[int]):
+    """خطوة البناء: كتابة ملف جدول لكل سنة مطلوبة."""
+    for year in years:
+        started = time.perf_counter()
+        path = timetable_path(year)
+        write_timetable(compute_year_timetable(year), path)
+        logger.info(f"Wrote {path} in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+# جدول لكل سنة (الحالية والتالية عادةً)، فجداول الأسبوع/الشهر عبر رأس السنة لا تتبادل الجدولين
+_timetables: Dict[int, Timetable] = {}
+_timetable_lock = threading.Lock()
+MAX_LOADED_TIMETABLES = 2
+
+
+def get_timetable(day: date) -> Optional[Timetable]:
+    """الجدول الذي يغطي هذا اليوم: من الملف إن وُجد، وإلا يُحسب في الذاكرة."""
+    table = _timetables.get(day.year)
+    if table is not None and table.covers(day, PRAYER_METHOD, PRAYER_SCHOOL):
+        return table
+    if PRAYER_METHOD not in CALCULATION_METHODS:
+        return None
+    with _timetable_lock:
+        table = _timetables.get(day.year)
+        if table is None or not table.covers(day, PRAYER_METHOD, PRAYER_SCHOOL):
+            started = time.perf_counter()
+            path = timetable_path(day.year)
+            table = load_timetable(path, day.year)
+            source = path
+            if table is None:
+                table = compute_year_timetable(day.year)
+                source = "memory"
+            _timetables[day.year] = table
+            while len(_timetables) > MAX_LOADED_TIMETABLES:
+                _timetables.pop(min(_timetables))
+            logger.info(
+                f"Loaded {day.year} timetable ({len(table.cities)} cities) from {source} "
+                f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+            )
+        return table
+
+
+# ================ الفهرس المكاني للمدن ================
+EARTH_RADIUS_KM = 6371.0
+
+
+def snap_coords(lat: float, lon: float) -> Tuple[float, float]:
+    """تقريب الإحداثيات لشبكة COORD_GRID_DEG حتى يتشارك الجيران نفس مفتاح الكاش."""
+    return (
+        round(round(lat / COORD_GRID_DEG) * COORD_GRID_DEG, 4),
+        round(round(lon / COORD_GRID_DEG) * COORD_GRID_DEG, 4),
+    )
+
+
+def _unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    la, lo = math.radians(lat), math.radians(lon)
+    return (math.cos(la) * math.cos(lo), math.cos(la) * math.sin(lo), math.sin(la))
+
+
+class CityIndex:
+    """شجرة k-d على متجهات الوحدة (x, y, z) للمدن المعروفة: أقرب مدينة لموقع."""
+
+    def __init__(self, cities: Dict[str, Tuple[float, float, str]]):
+        points = [(_unit_vector(lat, lon), name) for name, (lat, lon, _) in cities.items()]
+        self.root = self._build(points, 0)
+
+    def _build(self, points: List, depth: int):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return (
+            points[mid],
+            axis,
+            self._build(points[:mid], depth + 1),
+            self._build(points[mid + 1:], depth + 1),
+        )
+
+    def nearest(self, lat: float, lon: float) -> Optional[Tuple[str, float]]:
+        """(اسم المدينة، المسافة بالكيلومتر) لأقرب مدينة."""
+        target = _unit_vector(lat, lon)
+        best: List = [None, float("inf")]  # أصغر مربع مسافة وترية
+
+        def visit(node):
+            if node is None:
+                return
+            (point, name), axis, left, right = node
+            d2 = sum((a - b) ** 2 for a, b in zip(point, target))
+            if d2 < best[1]:
+                best[0], best[1] = name, d2
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if diff * diff < best[1]:
+                visit(far)
+
+        visit(self.root)
+        if best[0] is None:
+            return None
+        chord = math.sqrt(best[1])
+        return best[0], 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+city_index = CityIndex(CITY_COORDS)
+
+# الاسم العربي (الدولة، المدينة) لكل مدينة معروفة، لعرض اسم حقيقي للموقع
+CITY_ARABIC_NAMES: Dict[str, Tuple[str, str]] = {}
+for (_country_ar, _city_ar), _city_en in CITY_API_NAMES.items():
+    if _city_ar in COUNTRY_CITIES.get(_country_ar, []):
+        CITY_ARABIC_NAMES.setdefault(_city_en, (_country_ar, _city_ar))
+for _country_ar, _entries in EXTRA_CITIES.items():
+    for _city_ar, _city_en, *_ in _entries:
+        CITY_ARABIC_NAMES.setdefault(_city_en, (_country_ar, _city_ar))
+
+
+def resolve_location(lat: float, lon: float) -> Optional[Tuple[str, str, str]]:
+    """(الدولة، وصف المكان، المنطقة الزمنية) من أقرب مدينة معروفة، أو None إن كانت بعيدة.
+
+    المنطقة الزمنية تقدير فقط: قرب الحدود قد تكون المدينة الأقرب في منطقة أخرى
+    (إيلات وأقرب مدينة لها العقبة، رفح المصرية ورفح غزة).
+    """
+    found = city_index.nearest(lat, lon)
+    if not found or found[1] > NEAREST_CITY_MAX_KM or found[0] not in CITY_ARABIC_NAMES:
+        return None
+    city_en, distance = found
+    country_ar, city_ar = CITY_ARABIC_NAMES[city_en]
+    if distance > 10:
+        city_ar = f"بالقرب من {city_ar}"
+    return country_ar, city_ar, CITY_COORDS[city_en][2]
+
+
+# ================ دليل المدن والبحث التقريبي ================
+ARABIC_DIACRITICS = dict.fromkeys([*range(0x064B, 0x0653), 0x0670, 0x0640], None)  # تشكيل + تطويل
+ARABIC_LETTER_MAP = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي"})
+
+
+def normalize_arabic(text: str) -> str:
+    """توحيد الكتابة: حذف التشكيل والتطويل، توحيد الألف والتاء المربوطة والياء."""
+    text = text.translate(ARABIC_DIACRITICS).translate(ARABIC_LETTER_MAP).lower()
+    return " ".join(text.split())
+
+
+def _strip_article(name: str) -> str:
+    return " ".join(w[2:] if w.startswith("ال") and len(w) > 3 else w for w in name.split())
+
+
+def _trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """فهرس ثلاثيات الحروف لمدن كل دولة (عربي وإنجليزي) للبحث التقريبي محليًا."""
+
+    def __init__(self):
+        # الدولة -> ثلاثية -> أرقام المدخلات، والمدخل = (الاسم المعتمد، ثلاثيات الصيغة، عدد كلماتها)
+        self._postings: Dict[str, Dict[str, List[int]]] = {}
+        self._entries: Dict[str, List[Tuple[str, set, int]]] = {}
+        self._exact: Dict[str, Dict[str, str]] = {}
+
+    def add(self, country_ar: str, canonical: str, spelling: str):
+        postings = self._postings.setdefault(country_ar, {})
+        entries = self._entries.setdefault(country_ar, [])
+        exact = self._exact.setdefault(country_ar, {})
+        for form in {normalize_arabic(spelling), _strip_article(normalize_arabic(spelling))}:
+            exact.setdefault(form, canonical)
+            grams = _trigrams(form)
+            entries.append((canonical, grams, len(form.split())))
+            for gram in grams:
+                postings.setdefault(gram, []).append(len(entries) - 1)
+
+    def _ranked(self, country_ar: str, text: str) -> List[Tuple[str, float, bool]]:
+        """(الاسم المعتمد، درجة التشابه، نفس عدد الكلمات؟) مرتبة، والتطابق بعد التوحيد = 1.0."""
+        query = _strip_article(normalize_arabic(text))
+        exact = self._exact.get(country_ar, {})
+        for form in (normalize_arabic(text), query):
+            if form in exact:
+                return [(exact[form], 1.0, True)]
+
+        entries = self._entries.get(country_ar, [])
+        postings = self._postings.get(country_ar, {})
+        grams = _trigrams(query)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for i in postings.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+
+        words = len(query.split())
+        best: Dict[str, Tuple[float, bool]] = {}
+        for i, common in shared.items():
+            canonical, entry_grams, entry_words = entries[i]
+            score = 2 * common / (len(grams) + len(entry_grams))  # معامل Dice
+            if score > best.get(canonical, (0.0, False))[0]:
+                best[canonical] = (score, entry_words == words)
+        return sorted(((name, score, same) for name, (score, same) in best.items()), key=lambda item: -item[1])
+
+    def match(self, country_ar: str, text: str, limit: int = 3) -> List[Tuple[str, float]]:
+        """أفضل المدن المطابقة مع درجة التشابه (1.0 = تطابق بعد التوحيد)."""
+        ranked = self._ranked(country_ar, text)
+        return [(name, score) for name, score, _ in ranked if score >= GAZETTEER_SUGGEST_SCORE][:limit]
+
+    def correct(self, country_ar: str, text: str) -> Optional[str]:
+        """المدينة التي نصحح إليها الاسم تلقائيًا، أو None (نقترح فقط).
+
+        فوق GAZETTEER_ACCEPT_SCORE ولصيغة بنفس عدد الكلمات: "مدينة حمد" تشبه
+        "المدينة" في ثلاثياتها لكنها مدينة أخرى.
+        """
+        ranked = self._ranked(country_ar, text)
+        if ranked and ranked[0][1] >= GAZETTEER_ACCEPT_SCORE and ranked[0][2]:
+            return ranked[0][0]
+        return None
+
+
+def build_gazetteer() -> Gazetteer:
+    gazetteer = Gazetteer()
+    for (country_ar, city_ar), city_en in CITY_API_NAMES.items():
+        # الاسم المعتمد هو اسم القائمة إن وُجد (عمّان بدل عمان مثلًا)
+        canonical = CITY_ARABIC_NAMES.get(city_en, (country_ar, city_ar))
+        canonical_city = canonical[1] if canonical[0] == country_ar else city_ar
+        gazetteer.add(country_ar, canonical_city, city_ar)
+        gazetteer.add(country_ar, canonical_city, city_en)
+    return gazetteer
+
+
+gazetteer = build_gazetteer()
+
+
+# ================ المقاييس ================
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metrics:
+    """سجل مقاييس بصيغة Prometheus النصية: عدادات، هيستوجرامات، وقيم تُقرأ عند الطلب.
+
+    كل التحديثات من حلقة asyncio نفسها، فلا حاجة لأقفال. الوسوم (labels)
+    tuple من أزواج (اسم، قيمة) ويجب أن تبقى قليلة التنوع.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._meta: Dict[str, Tuple[str, str]] = {}  # الاسم -> (النوع، الوصف)
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List[float]] = {}  # عدّ كل خانة + المجموع في الآخر
+        self._collectors: List = []
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None):
+        self._meta[name] = (kind, help_text)
+        if buckets:
+            self._buckets[name] = buckets
+
+    def add_collector(self, collect):
+        """collect() تعيد (الاسم، النوع، الوصف، الوسوم، القيمة) لكل قيمة لحظية."""
+        self._collectors.append(collect)
+
+    def inc(self, name: str, labels: Tuple = (), value: float = 1.0):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Tuple = ()):
+        buckets = self._buckets.get(name, self.BUCKETS)
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def render(self) -> str:
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), value in self._counters.items():
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in self._histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self._buckets.get(name, self.BUCKETS) + (None,), histogram):
+                cumulative += count
+                le = "+Inf" if bound is None else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        for collect in self._collectors:
+            for name, kind, help_text, labels, value in collect():
+                self._meta.setdefault(name, (kind, help_text))
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+
+        out = []
+        for name in sorted(samples):
+            kind, help_text = self._meta.get(name, ("untyped", ""))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("prayer_bot_handler_seconds", "histogram", "Handler latency in seconds.")
+metrics.describe("prayer_bot_handler_errors_total", "counter", "Handlers that raised.")
+metrics.describe("prayer_bot_upstream_seconds", "histogram", "Aladhan request latency in seconds.")
+metrics.describe("prayer_bot_upstream_requests_total", "counter", "Aladhan requests by outcome.")
+metrics.describe("prayer_bot_alert_lag_seconds", "histogram", "Delay between prayer time and alert delivery.")
+metrics.describe("prayer_bot_updates_received_total", "counter", "Webhook updates received.")
+
+
+def track_latency(handler):
+    """يسجّل زمن الـ handler (وأخطاءه) في prayer_bot_handler_seconds."""
+    labels = (("handler", handler.__name__),)
+    span_name = f"handler:{handler.__name__}"
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
+        try:
+            with span(span_name):
+                return await handler(update, context)
+        except Exception:
+            metrics.inc("prayer_bot_handler_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("prayer_bot_handler_seconds", time.perf_counter() - started, labels)
+
+    return wrapper
+
+
+class SamplingProfiler:
+    """بروفايلر بالعينات: خيط جانبي يقرأ مكدس خيط الحلقة كل interval ثانية.
+
+    الناتج بصيغة collapsed stacks (دالة;دالة;... العدد) الجاهزة لأدوات flamegraph،
+    وتكلفته صفر حين لا يعمل.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._running = threading.Lock()
+
+    def sample(self, thread_id: int, seconds: float) -> str:
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("profiler is already running")
+        try:
+            counts: Dict[str, int] = {}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+                time.sleep(self.interval)
+            ranked = sorted(counts.items(), key=lambda item: -item[1])
+            return "\n".join(f"{stack} {count}" for stack, count in ranked) + "\n"
+        finally:
+            self._running.release()
+
+
+profiler = SamplingProfiler(PROFILER_INTERVAL)
+
+
+# ================ تتبّع التحديثات ================
+class Trace:
+    """مراحل تحديث واحد (spans) بأزمنة نسبية من لحظة استلامه."""
+
+    __slots__ = ("update_id", "started", "spans")
+
+    def __init__(self, update_id: Optional[int], started: float):
+        self.update_id = update_id
+        self.started = started  # time.monotonic() لحظة الاستلام
+        self.spans: List[Tuple[str, float, float, int]] = []  # (الاسم، البداية، المدة، العمق)
+
+    def add(self, name: str, start: float, duration: float, depth: int = 0):
+        self.spans.append((name, start - self.started, duration, depth))
+
+    def summary(self) -> str:
+        spans = sorted(self.spans, key=lambda item: item[1])
+        return ", ".join(f"{'>' * depth}{name}={duration * 1000:.1f}ms" for name, _, duration, depth in spans)
+
+    def to_dict(self, duration: float) -> Dict:
+        return {
+            "update_id": self.update_id,
+            "started_at": round(time.time() - (time.monotonic() - self.started), 3),
+            "duration_ms": round(duration * 1000, 2),
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 2), "duration_ms": round(d * 1000, 2), "depth": depth}
+                for name, start, d, depth in sorted(self.spans, key=lambda item: item[1])
+            ],
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start", "depth", "token")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        self.depth = _span_depth.get()
+        self.token = _span_depth.set(self.depth + 1)
+        return self
+
+    def __exit__(self, *exc_info):
+        _span_depth.reset(self.token)
+        self.trace.add(self.name, self.start, time.monotonic() - self.start, self.depth)
+        return False
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+# العمق في ContextVar لا في Trace: المهام الفرعية المتزامنة لنفس التحديث لكل منها نسختها
+_span_depth: ContextVar[int] = ContextVar("span_depth", default=0)
+_NO_SPAN = nullcontext()
+
+
+def span(name: str):
+    """with span("اسم"): يسجّل زمن المرحلة في تتبع التحديث الحالي.
+
+    خارج تحديث مُتتبَّع (أو مع TRACE_SAMPLE_RATE=0) يكلّف قراءة ContextVar فقط.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+class Tracer:
+    """يختار عينة من التحديثات، ويسجّل تفصيل كل تحديث أبطأ من slow_ms (وفي ملف JSONL إن وُجد)."""
+
+    def __init__(self, sample_rate: float, slow_ms: float, path: str):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_ms / 1000
+        self.path = path
+        self._log: Optional[logging.Logger] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self.sampled = 0
+        self.slow = 0
+
+    def begin(self, update_id: Optional[int], received_at: float) -> Optional[Trace]:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        self.sampled += 1
+        return Trace(update_id, received_at)
+
+    def finish(self, trace: Trace):
+        duration = time.monotonic() - trace.started
+        if duration < self.slow_seconds:
+            return
+        self.slow += 1
+        logger.warning(f"Slow update {trace.update_id}: {duration * 1000:.0f} ms [{trace.summary()}]")
+        if self.path:
+            self._trace_log().info(json.dumps(trace.to_dict(duration), ensure_ascii=False))
+
+    def _trace_log(self) -> logging.Logger:
+        """لوج ملف JSONL: الحلقة تضع السطر في طابور فقط، وخيط QueueListener يكتب للملف."""
+        if self._log is None:
+            file_handler = logging.FileHandler(self.path, encoding="utf-8", delay=True)
+            file_handler.setFormatter(logging.Formatter("%(message)s"))
+            queue: SimpleQueue = SimpleQueue()
+            self._listener = logging.handlers.QueueListener(queue, file_handler)
+            self._listener.start()
+            self._log = logging.getLogger(f"{__name__}.traces")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            self._log.addHandler(logging.handlers.QueueHandler(queue))
+        return self._log
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()  # يكتب ما بقي في الطابور
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+
+tracer = Tracer(TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_FILE)
+
+
+class TracedRequest(HTTPXRequest):
+    """طلبات Bot API كمراحل في التتبع (telegram:sendMessage...). تُستخدم فقط حين يكون التتبع مفعّلًا."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with span("telegram:" + url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+# ================ عميل HTTP لـ Aladhan ================
+class CircuitBreaker:
+    """بعد عدد من الإخفاقات المتتالية نتوقف عن الطلب لفترة ونفشل فورًا."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        # half-open: بعد انتهاء المهلة نسمح بطلب تجريبي واحد
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Aladhan circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        return "closed" if self.opened_at is None else "open"
+
+
+class AladhanClient:
+    """عميل httpx غير متزامن مشترك (keep-alive) مع حد للتزامن، إعادة محاولة بتأخير عشوائي، وقاطع دائرة."""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.breaker = CircuitBreaker(ALADHAN_BREAKER_THRESHOLD, ALADHAN_BREAKER_COOLDOWN)
+        self._metrics: Dict[str, Dict[str, float]] = {}
+        self.pending = 0  # طلبات جارية أو تنتظر مكانًا
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # يُنشأ داخل حلقة asyncio الفعلية عند أول استخدام
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=ALADHAN_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=ALADHAN_MAX_CONCURRENCY,
+                    max_keepalive_connections=ALADHAN_MAX_CONCURRENCY,
+                ),
+            )
+            self._slots = asyncio.Semaphore(ALADHAN_MAX_CONCURRENCY)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _record(self, endpoint: str, seconds: float, ok: bool):
+        # calendarByCity/2026/10 -> calendarByCity، حتى لا يتفرع كل شهر لمقياس مستقل
+        endpoint = endpoint.split("/", 1)[0]
+        labels = (("endpoint", endpoint),)
+        metrics.observe("prayer_bot_upstream_seconds", seconds, labels)
+        metrics.inc("prayer_bot_upstream_requests_total", labels + (("outcome", "ok" if ok else "error"),))
+        m = self._metrics.setdefault(
+            endpoint, {"requests": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        m["requests"] += 1
+        m["total_seconds"] += seconds
+        m["max_seconds"] = max(m["max_seconds"], seconds)
+        if not ok:
+            m["errors"] += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {endpoint: dict(m) for endpoint, m in self._metrics.items()}
+
+    def _backoff(self, attempt: int, resp: Optional[httpx.Response]) -> float:
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), ALADHAN_TIMEOUT)
+        return random.uniform(0, min(8.0, 0.5 * 2 ** attempt))  # full jitter
+
+    async def get(self, endpoint: str, params: Dict) -> Optional[Dict]:
+        """طلب GET يعيد JSON أو None بعد استنفاد المحاولات."""
+        if not self.breaker.allow():
+            logger.warning(f"Aladhan circuit open, skipping {endpoint}")
+            return None
+
+        self.pending += 1
+        try:
+            with span("aladhan:" + endpoint.split("/", 1)[0]):
+                return await self._get(endpoint, params)
+        finally:
+            self.pending -= 1
+
+    async def _get(self, endpoint: str, params: Dict) -> Optional[Dict]:
+        client = self.client
+        url = f"{self.base_url}/{endpoint}"
+        for attempt in range(ALADHAN_RETRIES):
+            resp = None
+            started = time.perf_counter()
+            try:
+                async with self._slots:
+                    resp = await client.get(url, params=params)
+                if resp.status_code not in self.RETRY_STATUSES:
+                    resp.raise_for_status()
+                    data = resp.json()
+                    self._record(endpoint, time.perf_counter() - started, True)
+                    self.breaker.record_success()
+                    return data
+                logger.warning(f"Aladhan {endpoint} returned {resp.status_code} (attempt {attempt + 1})")
+            except httpx.HTTPStatusError as e:
+                # خطأ من طرفنا (مدينة غير معروفة مثلًا)، لا فائدة من الإعادة
+                logger.warning(f"Aladhan {endpoint} rejected request: {e}")
+                self._record(endpoint, time.perf_counter() - started, False)
+                return None
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"Aladhan {endpoint} failed (attempt {attempt + 1}): {e}")
+            self._record(endpoint, time.perf_counter() - started, False)
+            if attempt + 1 < ALADHAN_RETRIES:
+                await asyncio.sleep(self._backoff(attempt, resp))
+
+        self.breaker.record_failure()
+        return None
+
+
+aladhan = AladhanClient(ALADHAN_BASE_URL)
+
+
+# ================ استدعاء API ================
+async def _fetch_prayer_times(country_ar: str, city_ar: str) -> Optional[Dict]:
+    """عن طريق الدولة / المدينة (طلب مباشر بدون كاش)."""
+    country_en = COUNTRY_API_NAMES.get(country_ar, country_ar)
+    city_en = CITY_API_NAMES.get((country_ar, city_ar), city_ar)
+
+    try:
+        params = {
+            "city": city_en,
+            "country": country_en,
+            "method": PRAYER_METHOD,
+            "school": PRAYER_SCHOOL,
+        }
+        data = await aladhan.get("timingsByCity", params)
+        if not data:
+            return None
+        if data.get("code") != 200:
+            logger.warning(f"API error: {data}")
+            return None
+
+        timings = data["data"]["timings"]
+        date_info = data["data"]["date"]
+        gregorian = date_info["readable"]
+        hijri = date_info["hijri"]["date"]
+        meta = data["data"]["meta"]
+        timezone = meta["timezone"]
+
+        return {
+            "Fajr": timings.get("Fajr"),
+            "Dhuhr": timings.get("Dhuhr"),
+            "Asr": timings.get("Asr"),
+            "Maghrib": timings.get("Maghrib"),
+            "Isha": timings.get("Isha"),
+            "gregorian": gregorian,
+            "hijri": hijri,
+            "timezone": timezone,
+            "country_ar": country_ar,
+            "city_ar": city_ar,
+            "source": "api",
+            # إحداثيات المدينة كما حددها Aladhan، لنحسب محليًا إن تعذّر الطلب لاحقًا
+            "coords": [meta.get("latitude"), meta.get("longitude")],
+        }
+    except Exception as e:
+        logger.exception(f"Error fetching prayer times by city: {e}")
+        return None
+
+
+async def _fetch_prayer_times_by_coords(lat: float, lon: float) -> Optional[Dict]:
+    """عن طريق الإحداثيات (GPS) (طلب مباشر بدون كاش)."""
+    try:
+        params = {
+            "latitude": lat,
+            "longitude": lon,
+            "method": PRAYER_METHOD,
+            "school": PRAYER_SCHOOL,
+        }
+        data = await aladhan.get("timings", params)
+        if not data:
+            return None
+        if data.get("code") != 200:
+            logger.warning(f"API error: {data}")
+            return None
+
+        timings = data["data"]["timings"]
+        date_info = data["data"]["date"]
+        gregorian = date_info["readable"]
+        hijri = date_info["hijri"]["date"]
+        timezone = data["data"]["meta"]["timezone"]
+
+        # لا نعرف المدينة بالضبط، فنكتب وصف عام
+        country_ar = "حسب موقعك"
+        city_ar = "موقعك الحالي"
+
+        return {
+            "Fajr": timings.get("Fajr"),
+            "Dhuhr": timings.get("Dhuhr"),
+            "Asr": timings.get("Asr"),
+            "Maghrib": timings.get("Maghrib"),
+            "Isha": timings.get("Isha"),
+            "gregorian": gregorian,
+            "hijri": hijri,
+            "timezone": timezone,
+            "country_ar": country_ar,
+            "city_ar": city_ar,
+            "source": "api",
+        }
+    except Exception as e:
+        logger.exception(f"Error fetching prayer times by coords: {e}")
+        return None
+
+
+async def _fetch_prayer_calendar(place: Dict, year: int, month: int) -> Optional[Dict[date, Dict]]:
+    """شهر كامل بطلب واحد (calendarByCity / calendar): التاريخ -> مواقيت اليوم."""
+    if place.get("lat") is not None:
+        lat, lon = snap_coords(place["lat"], place["lon"])
+        endpoint = f"calendar/{year}/{month}"
+        params = {"latitude": lat, "longitude": lon}
+    else:
+        endpoint = f"calendarByCity/{year}/{month}"
+        params = {
+            "city": CITY_API_NAMES.get((place["country"], place["city"]), place["city"]),
+            "country": COUNTRY_API_NAMES.get(place["country"], place["country"]),
+        }
+    params.update({"method": PRAYER_METHOD, "school": PRAYER_SCHOOL})
+
+    try:
+        data = await aladhan.get(endpoint, params)
+        if not data:
+            return None
+        if data.get("code") != 200:
+            logger.warning(f"API error: {data}")
+            return None
+
+        month_times = {}
+        for entry in data["data"]:
+            timings = entry["timings"]
+            date_info = entry["date"]
+            # أوقات التقويم تأتي بصيغة "04:12 (EET)"
+            times = {key: (timings.get(key) or "").split(" ")[0] or None for key in PRAYER_KEYS}
+            times.update(
+                {
+                    "gregorian": date_info["readable"],
+                    "hijri": date_info["hijri"]["date"],
+                    "timezone": entry["meta"]["timezone"],
+                    "source": "api",
+                }
+            )
+            month_times[datetime.strptime(date_info["gregorian"]["date"], "%d-%m-%Y").date()] = times
+        return month_times
+    except Exception as e:
+        logger.exception(f"Error fetching prayer calendar: {e}")
+        return None
+
+
+# ================ كاش المواقيت ================
+class PrayerTimesCache:
+    """كاش LRU محدود الحجم، كل مدخل ينتهي عند منتصف الليل بتوقيت المدينة."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key: Tuple) -> Optional[Dict]:
+        """مثل get لكن بدون تحديث الترتيب أو العدادات (للاستخدام الداخلي)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def record_miss(self):
+        """مفتاح لا نعرف منطقته الزمنية بعد، فهو غير موجود حتمًا."""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key: Tuple, times: Dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, times)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
+
+
+prayer_cache = PrayerTimesCache(PRAYER_CACHE_SIZE)
+
+# آخر منطقة زمنية عرفناها لكل مدينة/موقع، لنحسب "اليوم المحلي" قبل الطلب
+_timezone_hints: Dict[Tuple, str] = {}
+
+# آخر مواقيت جاءت من Aladhan لكل مفتاح: (اليوم المحلي، المواقيت)، بديل حين يتعذّر الطلب
+_last_good: "OrderedDict[Tuple, Tuple[date, Dict]]" = OrderedDict()
+
+
+def _remember_good(base_key: Tuple, day: date, times: Dict):
+    _last_good[base_key] = (day, times)
+    _last_good.move_to_end(base_key)
+    while len(_last_good) > PRAYER_CACHE_SIZE:
+        _last_good.popitem(last=False)
+
+
+def _stale_times(base_key: Tuple, day: date) -> Optional[Dict]:
+    """آخر مواقيت صحيحة للمفتاح ليوم day، أو None.
+
+    من يوم سابق: نعيد الحساب محليًا عند إحداثيات Aladhan للمدينة إن أمكن،
+    وإلا نعيدها كما هي معلّمة stale (الفرق بين يومين دقيقة أو اثنتان).
+    """
+    entry = _last_good.get(base_key)
+    if entry is None:
+        return None
+    good_day, times = entry
+    if good_day == day:
+        # خرجت من الكاش فقط (LRU)، وما زالت صالحة
+        prayer_cache.put(base_key + (day,), times, _next_local_midnight(times["timezone"], day))
+        return times
+    lat, lon = times.get("coords") or (None, None)
+    if lat is not None and lon is not None and PRAYER_METHOD in CALCULATION_METHODS:
+        metrics.inc("prayer_bot_stale_served_total", (("kind", "recomputed"),))
+        return _compute_times_at(lat, lon, times["timezone"], times["country_ar"], times["city_ar"], day=day)
+    metrics.inc("prayer_bot_stale_served_total", (("kind", "previous_day"),))
+    return dict(times, stale=True)
+
+
+# المنطقة -> (بداية، نهاية، تاريخ) آخر يوم محلي سُئل عنه، فمعظم الاستدعاءات مقارنتان فقط
+_zone_days: Dict[str, Tuple[float, float, date]] = {}
+
+
+def _local_date(tz_name: str, at: Optional[float] = None) -> date:
+    """التاريخ المحلي الآن (أو عند اللحظة at)."""
+    if at is None:
+        at = time.time()
+    bounds = _zone_days.get(tz_name)
+    if bounds is None or not bounds[0] <= at < bounds[1]:
+        day = datetime.fromtimestamp(at, _tz(tz_name)).date()
+        bounds = _zone_days[tz_name] = _day_bounds(tz_name, day) + (day,)
+    return bounds[2]
+
+
+def _next_local_midnight(tz_name: str, day: date) -> float:
+    """لحظة انتهاء اليوم المحلي (epoch) في المنطقة الزمنية المعطاة."""
+    return _day_bounds(tz_name, day)[1]
+
+
+class SingleFlight:
+    """طلبات متزامنة بنفس المفتاح تنتظر تنفيذًا واحدًا وتتشارك نتيجته."""
+
+    def __init__(self):
+        self._calls: Dict[Tuple, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def pending(self, key: Tuple) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Tuple, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except BaseException:
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result
+
+
+lookup_flights = SingleFlight()
+metrics.describe("prayer_bot_stale_served_total", "counter", "Lookups answered from the last known good times.")
+
+
+async def _within_deadline(flight_key: Tuple, fn):
+    """lookup_flights.do، لكن طلب المستخدم لا ينتظر أكثر من LOOKUP_DEADLINE.
+
+    عند انتهاء المهلة يرفع Overloaded("deadline") ويكمل الطلب في الخلفية،
+    فالمحاولة التالية تجد النتيجة في الكاش.
+    """
+    if not _interactive.get():
+        return await lookup_flights.do(flight_key, fn)
+    task = _spawn(lookup_flights.do(flight_key, fn))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), LOOKUP_DEADLINE)
+    except asyncio.TimeoutError:
+        raise Overloaded("deadline") from None
+
+
+def _times_day(times: Dict) -> Optional[date]:
+    """التاريخ الذي تخص المواقيت (حقل gregorian، بنفس الصيغة للحساب المحلي و Aladhan)."""
+    try:
+        return datetime.strptime(times["gregorian"], "%d %b %Y").date()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+async def _cached_lookup(base_key: Tuple, fetch) -> Optional[Dict]:
+    """يبحث في الكاش بمفتاح (base_key + التاريخ المحلي) وإلا يستدعي fetch.
+
+    عند عدم الوجود يمر الطلب عبر SingleFlight، فعشرات الطلبات المتزامنة لنفس
+    المدينة/اليوم تنتج طلبًا واحدًا فقط لـ Aladhan أو للحساب المحلي.
+
+    إن كانت لدينا مواقيت سابقة من Aladhan للمفتاح، يأخذها طلب المستخدم فورًا
+    (stale-while-revalidate) ويُحدَّث الكاش في الخلفية. وإن فشل الطلب نعود إليها أيضًا.
+    """
+    tz_name = _timezone_hints.get(base_key)
+    day = _local_date(tz_name) if tz_name else None
+    if day:
+        times = prayer_cache.get(base_key + (day,))
+        if times is not None:
+            return times
+    else:
+        prayer_cache.record_miss()
+    flight_key = base_key + (day,)
+
+    async def fetch_and_store() -> Optional[Dict]:
+        # ربما أنهى طلب سابق الجلب بين عدم وجودها في الكاش وبدء هذا الطلب (مهمة منفصلة
+        # في _within_deadline)، وعندها عرفنا المنطقة الزمنية حتى لمفتاح كان باردًا
+        hint = _timezone_hints.get(base_key)
+        if hint and (times := prayer_cache.peek(base_key + (_local_date(hint),))) is not None:
+            return times
+        if day and WORKERS > 1:
+            # ربما جلبها عامل آخر من Aladhan اليوم
+            times = await asyncio.to_thread(user_states.store.load_times, repr(flight_key))
+            if times:
+                prayer_cache.put(flight_key, times, _next_local_midnight(times["timezone"], day))
+                _remember_good(base_key, day, times)
+                return times
+
+        times = await fetch()
+        if not times:
+            return None
+
+        tz = times["timezone"]
+        _timezone_hints[base_key] = tz
+        # تاريخ المواقيت نفسها: طلب عبر منتصف الليل المحلي يعيد مواقيت أمس، فلا تُخزَّن باسم اليوم
+        local_day = _times_day(times) or _local_date(tz)
+        expires_at = _next_local_midnight(tz, local_day)
+        prayer_cache.put(base_key + (local_day,), times, expires_at)
+        if times.get("source") == "api":
+            # الحساب المحلي لا يفشل، فنحتفظ بنتائج Aladhan فقط
+            _remember_good(base_key, local_day, times)
+            if WORKERS > 1:
+                # والحساب المحلي أرخص من قراءة المخزن، فنشاركها هي فقط بين العمال
+                _spawn(asyncio.to_thread(user_states.store.save_times, repr(base_key + (local_day,)), times, expires_at))
+        return times
+
+    try:
+        load_shedder.check(base_key, flight_key)
+    except Overloaded:
+        stale = _stale_times(base_key, day) if day else None
+        if stale is None:
+            raise
+        return stale
+
+    if day and _interactive.get() and base_key in _last_good:
+        if not lookup_flights.pending(flight_key):
+            _spawn(lookup_flights.do(flight_key, fetch_and_store))
+        return _stale_times(base_key, day)
+
+    times = await _within_deadline(flight_key, fetch_and_store)
+    if times is None and day:
+        return _stale_times(base_key, day)
+    return times
+
+
+async def _city_times(country_ar: str, city_ar: str) -> Optional[Dict]:
+    """الحساب المحلي أولًا، و Aladhan فقط للمدن غير المعروفة."""
+    times = _compute_city_times(country_ar, city_ar)
+    if times is None:
+        return await _fetch_prayer_times(country_ar, city_ar)
+    if PRAYER_API_CROSSCHECK:
+        _spawn(_crosscheck_with_api(times, lambda: _fetch_prayer_times(country_ar, city_ar)))
+    return times
+
+
+def _lookup_key(place: Dict) -> Tuple:
+    """مفتاح الكاش (بدون التاريخ) لمكان محفوظ، بنفس صيغة get_prayer_times*."""
+    if place.get("lat") is not None:
+        return ("coords",) + snap_coords(place["lat"], place["lon"]) + (PRAYER_METHOD, PRAYER_SCHOOL)
+    return ("city", place["country"], place["city"], PRAYER_METHOD, PRAYER_SCHOOL)
+
+
+def _needs_upstream(base_key: Tuple) -> bool:
+    """هل يحتاج مفتاح _lookup_key طلبًا لـ Aladhan إن لم يكن في الكاش؟"""
+    if PRAYER_METHOD not in CALCULATION_METHODS:
+        return True
+    if base_key[0] == "coords":
+        return base_key not in _timezone_hints
+    return CITY_API_NAMES.get((base_key[1], base_key[2]), base_key[2]) not in CITY_COORDS
+
+
+async def get_prayer_times(country_ar: str, city_ar: str) -> Optional[Dict]:
+    """عن طريق الدولة / المدينة، مع كاش حتى منتصف الليل المحلي."""
+    base_key = _lookup_key({"country": country_ar, "city": city_ar})
+    place = CITY_COORDS.get(CITY_API_NAMES.get((country_ar, city_ar), city_ar))
+    if place:
+        _timezone_hints.setdefault(base_key, place[2])
+    with span("lookup"):
+        return await _cached_lookup(base_key, lambda: _city_times(country_ar, city_ar))
+
+
+async def get_prayer_times_by_coords(lat: float, lon: float) -> Optional[Dict]:
+    """عن طريق الإحداثيات، مقرّبة لشبكة COORD_GRID_DEG لتتشارك الكاش.
+
+    المنطقة الزمنية للمربع من Aladhan (meta.timezone) في أول طلب، ثم نحسب محليًا.
+    المدينة القريبة تعطي الاسم فقط، ومنطقتها بديل إن تعذّر Aladhan في ذلك الطلب الأول.
+    """
+    lat, lon = snap_coords(lat, lon)
+    base_key = _lookup_key({"lat": lat, "lon": lon})
+    nearby = resolve_location(lat, lon)
+    country_ar, city_ar = nearby[:2] if nearby else ("حسب موقعك", "موقعك الحالي")
+
+    async def fetch() -> Optional[Dict]:
+        # المنطقة الزمنية معروفة من طلب سابق لنفس المربع؟ نحسب محليًا
+        tz_name = _timezone_hints.get(base_key)
+        if tz_name and PRAYER_METHOD in CALCULATION_METHODS:
+            return _compute_times_at(lat, lon, tz_name, country_ar, city_ar)
+        times = await _fetch_prayer_times_by_coords(lat, lon)
+        if times and nearby:
+            times.update({"country_ar": country_ar, "city_ar": city_ar})
+        return times
+
+    with span("lookup"):
+        times = await _cached_lookup(base_key, fetch)
+    if times is None and nearby and PRAYER_METHOD in CALCULATION_METHODS:
+        # Aladhan غير متاح ولا نعرف منطقة المربع بعد: منطقة المدينة القريبة أفضل من لا شيء،
+        # بدون كاش ولا تلميح حتى يصحّحها الطلب التالي
+        times = _compute_times_at(lat, lon, nearby[2], country_ar, city_ar)
+    return times
+
+
+def _local_place_times(place: Dict, today: Dict, day: date) -> Optional[Dict]:
+    """أوقات يوم آخر للمكان بالحساب المحلي، بنفس شكل نتيجة اليوم، أو None."""
+    if PRAYER_METHOD not in CALCULATION_METHODS:
+        return None
+    tz_name = today["timezone"]
+    if place.get("lat") is not None:
+        lat, lon = snap_coords(place["lat"], place["lon"])
+        return _compute_times_at(lat, lon, tz_name, today["country_ar"], today["city_ar"], day=day)
+    city_en = CITY_API_NAMES.get((place["country"], place["city"]), place["city"])
+    coords = CITY_COORDS.get(city_en)
+    if not coords:
+        return None
+    return _compute_times_at(coords[0], coords[1], tz_name, today["country_ar"], today["city_ar"], city_en, day)
+
+
+async def get_prayer_calendar(place: Dict, days: int) -> Optional[List[Dict]]:
+    """مواقيت days يومًا بدءًا من اليوم المحلي للمكان.
+
+    كل يوم يُحفظ في نفس كاش get_prayer_times بمفتاح تاريخه، فجدول شهر واحد
+    يملأ الكاش لثلاثين يومًا قادمة (ولانتقال التنبيهات لليوم التالي). الأيام
+    الناقصة تُحسب محليًا، وإلا تُطلب بطلب تقويم واحد لكل شهر ميلادي.
+    """
+    today = await get_place_times(place)
+    if not today:
+        return None
+    base_key = _lookup_key(place)
+    tz_name = today["timezone"]
+    start = _local_date(tz_name)
+
+    # مواقيت يوم سابق (stale) لا تصلح سطرًا أول في الجدول، فيُملأ كبقية الأيام
+    calendar: List[Optional[Dict]] = [None if today.get("stale") else today]
+    for offset in range(1, days):
+        day = start + timedelta(days=offset)
+        times = prayer_cache.peek(base_key + (day,))
+        if times is None:
+            times = _local_place_times(place, today, day)
+            if times is not None:
+                prayer_cache.put(base_key + (day,), times, _next_local_midnight(tz_name, day))
+        calendar.append(times)
+
+    missing_months = sorted(
+        {(start + timedelta(days=i)).timetuple()[:2] for i, times in enumerate(calendar) if times is None}
+    )
+    for year, month in missing_months:
+        load_shedder.check(None, base_key + ("calendar", year, month))
+        month_times = await _within_deadline(
+            base_key + ("calendar", year, month),
+            lambda: _fetch_prayer_calendar(place, year, month),
+        )
+        if not month_times:
+            return None
+        for day, times in month_times.items():
+            times.update({"country_ar": today["country_ar"], "city_ar": today["city_ar"]})
+            prayer_cache.put(base_key + (day,), times, _next_local_midnight(tz_name, day))
+        for i, times in enumerate(calendar):
+            day = start + timedelta(days=i)
+            if times is None and day in month_times:
+                calendar[i] = month_times[day]
+
+    return calendar if all(calendar) else None
+
+
+# ================ تنسيق الرسالة ================
+def format_prayer_message(country_ar: str, city_ar: str, times: Dict) -> str:
+    # نفس المدينة ونفس اليوم = نفس النص لكل المستخدمين، فنحفظه بدل إعادة التنسيق
+    with span("render"):
+        return _render_prayer_message(
+            country_ar,
+            city_ar,
+            times["gregorian"],
+            times["hijri"],
+            times["Fajr"],
+            times["Dhuhr"],
+            times["Asr"],
+            times["Maghrib"],
+            times["Isha"],
+            times.get("stale", False),
+        )
+
+
+@functools.lru_cache(maxsize=PRAYER_CACHE_SIZE)
+def _render_prayer_message(
+    country_ar: str,
+    city_ar: str,
+    gregorian: str,
+    hijri: str,
+    fajr: str,
+    dhuhr: str,
+    asr: str,
+    maghrib: str,
+    isha: str,
+    stale: bool = False,
+) -> str:
+    note = "⚠️ تعذّر تحديث المواقيت الآن، هذه مواقيت آخر يوم متاح (الفرق عادة دقيقة أو اثنتان).\n\n" if stale else ""
+    return (
+        f"🕌 *مواقيت الصلاة اليوم*\n"
+        f"📍 *المدينة:* {city_ar}\n"
+        f"🌍 *الدولة:* {country_ar}\n\n"
+        f"📅 *التاريخ الميلادي:* {gregorian}\n"
+        f"🗓 *التاريخ الهجري:* {hijri}\n\n"
+        f"الفجر: {fajr}\n"
+        f"الظهر: {dhuhr}\n"
+        f"العصر: {asr}\n"
+        f"المغرب: {maghrib}\n"
+        f"العشاء: {isha}\n\n"
+        f"{note}"
+        f"🤍 نسأل الله أن يتقبّل منّا ومنكم."
+    )
+
+
+def format_calendar_message(country_ar: str, city_ar: str, calendar: List[Dict]) -> str:
+    rows = []
+    for times in calendar:
+        day = datetime.strptime(times["gregorian"], "%d %b %Y")
+        row = " ".join(times[key] or "--:--" for key in PRAYER_KEYS)
+        rows.append(f"{day:%d/%m}  {row}")
+    period = "هذا الأسبوع" if len(calendar) == 7 else f"{len(calendar)} يومًا"
+    return (
+        f"🗓 *مواقيت الصلاة لـ {period}*\n"
+        f"📍 *المدينة:* {city_ar}\n"
+        f"🌍 *الدولة:* {country_ar}\n"
+        f"🗓 *بداية الجدول هجريًا:* {calendar[0]['hijri']}\n\n"
+        f"الترتيب: الفجر، الظهر، العصر، المغرب، العشاء\n"
+        f"```\n" + "\n".join(rows) + "\n```"
+    )
+
+
+# ================ تخزين حالة المستخدمين ================
+# الحقول التي تبقى بعد إعادة التشغيل (الباقي مثل selected_country مؤقت)
+PERSISTED_FIELDS = ("saved_country", "saved_city", "saved_lat", "saved_lon", "alerts_on")
+
+
+class UserStore(ABC):
+    """واجهة التخزين: تحميل مستخدم واحد، وكتابة دفعة من المستخدمين.
+
+    مخزن ينقصه أحد الدوال المجردة يفشل عند إنشائه، لا عند أول حفظ.
+    """
+
+    @abstractmethod
+    def load(self, user_id: int) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def save_many(self, rows: List[Tuple[int, Dict]]):
+        ...
+
+    @abstractmethod
+    def load_subscriptions(self) -> Dict[int, Dict]:
+        """كل اشتراكات التنبيهات: chat_id -> المكان."""
+
+    @abstractmethod
+    def save_subscription(self, chat_id: int, place: Dict):
+        ...
+
+    @abstractmethod
+    def delete_subscription(self, chat_id: int):
+        ...
+
+    def load_times(self, key: str) -> Optional[Dict]:
+        """مواقيت جلبها عامل آخر (وضع WORKERS > 1)، أو None إن لم يدعمها المخزن."""
+        return None
+
+    def save_times(self, key: str, times: Dict, expires_at: float):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryUserStore(UserStore):
+    """للتجارب فقط: لا يبقى شيء بعد إعادة التشغيل."""
+
+    def __init__(self, location: str = ""):
+        self._rows: Dict[int, Dict] = {}
+        self._subscriptions: Dict[int, Dict] = {}
+
+    def load(self, user_id: int) -> Optional[Dict]:
+        row = self._rows.get(user_id)
+        return dict(row) if row else None
+
+    def save_many(self, rows: List[Tuple[int, Dict]]):
+        for user_id, state in rows:
+            self._rows[user_id] = dict(state)
+
+    def load_subscriptions(self) -> Dict[int, Dict]:
+        return dict(self._subscriptions)
+
+    def save_subscription(self, chat_id: int, place: Dict):
+        self._subscriptions[chat_id] = dict(place)
+
+    def delete_subscription(self, chat_id: int):
+        self._subscriptions.pop(chat_id, None)
+
+
+class SQLiteUserStore(UserStore):
+    """صف واحد لكل مستخدم في SQLite بوضع WAL (قرّاء متعددون مع كاتب واحد)."""
+
+    def __init__(self, location: str):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(location, timeout=10, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                country TEXT,
+                city TEXT,
+                lat REAL,
+                lon REAL,
+                alerts_on INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS alert_subscriptions (
+                chat_id INTEGER PRIMARY KEY,
+                country TEXT,
+                city TEXT,
+                lat REAL,
+                lon REAL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shared_times (
+                key TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL,
+                times TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def load(self, user_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT country, city, lat, lon, alerts_on FROM users WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        country, city, lat, lon, alerts_on = row
+        return {
+            "saved_country": country,
+            "saved_city": city,
+            "saved_lat": lat,
+            "saved_lon": lon,
+            "alerts_on": bool(alerts_on),
+        }
+
+    def save_many(self, rows: List[Tuple[int, Dict]]):
+        now = int(time.time())
+        params = [
+            (
+                user_id,
+                state.get("saved_country"),
+                state.get("saved_city"),
+                state.get("saved_lat"),
+                state.get("saved_lon"),
+                int(bool(state.get("alerts_on"))),
+                now,
+            )
+            for user_id, state in rows
+        ]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users "
+                "(user_id, country, city, lat, lon, alerts_on, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                params,
+            )
+            self.conn.commit()
+
+    def load_subscriptions(self) -> Dict[int, Dict]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT chat_id, country, city, lat, lon FROM alert_subscriptions"
+            ).fetchall()
+        return {
+            chat_id: {"country": country, "city": city, "lat": lat, "lon": lon}
+            for chat_id, country, city, lat, lon in rows
+        }
+
+    def save_subscription(self, chat_id: int, place: Dict):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO alert_subscriptions (chat_id, country, city, lat, lon) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (chat_id, place.get("country"), place.get("city"), place.get("lat"), place.get("lon")),
+            )
+            self.conn.commit()
+
+    def delete_subscription(self, chat_id: int):
+        with self._lock:
+            self.conn.execute("DELETE FROM alert_subscriptions WHERE chat_id = ?", (chat_id,))
+            self.conn.commit()
+
+    def load_times(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT times FROM shared_times WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_times(self, key: str, times: Dict, expires_at: float):
+        with self._lock:
+            self.conn.execute("DELETE FROM shared_times WHERE expires_at <= ?", (time.time(),))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO shared_times (key, expires_at, times) VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(times, ensure_ascii=False)),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+USER_STORE_BACKENDS: Dict[str, Type[UserStore]] = {
+    "sqlite": SQLiteUserStore,
+    "memory": MemoryUserStore,
+}
+
+
+def open_user_store(url: str) -> UserStore:
+    scheme, _, location = url.partition("://")
+    backend = USER_STORE_BACKENDS.get(scheme)
+    if backend is None:
+        raise ValueError(f"Unknown USER_STORE_URL scheme: {scheme}")
+    if scheme == "sqlite":
+        # مثل SQLAlchemy: sqlite:///relative.db و sqlite:////absolute/path.db
+        location = location[1:]
+    return backend(location)
+
+
+class UserStateManager:
+    """تحميل كسول لكل مستخدم عند أول تحديث، وكتابة مجمّعة في الخلفية."""
+
+    def __init__(self, url: str, flush_interval: float):
+        self.url = url
+        self.flush_interval = flush_interval
+        self._store: Optional[UserStore] = None
+        self._loaded: Dict[int, Dict] = {}  # user_id -> user_data الحي (نفس كائن PTB)
+        self._dirty: Dict[int, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def open(self) -> UserStore:
+        """المخزن يُفتح في start (post_init) أو عند أول استخدام، لا عند الاستيراد:
+        فلا يُنشأ ملف SQLite بمجرد import ولا يسبق فتحُه ربط البورت."""
+        if self._store is None:
+            self._store = open_user_store(self.url)
+        return self._store
+
+    @property
+    def store(self) -> UserStore:
+        return self.open()
+
+    async def ensure_loaded(self, user_id: int, user_data: Dict):
+        if user_id in self._loaded:
+            return
+        self._loaded[user_id] = user_data
+        # تعديل لم يُكتب بعد (من set_fields) أحدث مما في المخزن
+        state = self._dirty.get(user_id) or await asyncio.to_thread(self.store.load, user_id)
+        if state:
+            for key, value in state.items():
+                user_data.setdefault(key, value)
+
+    @staticmethod
+    def snapshot(user_data: Dict) -> Dict:
+        return {key: user_data.get(key) for key in PERSISTED_FIELDS}
+
+    def mark_dirty(self, user_id: int, state: Dict):
+        self._dirty[user_id] = state
+
+    async def set_fields(self, user_id: int, **fields):
+        """تعديل حالة مستخدم من خارج الـ handlers (مثل إيقاف تنبيهاته بعد حظره للبوت)."""
+        user_data = self._loaded.get(user_id)
+        if user_data is None:
+            state = self._dirty.get(user_id) or await asyncio.to_thread(self.store.load, user_id)
+            user_data = self._loaded.get(user_id, state)  # ربما حمّله handler أثناء الانتظار
+            if user_data is None:
+                return
+        user_data.update(fields)
+        self.mark_dirty(user_id, self.snapshot(user_data))
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = list(self._dirty.items()), {}
+        try:
+            await asyncio.to_thread(self.store.save_many, batch)
+        except Exception:
+            logger.exception(f"Failed to persist {len(batch)} user states")
+            for user_id, state in batch:
+                self._dirty.setdefault(user_id, state)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        self.open()
+        self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+        if self._store is not None:
+            self._store.close()
+
+
+user_states = UserStateManager(USER_STORE_URL, USER_STORE_FLUSH_INTERVAL)
+
+
+def with_user_state(handler):
+    """يحمّل حالة المستخدم المحفوظة قبل الـ handler ويسجّل أي تغيير بعده."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None:
+            return await handler(update, context)
+        user_data = context.user_data
+        with span("user_state"):
+            await user_states.ensure_loaded(user.id, user_data)
+        before = user_states.snapshot(user_data)
+        try:
+            return await handler(update, context)
+        finally:
+            after = user_states.snapshot(user_data)
+            if after != before:
+                user_states.mark_dirty(user.id, after)
+            place = place_from_user_data(user_data)
+            if place:
+                prefetcher.touch(place)
+
+    return wrapper
+
+
+# ================ تنبيهات الأذان ================
+# (رقم هذا العامل، عدد العمال)؛ يضبطه run_worker
+WORKER_SHARD: Tuple[int, int] = (0, 1)
+
+
+def owns_chat(chat_id: int) -> bool:
+    index, count = WORKER_SHARD
+    return chat_id % count == index
+
+
+PRAYER_LABELS_AR = {
+    "Fajr": "الفجر",
+    "Dhuhr": "الظهر",
+    "Asr": "العصر",
+    "Maghrib": "المغرب",
+    "Isha": "العشاء",
+}
+
+
+def place_from_user_data(user_data: Dict) -> Optional[Dict]:
+    """المكان المحفوظ للمستخدم (إحداثيات أو دولة/مدينة) أو None."""
+    if user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None:
+        return {"country": None, "city": None, "lat": user_data["saved_lat"], "lon": user_data["saved_lon"]}
+    if user_data.get("saved_country") and user_data.get("saved_city"):
+        return {"country": user_data["saved_country"], "city": user_data["saved_city"], "lat": None, "lon": None}
+    return None
+
+
+def _place_key(place: Dict) -> Tuple:
+    if place.get("lat") is not None:
+        return ("coords",) + snap_coords(place["lat"], place["lon"])
+    return ("city", place["country"], place["city"])
+
+
+async def get_place_times(place: Dict) -> Optional[Dict]:
+    if place.get("lat") is not None:
+        return await get_prayer_times_by_coords(place["lat"], place["lon"])
+    return await get_prayer_times(place["country"], place["city"])
+
+
+@functools.lru_cache(maxsize=PRAYER_CACHE_SIZE * 2)
+def _day_instants(tz_name: str, day: date, day_times: Tuple[Optional[str], ...]) -> Tuple[Tuple[float, str], ...]:
+    """لحظات (epoch) صلوات يوم بالترتيب. تُحسب مرة لكل (منطقة، يوم، أوقات)، أي مرة
+    لكل مدينة في اليوم مهما كان عدد مشتركيها أو مرات تفعيلهم للتنبيهات."""
+    instants = []
+    for key, t_str in zip(PRAYER_KEYS, day_times):
+        try:
+            hour, minute = map(int, t_str.split(":")[:2])
+        except Exception:
+            continue
+        instants.append((_local_instant(tz_name, day, hour, minute), key))
+    return tuple(instants)
+
+
+async def next_prayer_alert(place: Dict, after: float) -> Optional[Tuple[float, str]]:
+    """أقرب صلاة بعد اللحظة after: (epoch، مفتاح الصلاة)، وتنتقل لفجر الغد تلقائيًا."""
+    times = await get_place_times(place)
+    if not times:
+        return None
+    tz_name = times["timezone"]
+    today = _local_date(tz_name, after)
+
+    for day, day_times in ((today, times), (today + timedelta(days=1), None)):
+        if day_times is None:
+            # الغد من الكاش إن جلبه جدول أسبوع/شهر، وإلا بالحساب المحلي ونحفظه في
+            # الكاش لطلبات الغد. لمدينة غير معروفة محليًا أوقات اليوم تقريب كافٍ
+            # للغد (فرق دقيقة تقريبًا)، وبعد الفجر نعيد الحساب من البيانات الفعلية
+            cache_key = _lookup_key(place) + (day,)
+            day_times = prayer_cache.peek(cache_key)
+            if day_times is None:
+                day_times = _local_place_times(place, times, day)
+                if day_times is not None:
+                    prayer_cache.put(cache_key, day_times, _next_local_midnight(tz_name, day))
+                else:
+                    day_times = times
+        for instant, prayer in _day_instants(tz_name, day, tuple(day_times.get(key) for key in PRAYER_KEYS)):
+            if instant > after:
+                return instant, prayer
+    return None
+
+
+class TokenBucket:
+    """دلو رموز: rate رمز/ثانية بحد أقصى capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AlertSender:
+    """إرسال جماعي يحترم حدود تيليجرام.
+
+    كل دفعة (مكان، صلاة، دقيقة) لها طابور، ونأخذ من الطوابير بالتناوب حتى لا
+    تؤخر مدينة كبيرة تنبيهات مدينة صغيرة. دلو رموز عام، رسالة/ثانية لكل
+    محادثة، وعند RetryAfter يتوقف الإرسال كله للمدة المطلوبة.
+    """
+
+    def __init__(self, rate: float, per_chat_interval: float, max_in_flight: int):
+        self.bucket = TokenBucket(rate, rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_in_flight = max_in_flight
+        self._queues: "OrderedDict[Tuple, deque]" = OrderedDict()
+        self._last_sent: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._pending: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self.bot = None
+        self.on_forbidden = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def start(self, bot, on_forbidden):
+        self.bot = bot
+        self.on_forbidden = on_forbidden
+        self._pending = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def enqueue(self, batch_key: Tuple, chat_ids, text: str, fire_at: float):
+        queue = self._queues.setdefault(batch_key, deque())
+        queue.extend((chat_id, text, fire_at) for chat_id in chat_ids)
+        self._pending.set()
+
+    def _next_message(self) -> Optional[Tuple[int, str, float]]:
+        """رسالة من أول طابور في الدور ثم ننقله لآخر الدور (round-robin)."""
+        now = time.monotonic()
+        for _ in range(len(self._queues)):
+            batch_key, queue = next(iter(self._queues.items()))
+            self._queues.move_to_end(batch_key)
+            for _ in range(len(queue)):
+                item = queue.popleft()
+                if now - self._last_sent.get(item[0], 0.0) >= self.per_chat_interval:
+                    if not queue:
+                        del self._queues[batch_key]
+                    return item
+                queue.append(item)  # هذه المحادثة استلمت رسالة للتو
+        return None
+
+    async def _run(self):
+        while True:
+            if not self._queues:
+                self._pending.clear()
+                await self._pending.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            item = self._next_message()
+            if item is None:
+                await asyncio.sleep(self.per_chat_interval / 4)
+                continue
+            await self.bucket.acquire()
+            await self._slots.acquire()
+            self._last_sent[item[0]] = time.monotonic()
+            _spawn(self._deliver(*item))
+
+    async def _deliver(self, chat_id: int, text: str, fire_at: float):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+            lag = time.time() - fire_at
+            metrics.observe("prayer_bot_alert_lag_seconds", lag)
+            self.sent += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            logger.warning(f"Telegram asked to slow down for {retry_after}s")
+            self.retried += 1
+            self._paused_until = time.monotonic() + retry_after
+            self.enqueue(("retry",), [chat_id], text, fire_at)
+        except Forbidden:
+            # المستخدم حظر البوت: لا فائدة من الاستمرار
+            logger.info(f"Chat {chat_id} blocked the bot, dropping its alerts")
+            self.failed += 1
+            await self.on_forbidden(chat_id)
+        except TelegramError as e:
+            logger.warning(f"Alert to chat {chat_id} failed: {e}")
+            self.failed += 1
+        finally:
+            self._slots.release()
+            if len(self._last_sent) > 10 * self.max_in_flight:
+                cutoff = time.monotonic() - self.per_chat_interval
+                self._last_sent = {c: t for c, t in self._last_sent.items() if t > cutoff}
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self.queue_depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "lag_avg_seconds": (self.lag_total / self.sent) if self.sent else 0.0,
+            "lag_max_seconds": self.lag_max,
+        }
+
+
+class AlertScheduler:
+    """جدولة ذاتية التجديد لتنبيهات الأذان.
+
+    الاشتراكات محفوظة في المخزن، والمشتركون مجمّعون حسب المكان (مدينة أو
+    مربع إحداثيات). في الكومة مدخل واحد لكل مكان نشط هو صلاته القادمة، فعند
+    حلول الوقت تُرسل دفعة واحدة لكل مشتركي المكان عبر AlertSender، ثم تُحسب
+    الصلاة التالية (وفجر الغد بعد العشاء) في مهمة خلفية تعيدها للكومة، فمدينة
+    تنتظر Aladhan لا تؤخر تنبيهات بقية الأماكن. seq المكان = 0 أثناء ذلك.
+
+    الفهرس chat_id -> مفتاح المكان يجعل الإلغاء وإعادة الجدولة O(1)، والحذف
+    من الكومة كسول: المدخل يبقى حتى يصل لرأس الكومة فيُتجاهل إن لم يعد رقمه
+    (seq) هو الرقم الحالي لمكانه، ونعيد بناء الكومة إن زادت المدخلات الميتة.
+    """
+
+    def __init__(self, store: Optional[UserStore], sender: AlertSender):
+        self.store = store  # None = مخزن user_states، يُؤخذ في start
+        self.sender = sender
+        self.subscriptions: Dict[int, Dict] = {}
+        self._chat_place: Dict[int, Tuple] = {}  # chat_id -> مفتاح المكان
+        self.places: Dict[Tuple, Dict] = {}  # مفتاح المكان -> {"place", "members", "seq"}
+        self._heap: List[Tuple[float, int, Tuple, Optional[str]]] = []  # (وقت، seq، مكان، صلاة)
+        self._seq = 0
+        self._stale = 0
+        self.upstream_reschedules = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_size(self) -> int:
+        """عدد المدخلات الحية في الكومة (مكان نشط واحد لكل مدخل)."""
+        return len(self._heap) - self._stale
+
+    def stats(self) -> Dict:
+        return {
+            "subscriptions": len(self.subscriptions),
+            "places": len(self.places),
+            "queue_size": self.queue_size,
+            "heap_size": len(self._heap),
+            "stale_entries": self._stale,
+            "upstream_reschedules": self.upstream_reschedules,
+        }
+
+    def _push(self, key: Tuple, fire_at: float, prayer: str):
+        self._seq += 1
+        self.places[key]["seq"] = self._seq
+        heapq.heappush(self._heap, (fire_at, self._seq, key, prayer))
+
+    def _is_live(self, entry: Tuple[float, int, Tuple, str]) -> bool:
+        group = self.places.get(entry[2])
+        return group is not None and group["seq"] == entry[1]
+
+    def _drop_place(self, key: Tuple):
+        # مدخل المكان في الكومة (إن وُجد؛ seq = 0 أثناء _reschedule) صار ميتًا، يُتجاهل عند وصوله للرأس
+        if self.places.pop(key)["seq"]:
+            self._stale += 1
+        if self._stale > 64 and self._stale > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    async def start(self, bot):
+        if self.store is None:
+            self.store = user_states.store
+        self._wakeup = asyncio.Event()
+        self.sender.start(bot, self._on_forbidden)
+        started = time.perf_counter()
+        stored = await asyncio.to_thread(self.store.load_subscriptions)
+        # مع عدة عمال: لكل عامل اشتراكات محادثاته فقط (نفس توزيع التحديثات)
+        self.subscriptions = {chat_id: place for chat_id, place in stored.items() if owns_chat(chat_id)}
+
+        for chat_id, place in self.subscriptions.items():
+            key = _place_key(place)
+            self._chat_place[chat_id] = key
+            group = self.places.setdefault(key, {"place": place, "members": set(), "seq": 0})
+            group["members"].add(chat_id)
+
+        # الصلاة القادمة تُحسب مرة واحدة لكل مكان: المحلية الآن، وما يحتاج Aladhan
+        # في الخلفية حتى لا تنتظره الاستعادة ولا أول ردود البوت
+        now = time.time()
+        remote = []
+        for key, group in list(self.places.items()):
+            if not _computed_locally(group["place"]):
+                remote.append((key, group))
+                continue
+            upcoming = await next_prayer_alert(group["place"], now) or (now + ALERT_RETRY_SECONDS, None)
+            self._seq += 1
+            group["seq"] = self._seq
+            self._heap.append((upcoming[0], self._seq, key, upcoming[1]))
+        heapq.heapify(self._heap)
+
+        logger.info(
+            f"Restored {len(self.subscriptions)} alert subscriptions in {len(self.places)} places "
+            f"({len(remote)} resolving in the background) in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        for key, group in remote:
+            _spawn(self._reschedule(key, group, now))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.sender.stop()
+
+    def _leave_place(self, chat_id: int):
+        key = self._chat_place.pop(chat_id, None)
+        group = self.places.get(key) if key is not None else None
+        if group is None:
+            return
+        group["members"].discard(chat_id)
+        if not group["members"]:
+            self._drop_place(key)
+
+    async def subscribe(self, chat_id: int, place: Dict) -> bool:
+        key = _place_key(place)
+        if self._chat_place.get(chat_id) == key:
+            return True
+
+        # من الكاش غالبًا؛ نحسبه قبل أي تعديل حتى يبقى التعديل نفسه بلا await
+        upcoming = await next_prayer_alert(place, time.time())
+        if key not in self.places and not upcoming:
+            return False
+
+        self._leave_place(chat_id)
+        self.subscriptions[chat_id] = place
+        self._chat_place[chat_id] = key
+        group = self.places.get(key)
+        if group is None:
+            group = self.places[key] = {"place": place, "members": set(), "seq": 0}
+            self._push(key, *upcoming)
+            if self._wakeup:
+                self._wakeup.set()
+        group["members"].add(chat_id)
+
+        await asyncio.to_thread(self.store.save_subscription, chat_id, place)
+        return True
+
+    async def unsubscribe(self, chat_id: int):
+        self._leave_place(chat_id)
+        if self.subscriptions.pop(chat_id, None) is not None:
+            await asyncio.to_thread(self.store.delete_subscription, chat_id)
+
+    async def _on_forbidden(self, chat_id: int):
+        # المستخدم حظر البوت: حالته المحفوظة أيضًا، وإلا بقي الزر "مفعّلًا" بلا اشتراك
+        await self.unsubscribe(chat_id)
+        await user_states.set_fields(chat_id, alerts_on=False)
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+            else:
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            self._wakeup.clear()
+
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if not self._is_live(entry):
+                    self._stale -= 1
+                    continue
+                fire_at, _, key, prayer = entry
+                group = self.places[key]
+                group["seq"] = 0  # لا مدخل للمكان في الكومة حتى ينتهي _reschedule
+                if prayer is not None:
+                    self.sender.enqueue(
+                        (key, prayer, int(fire_at // 60)),
+                        list(group["members"]),
+                        f"🕌 حان الآن وقت صلاة *{PRAYER_LABELS_AR[prayer]}*.\n\nتقبّل الله طاعتكم 🤍",
+                        fire_at,
+                    )
+                _spawn(self._reschedule(key, group, max(fire_at, now)))
+
+    async def _reschedule(self, key: Tuple, group: Dict, after: float):
+        """الصلاة التالية للمكان بعد after، ثم إعادته للكومة (خارج حلقة الإرسال)."""
+        base_key = _lookup_key(group["place"])
+        tz_name = _timezone_hints.get(base_key)
+        if _needs_upstream(base_key) and not (tz_name and prayer_cache.peek(base_key + (_local_date(tz_name, after),))):
+            self.upstream_reschedules += 1  # لم يسخّنه NextDayPrefetcher: هذا المكان وحده ينتظر
+        try:
+            upcoming = await next_prayer_alert(group["place"], after)
+        except Exception:
+            logger.exception(f"Could not compute next alert for {key}")
+            upcoming = None
+        if self.places.get(key) is not group or group["seq"]:
+            return  # أُلغي آخر مشترك أثناء الحساب
+        # تعذّر الحساب (Aladhan متوقف مثلًا): نعيد المحاولة بعد دقائق بدون إرسال
+        self._push(key, *(upcoming or (time.time() + ALERT_RETRY_SECONDS, None)))
+        self._wakeup.set()
+
+
+alert_scheduler = AlertScheduler(
+    None,
+    AlertSender(ALERT_GLOBAL_RATE, ALERT_PER_CHAT_INTERVAL, ALERT_MAX_IN_FLIGHT),
+)
+
+
+async def clear_saved_place(chat_id: int, user_data: Dict):
+    """مسح المكان المحفوظ. الاشتراك يُلغى حتى لا تصل تنبيهات المكان القديم، و alerts_on
+    يبقى فينقله refresh_alerts للمكان الجديد عند اختياره."""
+    for field in ("saved_country", "saved_city", "saved_lat", "saved_lon"):
+        user_data.pop(field, None)
+    await alert_scheduler.unsubscribe(chat_id)
+
+
+async def refresh_alerts(chat_id: int, user_data: Dict):
+    """بعد تغيير المدينة/الموقع: نقل الاشتراك للمكان الجديد إن كانت التنبيهات مفعّلة."""
+    place = place_from_user_data(user_data)
+    if user_data.get("alerts_on") and place:
+        if not await alert_scheduler.subscribe(chat_id, place):
+            user_data["alerts_on"] = False
+
+
+# ================ التحميل المسبق لمواقيت الغد ================
+def _computed_locally(place: Dict) -> bool:
+    """هل تُحسب مواقيت المكان بدون شبكة؟ (نفس شروط get_prayer_times*)"""
+    return not _needs_upstream(_lookup_key(place))
+
+
+class NextDayPrefetcher:
+    """يملأ الكاش بمواقيت الغد قبل منتصف الليل المحلي لكل منطقة زمنية.
+
+    الأماكن المعنية: مشتركو التنبيهات + أماكن من استخدموا البوت خلال آخر
+    PREFETCH_ACTIVE_DAYS يومًا. الحساب المحلي فوري، أما الأماكن التي تحتاج
+    Aladhan فتُوزَّع طلباتها على نصف المهلة المتبقية حتى لا نصطدم بحد الطلبات،
+    وطلب التقويم الشهري يغطي بقية الشهر أيضًا.
+
+    هو تحسين فقط: مكان فاته التسخين يجلبه AlertScheduler._reschedule في الخلفية
+    بعد منتصف الليل، فيتأخر تنبيه ذلك المكان وحده (upstream_reschedules).
+    """
+
+    MAX_SPACING = 5.0  # ثوانٍ بين طلبين، حتى لا ينتظر مكان وحيد نصف ساعة
+
+    def __init__(self, lead_seconds: float, active_seconds: float):
+        self.lead_seconds = lead_seconds
+        self.active_seconds = active_seconds
+        self._active: Dict[Tuple, Tuple[Dict, float]] = {}  # مفتاح المكان -> (المكان، آخر استخدام)
+        self._done: set = set()  # (المنطقة الزمنية، تاريخ الغد) المنجزة
+        self._task: Optional[asyncio.Task] = None
+        self.zones_warmed = 0
+        self.places_warmed = 0
+        self.remote_fetches = 0
+        self.failures = 0
+
+    def touch(self, place: Dict):
+        self._active[_place_key(place)] = (place, time.time())
+
+    def stats(self) -> Dict:
+        return {
+            "active_places": len(self._active),
+            "zones_warmed": self.zones_warmed,
+            "places_warmed": self.places_warmed,
+            "remote_fetches": self.remote_fetches,
+            "failures": self.failures,
+        }
+
+    def _places_by_timezone(self) -> Dict[str, List[Dict]]:
+        cutoff = time.time() - self.active_seconds
+        for key in [key for key, (_, seen) in self._active.items() if seen < cutoff]:
+            del self._active[key]
+
+        places = {key: place for key, (place, _) in self._active.items()}
+        for key, group in alert_scheduler.places.items():
+            places.setdefault(key, group["place"])
+
+        zones: Dict[str, List[Dict]] = {}
+        for place in places.values():
+            # منطقة زمنية غير معروفة = لم يُطلب المكان بعد، فلا يوجد ما نسخّنه
+            tz_name = _timezone_hints.get(_lookup_key(place))
+            if tz_name:
+                zones.setdefault(tz_name, []).append(place)
+        return zones
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PREFETCH_CHECK_INTERVAL)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Prefetch check failed")
+
+    def check(self):
+        """يبدأ التسخين لكل منطقة زمنية دخلت مهلة ما قبل منتصف الليل."""
+        now = time.time()
+        for tz_name, places in self._places_by_timezone().items():
+            today = _local_date(tz_name)
+            remaining = _next_local_midnight(tz_name, today) - now
+            marker = (tz_name, today + timedelta(days=1))
+            if remaining > self.lead_seconds or marker in self._done:
+                continue
+            self._done.add(marker)
+            _spawn(self._warm_zone(tz_name, places, marker[1], remaining))
+        if len(self._done) > 1024:
+            yesterday = datetime.fromtimestamp(now, pytz.UTC).date() - timedelta(days=1)
+            self._done = {marker for marker in self._done if marker[1] >= yesterday}
+
+    async def _warm_zone(self, tz_name: str, places: List[Dict], tomorrow: date, remaining: float):
+        started = time.perf_counter()
+        # المحلي أولًا (بلا شبكة)، ثم طلبات Aladhan موزعة على نصف المهلة
+        ordered = sorted(((not _computed_locally(place), place) for place in places), key=lambda item: item[0])
+        remote = sum(1 for is_remote, _ in ordered if is_remote)
+        spacing = min(remaining / 2 / remote, self.MAX_SPACING) if remote else 0.0
+        for is_remote, place in ordered:
+            if prayer_cache.peek(_lookup_key(place) + (tomorrow,)) is not None:
+                continue  # جاء مع جدول شهري سابق
+            try:
+                calendar = await get_prayer_calendar(place, 2)
+            except Exception:
+                logger.exception(f"Prefetch failed for {_place_key(place)}")
+                calendar = None
+            if calendar:
+                self.places_warmed += 1
+            else:
+                self.failures += 1
+            if is_remote:
+                self.remote_fetches += 1
+                await asyncio.sleep(spacing)
+            else:
+                await asyncio.sleep(0)
+        self.zones_warmed += 1
+        logger.info(
+            f"Prefetched {tomorrow} for {len(places)} places in {tz_name} "
+            f"({remote} remote) in {time.perf_counter() - started:.1f} s"
+        )
+
+
+prefetcher = NextDayPrefetcher(PREFETCH_LEAD_SECONDS, PREFETCH_ACTIVE_DAYS * 86400)
+
+
+# ================ حماية من الإغراق ================
+class Overloaded(Exception):
+    """طلب مستخدم لا نستطيع خدمته الآن بدون انتظار Aladhan.
+
+    reason: "overload" (ضغط عالٍ) أو "deadline" (تجاوز LOOKUP_DEADLINE).
+    """
+
+    def __init__(self, reason: str = "overload"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# True داخل handlers المستخدمين فقط؛ التنبيهات والتحميل المسبق لا تُرفض
+_interactive: ContextVar[bool] = ContextVar("interactive", default=False)
+
+
+class ChatRateLimiter:
+    """دلو رموز لكل محادثة. الدلو الممتلئ = محادثة جديدة، فنحذف الأقدم عند تجاوز MAX_CHATS."""
+
+    MAX_CHATS = 50000
+
+    def __init__(self, per_minute: float, burst: float):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._warned: set = set()
+
+    def allow(self, chat_id: int) -> bool:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.MAX_CHATS:
+                old_chat, _ = self._buckets.popitem(last=False)
+                self._warned.discard(old_chat)
+        self._buckets.move_to_end(chat_id)
+        if bucket.try_acquire():
+            self._warned.discard(chat_id)
+            return True
+        return False
+
+    def first_rejection(self, chat_id: int) -> bool:
+        """نرد على أول طلب مرفوض فقط، لا على كل رسالة في سيل متكرر."""
+        if chat_id in self._warned:
+            return False
+        self._warned.add(chat_id)
+        return True
+
+
+class LoadShedder:
+    """يقرر متى نرفض طلبات Aladhan الجديدة النابعة من المستخدمين."""
+
+    def __init__(self, queue_ratio: float, upstream_pending: int):
+        self.queue_ratio = queue_ratio
+        self.upstream_pending = upstream_pending
+
+    def overloaded(self) -> bool:
+        return (
+            ingestor.depth >= ingestor.max_queue * self.queue_ratio
+            or aladhan.pending >= self.upstream_pending
+            or aladhan.breaker.state == "open"
+        )
+
+    def check(self, base_key: Optional[Tuple], flight_key: Tuple):
+        """يرفع Overloaded إن كان الطلب سيبدأ طلب Aladhan جديدًا أثناء الضغط.
+
+        الطلب الذي يلحق بطلب جارٍ لنفس المفتاح لا يكلّف شيئًا فيُسمح به.
+        """
+        if not _interactive.get() or lookup_flights.pending(flight_key):
+            return
+        if base_key is not None and not _needs_upstream(base_key):
+            return
+        if self.overloaded():
+            raise Overloaded()
+
+
+chat_limiter = ChatRateLimiter(CHAT_RATE_PER_MINUTE, CHAT_RATE_BURST)
+load_shedder = LoadShedder(SHED_QUEUE_RATIO, SHED_UPSTREAM_PENDING)
+metrics.describe("prayer_bot_shed_total", "counter", "User requests refused by reason (chat_rate, overload, deadline).")
+
+
+async def _reply_busy(update: Update, text: str):
+    if update.callback_query:
+        await update.callback_query.answer(text)
+    elif update.effective_message:
+        await update.effective_message.reply_text(text)
+
+
+def with_rate_limit(handler):
+    """حد الطلبات لكل محادثة، ورد "حاول لاحقًا" بدل طلب Aladhan جديد أثناء الضغط."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        if chat is not None and not chat_limiter.allow(chat.id):
+            metrics.inc("prayer_bot_shed_total", (("reason", "chat_rate"),))
+            if update.callback_query or chat_limiter.first_rejection(chat.id):
+                await _reply_busy(update, "⏳ طلبات كثيرة متتالية، انتظر قليلًا ثم حاول مرة أخرى.")
+            return None
+        token = _interactive.set(True)
+        try:
+            return await handler(update, context)
+        except Overloaded as e:
+            metrics.inc("prayer_bot_shed_total", (("reason", e.reason),))
+            await _reply_busy(update, "⏳ الخدمة مشغولة الآن، حاول مرة أخرى بعد دقيقة.")
+            return None
+        finally:
+            _interactive.reset(token)
+
+    return wrapper
+
+
+# ================ Handlers ================
+async def send_country_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = (
+        "اختَر الدولة أولًا من القائمة التالية، ثم اختر مدينتك للحصول على مواقيت الصلاة.\n\n"
+        "بعد اختيار المدينة سيتم تثبيتها تلقائيًا لك."
+    )
+
+    if update.message:
+        await update.message.reply_text(
+            text,
+            reply_markup=build_countries_keyboard(),
+        )
+    else:
+        query = update.callback_query
+        await query.answer()
+        await query.edit_message_text(
+            text,
+            reply_markup=build_countries_keyboard(),
+        )
+
+
+async def send_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE, days: int):
+    """جدول مواقيت عدة أيام للمكان المحفوظ (أسبوع أو شهر)."""
+    place = place_from_user_data(context.user_data)
+    if place is None:
+        # لم يتم تعيين مدينة بعد
+        await send_country_menu(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+    with span("calendar"):
+        calendar = await get_prayer_calendar(place, days)
+    if update.callback_query:
+        await update.callback_query.answer()
+    if not calendar:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ لم أستطع جلب جدول المواقيت الآن.\nحاول مرة أخرى لاحقًا.",
+        )
+        return
+
+    msg = format_calendar_message(calendar[0]["country_ar"], calendar[0]["city_ar"], calendar)
+    keyboard = LOCATION_TIMES_KEYBOARD if place.get("lat") is not None else TIMES_KEYBOARD
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=msg,
+        parse_mode="Markdown",
+        reply_markup=keyboard,
+    )
+
+
+@track_latency
+@with_rate_limit
+@with_user_state
+async def week_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_calendar(update, context, 7)
+
+
+@track_latency
+@with_rate_limit
+@with_user_state
+async def month_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_calendar(update, context, 30)
+
+
+@track_latency
+@with_user_state
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    welcome = (
+        "👋 أهلًا بك.\n\n"
+        "اكتب *السلام عليكم* أو استخدم الأزرار بالأسفل:\n"
+        "• مواقيت اليوم 🕌\n"
+        "• تغيير المدينة 🧭\n"
+        "• إرسال موقعي 📍\n"
+        "• تنبيهات الأذان 🔔\n\n"
+        "ولجدول عدة أيام: /week للأسبوع و /month للشهر 🗓"
+    )
+    await update.message.reply_text(
+        welcome,
+        reply_markup=main_reply_keyboard(),
+        parse_mode="Markdown",
+    )
+
+
+@track_latency
+@with_rate_limit
+@with_user_state
+async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = (update.message.text or "").strip()
+
+    # تحية = نفس /start
+    lowered = text.lower()
+    if (
+        "السلام" in lowered
+        or "سلام" in lowered
+        or "/start" in lowered
+        or lowered in ("hi", "hello")
+    ):
+        await start_command(update, context)
+        return
+
+    user_data = context.user_data
+    chat_id = update.message.chat_id
+
+    # لو كان ينتظر اسم مدينة غير موجودة في القائمة
+    if user_data.get("awaiting_city_name"):
+        country_ar = user_data["awaiting_city_name"]["country"]
+        city_ar = text.strip()
+        not_found = (
+            "❌ لم أستطع العثور على مواقيت الصلاة لهذه المدينة.\n"
+            "حاول كتابة الاسم بطريقة أخرى أو اختر مدينة من القائمة."
+        )
+
+        # نصحح الاسم من الدليل المحلي قبل أي طلب شبكة
+        matches = gazetteer.match(country_ar, city_ar)
+        corrected = gazetteer.correct(country_ar, city_ar)
+        if corrected:
+            city_ar = corrected
+        elif matches:
+            keyboard = InlineKeyboardMarkup(
+                [[InlineKeyboardButton(name, callback_data=f"city|{country_ar}|{name}")] for name, _ in matches]
+            )
+            await update.message.reply_text(
+                "🤔 لم أجد هذا الاسم بالضبط، هل تقصد إحدى هذه المدن؟",
+                reply_markup=keyboard,
+            )
+            return
+        elif len(city_ar) < 2 or len(city_ar) > 40 or any(ch.isdigit() for ch in city_ar):
+            await update.message.reply_text(not_found)
+            return
+
+        # ليست في الدليل: نسأل Aladhan (بلدات صغيرة مثلًا)
+        times = await get_prayer_times(country_ar, city_ar)
+        if not times:
+            await update.message.reply_text(not_found)
+            return
+
+        user_data["saved_country"] = country_ar
+        user_data["saved_city"] = city_ar
+        user_data["saved_lat"] = None
+        user_data["saved_lon"] = None
+        user_data["awaiting_city_name"] = None
+
+        msg = format_prayer_message(country_ar, city_ar, times)
+        keyboard = TIMES_KEYBOARD
+        await update.message.reply_markdown(msg, reply_markup=keyboard)
+        await refresh_alerts(chat_id, user_data)
+        return
+
+    # زر مواقيت اليوم
+    if "مواقيت" in text:
+        # عنده موقع محفوظ؟
+        times = None
+        if user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None:
+            times = await get_prayer_times_by_coords(user_data["saved_lat"], user_data["saved_lon"])
+        elif user_data.get("saved_country") and user_data.get("saved_city"):
+            times = await get_prayer_times(user_data["saved_country"], user_data["saved_city"])
+
+        if not times:
+            # لم يتم تعيين مدينة بعد
+            await send_country_menu(update, context)
+            return
+
+        msg = format_prayer_message(times["country_ar"], times["city_ar"], times)
+        keyboard = TIMES_KEYBOARD
+        await update.message.reply_markdown(msg, reply_markup=keyboard)
+        return
+
+    # زر تغيير المدينة
+    if "تغيير المدينة" in text:
+        await clear_saved_place(chat_id, user_data)
+        await send_country_menu(update, context)
+        return
+
+    # زر تنبيهات الأذان
+    if "تنبيهات" in text:
+        if not (
+            user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None
+        ) and not (user_data.get("saved_country") and user_data.get("saved_city")):
+            await update.message.reply_text(
+                "⚠️ من فضلك حدِّد مدينتك أو أرسل موقعك أولًا، ثم فعِّل تنبيهات الأذان."
+            )
+            return
+
+        alerts_on = user_data.get("alerts_on", False)
+        if alerts_on:
+            user_data["alerts_on"] = False
+            await alert_scheduler.unsubscribe(chat_id)
+            await update.message.reply_text("🔕 تم إيقاف تنبيهات الأذان.")
+        else:
+            ok = await alert_scheduler.subscribe(chat_id, place_from_user_data(user_data))
+            if ok:
+                user_data["alerts_on"] = True
+                await update.message.reply_text(
+                    "🔔 تم تفعيل تنبيهات الأذان.\n"
+                    "ستصلك التنبيهات *كل يوم* تلقائيًا حتى تضغط الزر مرة أخرى لإيقافها.",
+                    parse_mode="Markdown",
+                )
+            else:
+                await update.message.reply_text(
+                    "❌ لم أستطع جدولة التنبيهات. حاول لاحقًا أو غيّر المدينة."
+                )
+        return
+
+    # أي نص آخر
+    await update.message.reply_text(
+        "👋 استخدم الأزرار بالأسفل للحصول على مواقيت الصلاة أو تغيير المدينة.",
+        reply_markup=main_reply_keyboard(),
+    )
+
+
+@track_latency
+@with_rate_limit
+@with_user_state
+async def location_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عند إرسال الموقع من زر (إرسال موقعي 📍)."""
+    loc = update.message.location
+    lat, lon = loc.latitude, loc.longitude
+
+    user_data = context.user_data
+    user_data["saved_lat"] = lat
+    user_data["saved_lon"] = lon
+    user_data["saved_country"] = None
+    user_data["saved_city"] = None
+
+    times = await get_prayer_times_by_coords(lat, lon)
+    if not times:
+        await update.message.reply_text(
+            "❌ حدث خطأ أثناء جلب مواقيت الصلاة حسب موقعك.\nحاول مرة أخرى لاحقًا."
+        )
+        return
+
+    msg = format_prayer_message(times["country_ar"], times["city_ar"], times)
+    keyboard = LOCATION_TIMES_KEYBOARD
+    await update.message.reply_markdown(msg, reply_markup=keyboard)
+    await refresh_alerts(update.message.chat_id, user_data)
+
+
+@track_latency
+@with_rate_limit
+@with_user_state
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    chat_id = query.message.chat.id
+    user_data = context.user_data
+
+    # اختيار دولة
+    if data.startswith("country|"):
+        _, country_ar = data.split("|", 1)
+        user_data["selected_country"] = country_ar
+
+        cities_keyboard = build_cities_keyboard(country_ar)
+        await query.answer()
+        await query.edit_message_text(
+            f"🌍 الدولة المختارة: *{country_ar}*\n\n"
+            f"✅ اختر مدينتك من القائمة:",
+            reply_markup=cities_keyboard,
+            parse_mode="Markdown",
+        )
+        return
+
+    # اختيار مدينة
+    if data.startswith("city|"):
+        _, country_ar, city_ar = data.split("|", 2)
+        if city_ar == "غير ذلك":
+            user_data["awaiting_city_name"] = {"country": country_ar}
+            await query.answer()
+            await query.edit_message_text(
+                f"✏️ اكتب الآن اسم المدينة داخل *{country_ar}*:",
+                parse_mode="Markdown",
+            )
+            return
+
+        times = await get_prayer_times(country_ar, city_ar)
+        if not times:
+            await query.answer()
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="❌ لم أستطع العثور على مواقيت الصلاة لهذه المدينة.\n"
+                     "اختر (غير ذلك) وادخل الاسم يدويًا."
+            )
+            return
+
+        # حفظ المدينة
+        user_data["saved_country"] = country_ar
+        user_data["saved_city"] = city_ar
+        user_data["saved_lat"] = None
+        user_data["saved_lon"] = None
+        user_data["awaiting_city_name"] = None  # ربما جاء من اقتراحات "هل تقصد"
+
+        msg = format_prayer_message(country_ar, city_ar, times)
+        keyboard = TIMES_KEYBOARD
+        await query.answer()
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=msg,
+            parse_mode="Markdown",
+            reply_markup=keyboard,
+        )
+        await refresh_alerts(chat_id, user_data)
+        return
+
+    # إعادة آخر مدينة/موقع
+    if data == "repeat_last":
+        times = None
+        if user_data.get("saved_lat") is not None and user_data.get("saved_lon") is not None:
+            times = await get_prayer_times_by_coords(user_data["saved_lat"], user_data["saved_lon"])
+        elif user_data.get("saved_country") and user_data.get("saved_city"):
+            times = await get_prayer_times(user_data["saved_country"], user_data["saved_city"])
+
+        if not times:
+            await query.answer()
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="⚠️ لا توجد مدينة أو موقع محفوظ.\n"
+                     "استخدم زر (مواقيت اليوم 🕌) لتحديد المدينة أولًا."
+            )
+            return
+
+        msg = format_prayer_message(times["country_ar"], times["city_ar"], times)
+        keyboard = TIMES_KEYBOARD
+        await query.answer()
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=msg,
+            parse_mode="Markdown",
+            reply_markup=keyboard,
+        )
+        return
+
+    # جدول أسبوع / شهر
+    if data.startswith("calendar|"):
+        _, days = data.split("|", 1)
+        await send_calendar(update, context, 30 if days == "30" else 7)
+        return
+
+    # تغيير الدولة من جديد
+    if data == "change_country":
+        await clear_saved_place(chat_id, user_data)
+        user_data.pop("selected_country", None)
+
+        await query.answer()
+        await query.edit_message_text(
+            "اختر الدولة من جديد 🌍:",
+            reply_markup=build_countries_keyboard(),
+        )
+        return
+
+
+# ================ خادم الويب هوك والمقاييس ================
+def _collect_runtime_metrics():
+    """القيم اللحظية: الكاش، التنبيهات، التحميل المسبق، وحالة Aladhan."""
+    cache = prayer_cache.stats()
+    yield "prayer_bot_cache_entries", "gauge", "Prayer times cache size.", (), cache["size"]
+    yield "prayer_bot_cache_hits_total", "counter", "Prayer times cache hits.", (), cache["hits"]
+    yield "prayer_bot_cache_misses_total", "counter", "Prayer times cache misses.", (), cache["misses"]
+    yield "prayer_bot_cache_evictions_total", "counter", "Prayer times cache evictions.", (), cache["evictions"]
+    yield "prayer_bot_cache_hit_ratio", "gauge", "Prayer times cache hit ratio.", (), cache["hit_ratio"]
+    yield "prayer_bot_lookups_shared_total", "counter", "Lookups that joined an in-flight fetch.", (), lookup_flights.shared
+
+    sender = alert_scheduler.sender.stats()
+    yield "prayer_bot_alert_queue_depth", "gauge", "Alerts waiting to be sent.", (), sender["queued"]
+    yield "prayer_bot_alerts_sent_total", "counter", "Alerts delivered.", (), sender["sent"]
+    yield "prayer_bot_alerts_failed_total", "counter", "Alerts that failed.", (), sender["failed"]
+    yield "prayer_bot_alerts_retried_total", "counter", "Alerts retried after RetryAfter.", (), sender["retried"]
+    scheduler = alert_scheduler.stats()
+    yield "prayer_bot_alert_subscriptions", "gauge", "Active alert subscriptions.", (), scheduler["subscriptions"]
+    yield "prayer_bot_alert_places", "gauge", "Distinct places with subscribers.", (), scheduler["places"]
+    yield "prayer_bot_alert_schedule_size", "gauge", "Places waiting for their next alert.", (), scheduler["queue_size"]
+    yield "prayer_bot_alert_heap_size", "gauge", "Alert heap entries, including stale ones.", (), scheduler["heap_size"]
+    yield "prayer_bot_alert_heap_stale", "gauge", "Stale alert heap entries awaiting removal.", (), scheduler["stale_entries"]
+    yield "prayer_bot_alert_upstream_reschedules_total", "counter", "Reschedules that needed Aladhan (missed prefetch).", (), scheduler["upstream_reschedules"]
+
+    for name, value in prefetcher.stats().items():
+        kind = "gauge" if name == "active_places" else "counter"
+        suffix = "" if kind == "gauge" else "_total"
+        yield f"prayer_bot_prefetch_{name}{suffix}", kind, "Next-day prefetch.", (), value
+
+    ingest = ingestor.stats()
+    yield "prayer_bot_ingest_queue_depth", "gauge", "Updates waiting in the ingestion queue.", (), ingest["queued"]
+    yield "prayer_bot_ingest_queue_capacity", "gauge", "Ingestion queue capacity.", (), ingestor.max_queue
+    yield "prayer_bot_ingest_accepted_total", "counter", "Updates accepted for processing.", (), ingest["accepted"]
+    yield "prayer_bot_ingest_duplicates_total", "counter", "Redelivered updates ignored by update_id.", (), ingest["duplicates"]
+    yield "prayer_bot_ingest_rejected_total", "counter", "Updates rejected with 503 (backpressure).", (), ingest["rejected"]
+    yield "prayer_bot_ingest_batches_total", "counter", "Ingestion batches.", (), ingest["batches"]
+    yield "prayer_bot_ingest_prefetched_places_total", "counter", "Distinct places prefetched per batch.", (), ingest["prefetched_places"]
+
+    yield "prayer_bot_overloaded", "gauge", "1 while new user Aladhan lookups are shed.", (), int(load_shedder.overloaded())
+    yield "prayer_bot_upstream_pending", "gauge", "Aladhan requests in flight or waiting for a slot.", (), aladhan.pending
+
+    yield "prayer_bot_traces_sampled_total", "counter", "Updates traced.", (), tracer.sampled
+    yield "prayer_bot_traces_slow_total", "counter", "Traced updates slower than TRACE_SLOW_MS.", (), tracer.slow
+
+    state = 0 if aladhan.breaker.state == "closed" else 1
+    yield "prayer_bot_upstream_circuit_open", "gauge", "1 while the Aladhan circuit is open.", (), state
+
+    for phase, seconds in startup.phases:
+        yield "prayer_bot_startup_seconds", "gauge", "Startup time by phase.", (("phase", phase),), round(seconds, 4)
+    if _boot is not None:
+        yield "prayer_bot_startup_early_updates_total", "counter", "Updates acknowledged before the bot was ready.", (), _boot.acked
+
+
+metrics.add_collector(_collect_runtime_metrics)
+
+
+def _metrics_authorized(handler: tornado.web.RequestHandler) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    bearer = handler.request.headers.get("Authorization", "")
+    return bearer == f"Bearer {METRICS_TOKEN}" or handler.get_query_argument("token", "") == METRICS_TOKEN
+
+
+def update_chat_id(data: Dict) -> int:
+    """chat_id من JSON التحديث الخام (أو معرّف المرسل)، بدون بناء كائن Update."""
+    for field in ("message", "edited_message", "callback_query", "my_chat_member"):
+        obj = data.get(field)
+        if obj:
+            chat = (obj.get("message") or obj).get("chat") or {}
+            return chat.get("id") or (obj.get("from") or {}).get("id") or 0
+    return 0
+
+
+def _update_place(data: Dict) -> Optional[Dict]:
+    """المكان الذي سيطلب التحديث مواقيته إن أمكن معرفته من التحديث نفسه."""
+    message = data.get("message") or {}
+    location = message.get("location")
+    if location:
+        return {"country": None, "city": None, "lat": location["latitude"], "lon": location["longitude"]}
+    callback_data = (data.get("callback_query") or {}).get("data") or ""
+    if callback_data.startswith("city|"):
+        _, country_ar, city_ar = callback_data.split("|", 2)
+        if city_ar != "غير ذلك":
+            return {"country": country_ar, "city": city_ar, "lat": None, "lon": None}
+    return None
+
+
+class UpdateIngestor:
+    """مرحلة الاستقبال بين الويب هوك والـ handlers.
+
+    - الويب هوك يرد فورًا بعد وضع التحديث في طابور محدود، فزمن الرد لا يتأثر بزمن المعالجة.
+    - التحديث المكرر (نفس update_id، يعيده تيليجرام إن تأخر الرد) يُتجاهل.
+    - إن امتلأ الطابور نرد 503 فيعيد تيليجرام الإرسال لاحقًا، بدل تراكم مهام بلا حد في الذاكرة.
+    - المستهلك يأخذ دفعة، يبدأ جلب مواقيت كل مكان مذكور فيها مرة واحدة (الـ handlers
+      تلحق بنفس الطلب عبر SingleFlight)، ثم يعالج تحديثات كل محادثة بالترتيب
+      والمحادثات المختلفة بالتوازي حتى max_in_flight.
+    """
+
+    SEEN_LIMIT = 10000
+
+    def __init__(self, max_queue: int, batch_size: int, max_in_flight: int):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.application: Optional[Application] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._chats: Dict[int, List] = {}  # chat_id -> [قفل، عدد التحديثات المنتظرة]
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+        self.prefetched_places = 0
+
+    def start(self, application: Application):
+        self.application = application
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_queue)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self.depth,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "prefetched_places": self.prefetched_places,
+        }
+
+    def _is_duplicate(self, data: Dict) -> bool:
+        if data.get("update_id") in self._seen:
+            self.duplicates += 1
+            return True
+        return False
+
+    def _remember(self, data: Dict):
+        self._seen[data.get("update_id")] = None
+        if len(self._seen) > self.SEEN_LIMIT:
+            self._seen.popitem(last=False)
+        self.accepted += 1
+
+    def offer(self, data: Dict) -> bool:
+        """للويب هوك: لا ينتظر أبدًا. False = الطابور ممتلئ."""
+        if self.queue is None:
+            # قبل start: الطابور يُنشأ هنا ويبدأ المستهلك لاحقًا
+            self.queue = asyncio.Queue(self.max_queue)
+        if self._is_duplicate(data):
+            return True
+        try:
+            self.queue.put_nowait((time.monotonic(), data))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self._remember(data)
+        return True
+
+    def adopt(self, items: List[Dict]):
+        """تحديثات ردّ عليها BootAcceptor بـ 200 قبل الجاهزية: تيليجرام لن يعيدها،
+        فيتسع الطابور لها كلها فوق سعته العادية."""
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_queue + len(items))
+        dropped = sum(1 for data in items if not self.offer(data))
+        if dropped:
+            logger.error(f"Dropped {dropped} of {len(items)} updates acknowledged during startup")
+
+    async def put(self, data: Dict):
+        """للعمال: ينتظر مكانًا في الطابور، فيمتلئ الأنبوب ويظهر الضغط في العملية الأمامية."""
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_queue)
+        if not self._is_duplicate(data):
+            await self.queue.put((time.monotonic(), data))
+            self._remember(data)
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.batches += 1
+            metrics.observe("prayer_bot_ingest_batch_size", len(batch))
+
+            places = {}
+            for _, data in batch:
+                place = _update_place(data)
+                if place:
+                    places.setdefault(_place_key(place), place)
+            for place in places.values():
+                _spawn(self._prefetch(place))
+
+            for received_at, data in batch:
+                await self._slots.acquire()
+                metrics.observe("prayer_bot_ingest_wait_seconds", time.monotonic() - received_at)
+                _spawn(self._process(data, received_at))
+
+    async def _prefetch(self, place: Dict):
+        if _needs_upstream(_lookup_key(place)) and load_shedder.overloaded():
+            return  # يقرر الـ handler نفسه: كاش أو "حاول لاحقًا"
+        self.prefetched_places += 1
+        try:
+            await get_place_times(place)
+        except Exception:
+            logger.exception(f"Batch prefetch failed for {_place_key(place)}")
+
+    async def _process(self, data: Dict, received_at: float):
+        chat_id = update_chat_id(data)
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        # المهمة خاصة بهذا التحديث، فالـ ContextVar يخصه وحده (ومهامه الفرعية)
+        trace = tracer.begin(data.get("update_id"), received_at)
+        if trace is not None:
+            _current_trace.set(trace)
+        try:
+            async with entry[0]:
+                if trace is not None:
+                    # الطابور + انتظار تحديثات سابقة لنفس المحادثة
+                    trace.add("queue", received_at, time.monotonic() - received_at)
+                with span("decode"):
+                    update = Update.de_json(data, self.application.bot)
+                await self.application.process_update(update)
+        except Exception:
+            logger.exception(f"Failed to process update {data.get('update_id')}")
+        finally:
+            self._slots.release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat_id]
+            if trace is not None:
+                tracer.finish(trace)
+
+
+ingestor = UpdateIngestor(INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, CONCURRENT_UPDATES)
+metrics.describe("prayer_bot_ingest_wait_seconds", "histogram", "Time updates spent queued before processing.")
+metrics.describe(
+    "prayer_bot_ingest_batch_size", "histogram", "Updates taken per ingestion batch.", (1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+
+def _reject_overloaded(handler: tornado.web.RequestHandler):
+    # تيليجرام يعيد إرسال ما لم يُقبل، و update_id يمنع معالجته مرتين
+    handler.set_status(503)
+    handler.set_header("Retry-After", "5")
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    """يستقبل تحديثات تيليجرام ويرد فورًا بعد وضعها في طابور الاستقبال."""
+
+    def initialize(self, ingestor: UpdateIngestor):
+        self.ingestor = ingestor
+
+    def post(self):
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            logger.warning("Received an invalid webhook payload")
+            self.send_error(400)
+            return
+        metrics.inc("prayer_bot_updates_received_total")
+        if not self.ingestor.offer(data):
+            _reject_overloaded(self)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        if not _metrics_authorized(self):
+            self.send_error(403)
+            return
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render())
+
+
+class ProfileHandler(tornado.web.RequestHandler):
+    """GET /debug/profile?seconds=10 -> عينات مكدس حلقة البوت بصيغة collapsed."""
+
+    def initialize(self, thread_id: int):
+        self.thread_id = thread_id
+
+    async def get(self):
+        if not _metrics_authorized(self):
+            self.send_error(403)
+            return
+        try:
+            seconds = min(max(float(self.get_query_argument("seconds", "10")), 0.1), 60.0)
+        except ValueError:
+            self.send_error(400)
+            return
+        try:
+            report = await asyncio.to_thread(profiler.sample, self.thread_id, seconds)
+        except RuntimeError:
+            self.send_error(409)
+            return
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.write(report)
+
+
+def build_web_app(webhook_handler: Type[tornado.web.RequestHandler], options: Dict) -> tornado.web.Application:
+    routes = [
+        (rf"/{re.escape(WEBHOOK_PATH)}/?", webhook_handler, options),
+        (rf"/{re.escape(METRICS_PATH)}", MetricsHandler),
+    ]
+    if PROFILER_ENABLED:
+        routes.append((r"/debug/profile", ProfileHandler, {"thread_id": threading.get_ident()}))
+    return tornado.web.Application(routes)
+
+
+def _listen(server: HTTPServer) -> List[Tuple[bytes, Dict]]:
+    """يربط البورت، أو يستلم مقبس BootAcceptor إن ربطه مبكرًا، ويعيد ما استقبله من تحديثات."""
+    if _boot is None:
+        server.listen(PORT, address="0.0.0.0")
+        return []
+    sock, bodies = _boot.handover()
+    server.add_sockets([sock])
+    startup.mark("handover")
+    pending = []
+    for body in bodies:
+        try:
+            pending.append((body, json.loads(body)))
+        except ValueError:
+            logger.warning("Received an invalid webhook payload")
+    metrics.inc("prayer_bot_updates_received_total", value=len(pending))
+    return pending
+
+
+def _log_startup():
+    logger.info(f"Startup: {startup.summary()}")
+    if _boot is not None and _boot.first_ack is not None:
+        logger.info(
+            f"First webhook acknowledged {startup.elapsed(_boot.first_ack) * 1000:.0f} ms after process start, "
+            f"{_boot.acked} updates buffered before the bot was ready ({_boot.rejected} rejected)"
+        )
+
+
+async def serve_webhook(application: Application):
+    """بديل run_webhook بنفس خادم tornado، مع مسارات المقاييس والبروفايلر على نفس البورت."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # نربط البورت أولًا: ما يصل قبل اكتمال التهيئة ينتظر في طابور الاستقبال
+    server = HTTPServer(build_web_app(WebhookHandler, {"ingestor": ingestor}))
+    ingestor.adopt([data for _, data in _listen(server)])
+    async with application:
+        startup.mark("initialize")
+        await post_init(application)
+        startup.mark("post_init")
+        await application.bot.set_webhook(WEBHOOK_URL)
+        await application.start()
+        ingestor.start(application)
+        startup.mark("set_webhook")
+        logger.info(f"Webhook server listening on port {PORT}, metrics at /{METRICS_PATH}")
+        _log_startup()
+        try:
+            await stop.wait()
+        finally:
+            server.stop()
+            await ingestor.stop()
+            await application.stop()
+            await post_shutdown(application)
+
+
+# ================ عمّال متعددون (WORKERS > 1) ================
+def update_shard(data: Dict, count: int) -> int:
+    """رقم العامل المالك للتحديث: chat_id % count، فتبقى محادثة كل مستخدم في عامل واحد."""
+    return update_chat_id(data) % count
+
+
+class ShardedWebhookHandler(tornado.web.RequestHandler):
+    """العملية الأمامية: تقرأ chat_id فقط وترسل النص الخام لطابور العامل المالك."""
+
+    def initialize(self, supervisor: "WorkerSupervisor"):
+        self.supervisor = supervisor
+
+    def post(self):
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            logger.warning("Received an invalid webhook payload")
+            self.send_error(400)
+            return
+        metrics.inc("prayer_bot_updates_received_total")
+        if not self.supervisor.dispatch(self.request.body, data):
+            _reject_overloaded(self)
+
+
+class WorkerSupervisor:
+    """يشغّل العمال ويعيد تشغيل أي عامل يسقط.
+
+    لكل عامل أنبوب (Pipe) وصندوق صادر في العملية الأمامية يفرغه خيط مستقل، فما
+    يصل أثناء إعادة التشغيل ينتظر في الصندوق ولا يضيع. العامل الجديد يحمّل
+    اشتراكات تنبيهاته (chat_id % WORKERS) من المخزن المشترك.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self._context = multiprocessing.get_context("spawn")
+        self.outboxes = [SimpleQueue() for _ in range(count)]
+        self.connections: List = [None] * count
+        self.processes: List = [None] * count
+        self.dispatched = [0] * count
+        self.rejected = 0
+        self.restarts = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _start_worker(self, index: int):
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self.count, reader),
+            name=f"prayer-worker-{index}",
+        )
+        process.start()
+        reader.close()
+        previous, self.connections[index] = self.connections[index], writer
+        if previous is not None:
+            previous.close()
+        self.processes[index] = process
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def _send_loop(self, index: int):
+        """خيط لكل عامل: من الصندوق إلى الأنبوب، ويعيد الإرسال بعد إعادة تشغيل العامل."""
+        outbox = self.outboxes[index]
+        while True:
+            body = outbox.get()
+            while True:
+                try:
+                    self.connections[index].send_bytes(body)
+                    break
+                except (OSError, ValueError):
+                    time.sleep(0.2)  # الأنبوب مغلق: العامل يُعاد تشغيله
+            if not body:
+                return
+
+    def start(self):
+        for index in range(self.count):
+            self._start_worker(index)
+            threading.Thread(target=self._send_loop, args=(index,), name=f"worker-{index}-sender", daemon=True).start()
+        self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def dispatch(self, body: bytes, data: Dict, force: bool = False) -> bool:
+        """False = صندوق العامل ممتلئ (العامل متأخر أو يُعاد تشغيله). force يتجاوز الحد."""
+        index = update_shard(data, self.count)
+        if not force and self.outboxes[index].qsize() >= INGEST_QUEUE_SIZE:
+            self.rejected += 1
+            return False
+        self.outboxes[index].put(body)
+        self.dispatched[index] += 1
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.warning(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    self.restarts += 1
+                    self._start_worker(index)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        for outbox in self.outboxes:
+            outbox.put(b"")  # رسالة فارغة = توقف
+        for process in self.processes:
+            await asyncio.to_thread(process.join, 15)
+            if process.is_alive():
+                process.terminate()
+
+    def collect(self):
+        yield "prayer_bot_worker_restarts_total", "counter", "Worker processes restarted.", (), self.restarts
+        yield "prayer_bot_ingest_rejected_total", "counter", "Updates rejected with 503 (backpressure).", (), self.rejected
+        for index, process in enumerate(self.processes):
+            labels = (("worker", index),)
+            yield "prayer_bot_worker_dispatched_total", "counter", "Updates sent to each worker.", labels, self.dispatched[index]
+            yield "prayer_bot_worker_outbox_depth", "gauge", "Updates waiting for each worker.", labels, self.outboxes[index].qsize()
+            alive = int(process is not None and process.is_alive())
+            yield "prayer_bot_worker_up", "gauge", "1 while the worker process is alive.", labels, alive
+
+
+def run_worker(index: int, count: int, connection):
+    """نقطة دخول عملية العامل."""
+    global WORKER_SHARD
+    WORKER_SHARD = (index, count)
+    # Ctrl-C يصل لكل المجموعة؛ المشرف هو من يوقف العمال
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    get_timetable(datetime.now(pytz.UTC).date())
+    asyncio.run(serve_worker(build_application(), connection))
+
+
+async def serve_worker(application: Application, connection):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    def pump():
+        # خيط يقرأ من الأنبوب (يحجب) ويسلّم للحلقة
+        while True:
+            try:
+                body = connection.recv_bytes()
+            except (EOFError, OSError):
+                body = b""
+            if not body:
+                loop.call_soon_threadsafe(stop.set)
+                return
+            try:
+                data = json.loads(body)
+            except ValueError:
+                logger.warning("Worker received an invalid update")
+                continue
+            # ننتظر مكانًا في طابور الاستقبال، فيمتلئ الأنبوب ثم صندوق العملية الأمامية
+            asyncio.run_coroutine_threadsafe(ingestor.put(data), loop).result()
+
+    async with application:
+        await post_init(application)
+        await application.start()
+        ingestor.start(application)
+        threading.Thread(target=pump, name="update-pump", daemon=True).start()
+        logger.info(f"Worker {WORKER_SHARD[0]}/{WORKER_SHARD[1]} ready")
+        try:
+            await stop.wait()
+        finally:
+            await ingestor.stop()
+            await application.stop()
+            await post_shutdown(application)
+
+
+async def serve_sharded(count: int):
+    """العملية الأمامية: خادم الويب هوك والمقاييس + مشرف العمال."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    supervisor = WorkerSupervisor(count)
+    supervisor.start()
+    metrics.add_collector(supervisor.collect)
+    server = HTTPServer(build_web_app(ShardedWebhookHandler, {"supervisor": supervisor}))
+    for body, data in _listen(server):
+        # رددنا عليه بـ 200 فلن يعيده تيليجرام: لا نرفضه حتى لو امتلأ صندوق العامل
+        supervisor.dispatch(body, data, force=True)
+    async with Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_API_URL) as bot:
+        await bot.set_webhook(WEBHOOK_URL)
+    startup.mark("set_webhook")
+    logger.info(f"Webhook server listening on port {PORT} with {count} workers")
+    _log_startup()
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await supervisor.stop()
+
+
+# ================ Main =================
+async def post_init(application: Application):
+    # جدول السنة الحالية بعد ربط البورت: mmap من الملف إن بُني مسبقًا، وإلا حساب سريع في الذاكرة
+    get_timetable(datetime.now(pytz.UTC).date())
+    user_states.start()
+    await alert_scheduler.start(application.bot)
+    prefetcher.start()
+
+
+async def post_shutdown(application: Application):
+    await prefetcher.stop()
+    await alert_scheduler.stop()
+    await user_states.close()
+    await aladhan.close()
+    tracer.close()
+
+
+def build_application(**builder_options) -> Application:
+    """Application مع كل الـ handlers (builder_options للاختبار: request، base_url...)."""
+    # concurrent_updates: معالجة التحديثات بالتوازي على نفس الحلقة بدل خيط لكل طلب
+    # updater(None): التحديثات تصل من خادمنا عبر UpdateIngestor (process_update مباشرة)
+    builder = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(CONCURRENT_UPDATES).updater(None)
+    builder_options.setdefault("base_url", TELEGRAM_API_URL)
+    if TRACE_SAMPLE_RATE > 0:
+        # نفس حجم مجمّع الاتصالات الافتراضي في PTB
+        builder_options.setdefault("request", TracedRequest(connection_pool_size=256))
+    for option, value in builder_options.items():
+        builder = getattr(builder, option)(value)
+    application = builder.build()
+
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("week", week_command))
+    application.add_handler(CommandHandler("month", month_command))
+    application.add_handler(CallbackQueryHandler(callback_handler))
+    application.add_handler(MessageHandler(filters.LOCATION, location_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    return application
+
+
+def main():
+    startup.mark("module")
+    logger.info("Starting bot with webhook mode...")
+    logger.info(f"Using BASE_URL={BASE_URL}, PORT={PORT}")
+    logger.info(f"Setting webhook to {WEBHOOK_URL}")
+    today = datetime.now(pytz.UTC).date()
+
+    if WORKERS > 1:
+        if USER_STORE_URL.startswith("memory://"):
+            logger.warning("WORKERS > 1 with a memory store: state is not shared and is lost on restarts")
+        # العمال يفتحون نفس ملف الجدول عبر mmap (صفحات مشتركة) بدل نسخة محسوبة لكل عامل
+        if PRAYER_METHOD in CALCULATION_METHODS and load_timetable(timetable_path(today.year), today.year) is None:
+            try:
+                build_timetable_files([today.year])
+            except OSError as e:
+                logger.warning(f"Could not write the shared timetable: {e}")
+        asyncio.run(serve_sharded(WORKERS))
+        return
+
+    application = build_application()
+    startup.mark("application")
+    asyncio.run(serve_webhook(application))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build-timetable":
+        # python prayer_bot.py build-timetable [سنة ...] (الافتراضي: هذه السنة والتي بعدها)
+        this_year = datetime.now(pytz.UTC).year
+        build_timetable_files([int(y) for y in sys.argv[2:]] or [this_year, this_year + 1])
+    else:
+        main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# قبل استيراد prayer_bot: الإعدادات تُقرأ من البيئة عند الاستيراد
+os.environ.setdefault("TELEGRAM_TOKEN", "1:test")
+os.environ.setdefault("USER_STORE_URL", "memory://")
+os.environ.setdefault("TIMETABLE_DIR", tempfile.mkdtemp(prefix="prayer-bot-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+"""يولّد prayer_reference.json: مواقيت مرجعية لاختبار الحساب المحلي.
+
+    pip install praytimes==2.3.2
+    python tests/data/make_prayer_reference.py > tests/data/prayer_reference.json
+
+المرجع هو كود PrayTimes.org 2.3 الذي يطبّقه محرك Aladhan، بإعدادات Aladhan:
+زوايا كل طريقة كما في /v1/methods، تعديل العروض المرتفعة Angle Based، والعشاء
+بالدقائق (90، و120 في رمضان لأم القرى) مضافًا للمغرب. لا يستورد prayer_bot،
+فالجدول الناتج مستقل عن الكود المختبَر. المنطقة الزمنية: فرق التوقيت عند ظهر اليوم.
+"""
+import json
+import sys
+from datetime import date, datetime
+
+import pytz
+from praytimes.praytimes import PrayTimes
+
+# طرق Aladhan (رقم الطريقة -> زاوية الفجر، زاوية العشاء أو دقائقه)
+METHODS = {
+    1: (18.0, 18.0),
+    2: (15.0, 15.0),
+    3: (18.0, 17.0),
+    4: (18.5, "90 min"),
+    5: (19.5, 17.5),
+    8: (19.5, "90 min"),
+    9: (18.0, 17.5),
+    10: (18.0, "90 min"),
+    11: (20.0, 18.0),
+    12: (12.0, 12.0),
+    14: (16.0, 15.0),
+}
+
+# مدينة، عرض، طول، منطقة زمنية
+CITIES = [
+    ("Mecca", 21.3891, 39.8579, "Asia/Riyadh"),
+    ("Cairo", 30.0444, 31.2357, "Africa/Cairo"),
+    ("Beirut", 33.8938, 35.5018, "Asia/Beirut"),
+    ("Casablanca", 33.5731, -7.5898, "Africa/Casablanca"),
+    ("Baghdad", 33.3152, 44.3661, "Asia/Baghdad"),
+    ("Dubai", 25.2048, 55.2708, "Asia/Dubai"),
+    ("Algiers", 36.7538, 3.0588, "Africa/Algiers"),
+    ("Sanaa", 15.3694, 44.1910, "Asia/Aden"),
+]
+# عروض مرتفعة: الفجر والعشاء هنا من تعديل Angle Based لا من الزاوية
+HIGH_LATITUDE = [
+    ("Oslo", 59.9139, 10.7522, "Europe/Oslo"),
+    ("Stockholm", 59.3293, 18.0686, "Europe/Stockholm"),
+]
+DAYS = [date(2025, 1, 15), date(2025, 7, 15)]
+# منتصف رمضان 1446 (1 مارس - 29 مارس 2025) وشهر بعده، لعشاء أم القرى
+RAMADAN_DAY, AFTER_RAMADAN = date(2025, 3, 15), date(2025, 4, 15)
+
+
+def reference_times(lat, lon, tz_name, day, method, school):
+    fajr, isha = METHODS[method]
+    calculator = PrayTimes()
+    calculator.adjust(
+        {
+            "fajr": fajr,
+            "isha": isha if not isinstance(isha, str) else 0,
+            "maghrib": "0 min",
+            "dhuhr": "0 min",
+            "asr": "Hanafi" if school else "Standard",
+            "highLats": "AngleBased",
+            "midnight": "Standard",
+        }
+    )
+    noon = pytz.timezone(tz_name).localize(datetime(day.year, day.month, day.day, 12))
+    times = calculator.getTimes(day, (lat, lon), noon.utcoffset().total_seconds() / 3600)
+    result = {key.capitalize(): times[key] for key in ("fajr", "dhuhr", "asr", "maghrib", "isha")}
+    if isinstance(isha, str):
+        minutes = 120 if method == 4 and day == RAMADAN_DAY else int(isha.split()[0])
+        hours, mins = map(int, result["Maghrib"].split(":"))
+        total = (hours * 60 + mins + minutes) % (24 * 60)
+        result["Isha"] = f"{total // 60:02d}:{total % 60:02d}"
+    return result
+
+
+def cases():
+    methods = sorted(METHODS)
+    for i, method in enumerate(methods):
+        # ثلاث مدن مختلفة لكل طريقة، بالتناوب على القائمة
+        for name, lat, lon, tz_name in (CITIES[(i + k) % len(CITIES)] for k in range(3)):
+            for day in DAYS:
+                for school in (0, 1):
+                    yield name, lat, lon, tz_name, day, method, school
+    for name, lat, lon, tz_name in HIGH_LATITUDE:
+        for day in (date(2025, 6, 21), date(2025, 12, 21)):
+            for method in (2, 3):
+                yield name, lat, lon, tz_name, day, method, 0
+    for day in (RAMADAN_DAY, AFTER_RAMADAN):
+        yield ("Mecca", 21.3891, 39.8579, "Asia/Riyadh", day, 4, 0)
+
+
+def main():
+    rows = [
+        {
+            "city": name,
+            "lat": lat,
+            "lon": lon,
+            "timezone": tz_name,
+            "date": day.isoformat(),
+            "method": method,
+            "school": school,
+            "times": reference_times(lat, lon, tz_name, day, method, school),
+        }
+        for name, lat, lon, tz_name, day, method, school in cases()
+    ]
+    # سطر لكل حالة، فالفرق في git يوضح أي مدينة/طريقة تغيّرت
+    sys.stdout.write("[\n" + ",\n".join(json.dumps(row) for row in rows) + "\n]\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""AlertScheduler: الكومة ذات الحذف الكسول (seq، المدخلات الميتة، _reschedule في الخلفية)."""
+import asyncio
+import time
+
+import pytest
+
+import prayer_bot as pb
+
+BEIRUT = {"country": "لبنان", "city": "بيروت"}
+
+
+class FakeSender:
+    def __init__(self):
+        self.batches = []
+
+    def start(self, bot, on_forbidden):
+        pass
+
+    async def stop(self):
+        pass
+
+    def enqueue(self, batch_key, chat_ids, text, fire_at):
+        self.batches.append((batch_key, sorted(chat_ids), fire_at))
+
+
+class FakeNextAlert:
+    """الصلاة القادمة بعد gap ثانية. hold=True يوقف الحساب التالي حتى release()."""
+
+    def __init__(self, gap):
+        self.gap = gap
+        self.hold = False
+        self.held = asyncio.Event()
+        self._release = asyncio.Event()
+
+    async def __call__(self, place, after):
+        if self.hold:
+            self.hold = False
+            self.held.set()
+            await self._release.wait()
+        return max(after, time.time()) + self.gap, "Fajr"
+
+    def release(self):
+        self._release.set()
+
+
+@pytest.fixture
+def next_alert(monkeypatch):
+    def install(gap):
+        fake = FakeNextAlert(gap)
+        monkeypatch.setattr(pb, "next_prayer_alert", fake)
+        return fake
+
+    return install
+
+
+def _run(scenario):
+    async def main():
+        scheduler = pb.AlertScheduler(pb.MemoryUserStore(), FakeSender())
+        await scheduler.start(None)
+        try:
+            await scenario(scheduler)
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def _heap_state(scheduler):
+    return len(scheduler._heap), scheduler._stale, scheduler.queue_size
+
+
+def test_last_member_leaves_and_place_comes_back(next_alert):
+    next_alert(3600)
+
+    async def scenario(scheduler):
+        await scheduler.subscribe(1, BEIRUT)
+        await scheduler.subscribe(2, BEIRUT)
+        assert _heap_state(scheduler) == (1, 0, 1)
+
+        await scheduler.unsubscribe(1)
+        assert _heap_state(scheduler) == (1, 0, 1)
+        await scheduler.unsubscribe(2)
+        assert _heap_state(scheduler) == (1, 1, 0)
+        assert scheduler.places == {} and scheduler.subscriptions == {}
+
+        await scheduler.subscribe(1, BEIRUT)
+        assert _heap_state(scheduler) == (2, 1, 1)
+        assert scheduler.store.load_subscriptions() == {1: BEIRUT}
+
+    _run(scenario)
+
+
+def test_stale_entry_is_skipped_without_duplicate_alerts(next_alert):
+    next_alert(0.05)
+
+    async def scenario(scheduler):
+        await scheduler.subscribe(1, BEIRUT)
+        await scheduler.unsubscribe(1)
+        await scheduler.subscribe(1, BEIRUT)
+        assert _heap_state(scheduler) == (2, 1, 1)
+
+        await asyncio.sleep(0.3)
+        fire_times = [fire_at for _, _, fire_at in scheduler.sender.batches]
+        assert fire_times and len(fire_times) == len(set(fire_times))
+        assert all(members == [1] for _, members, _ in scheduler.sender.batches)
+        # المدخل الميت خرج من الكومة، ويبقى مدخل حي واحد للمكان
+        assert _heap_state(scheduler) == (1, 0, 1)
+
+    _run(scenario)
+
+
+def test_reschedule_racing_resubscribe(next_alert):
+    fake = next_alert(0.05)
+
+    async def scenario(scheduler):
+        await scheduler.subscribe(1, BEIRUT)
+        fake.hold = True  # الحساب التالي هو _reschedule بعد أول تنبيه
+        await asyncio.wait_for(fake.held.wait(), 1)
+        assert len(scheduler.sender.batches) == 1
+        assert _heap_state(scheduler) == (0, 0, 0)
+
+        # آخر مشترك يغادر ثم يعود أثناء _reschedule: مكان جديد بمدخل جديد
+        await scheduler.unsubscribe(1)
+        assert _heap_state(scheduler) == (0, 0, 0)
+        await scheduler.subscribe(1, BEIRUT)
+        assert _heap_state(scheduler) == (1, 0, 1)
+
+        # _reschedule القديم يجد مكانًا آخر فلا يضيف مدخلًا ثانيًا
+        fake.release()
+        await asyncio.sleep(0.01)
+        assert _heap_state(scheduler) == (1, 0, 1)
+
+        await asyncio.sleep(0.2)
+        fire_times = [fire_at for _, _, fire_at in scheduler.sender.batches]
+        assert len(fire_times) == len(set(fire_times))
+        assert _heap_state(scheduler) == (1, 0, 1)
+
+    _run(scenario)
+
+
+def test_reschedule_keeps_place_when_another_member_stays(next_alert):
+    fake = next_alert(0.05)
+
+    async def scenario(scheduler):
+        await scheduler.subscribe(1, BEIRUT)
+        await scheduler.subscribe(2, BEIRUT)
+        fake.hold = True
+        await asyncio.wait_for(fake.held.wait(), 1)
+
+        await scheduler.unsubscribe(1)
+        await scheduler.subscribe(1, BEIRUT)
+        assert _heap_state(scheduler) == (0, 0, 0)  # المكان نفسه، ومدخله عند _reschedule
+
+        fake.release()
+        await asyncio.sleep(0.01)
+        assert _heap_state(scheduler) == (1, 0, 1)
+        assert scheduler.places[pb._place_key(BEIRUT)]["members"] == {1, 2}
+
+    _run(scenario)
+
+
+def test_heap_is_compacted_when_mostly_stale(next_alert):
+    next_alert(3600)
+
+    async def scenario(scheduler):
+        for chat_id in range(200):
+            await scheduler.subscribe(chat_id, {"lat": 30 + chat_id * 0.1, "lon": 35.0})
+            await scheduler.unsubscribe(chat_id)
+            assert scheduler.queue_size == 0
+        assert len(scheduler._heap) <= 65
+        assert scheduler._stale == len(scheduler._heap)
+
+    _run(scenario)
@@ -0,0 +1,104 @@
+"""توحيد الكتابة العربية والبحث التقريبي عن المدن (التصحيح التلقائي أو الاقتراح أو الرفض)."""
+import pytest
+
+import prayer_bot as pb
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("أسيوط", "اسيوط"),  # همزة على الألف
+        ("إربد", "اربد"),  # همزة تحت الألف
+        ("آمنة", "امنه"),  # مدّة + تاء مربوطة
+        ("ٱلمدينة", "المدينه"),  # ألف وصل
+        ("زحلة", "زحله"),  # تاء مربوطة
+        ("دبى", "دبي"),  # ألف مقصورة
+        ("حائل", "حايل"),  # همزة على الياء
+        ("مؤتة", "موته"),  # همزة على الواو
+        ("بَيْرُوت", "بيروت"),  # تشكيل
+        ("عمّان", "عمان"),  # شدّة
+        ("بيـــروت", "بيروت"),  # تطويل
+        ("  Beirut   Port ", "beirut port"),  # مسافات وحروف لاتينية كبيرة
+    ],
+)
+def test_normalize_arabic(text, expected):
+    assert pb.normalize_arabic(text) == expected
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("الرياض", "رياض"),
+        ("خميس مشيط", "خميس مشيط"),
+        ("الخبر الجديدة", "خبر جديده"),
+        ("ال", "ال"),  # أقصر من أن تكون أداة تعريف
+        ("الم", "الم"),
+    ],
+)
+def test_strip_article(name, expected):
+    assert pb._strip_article(pb.normalize_arabic(name)) == expected
+
+
+@pytest.mark.parametrize(
+    "country, text, expected",
+    [
+        ("مصر", "قاهره", "القاهرة"),  # بدون ال التعريف وبهاء بدل التاء
+        ("مصر", "الاسكندريه", "الإسكندرية"),
+        ("مصر", "اسيوط", "أسيوط"),
+        ("الإمارات", "دبى", "دبي"),
+        ("السعودية", "حايل", "حائل"),
+        ("السعودية", "جده", "جدة"),
+        ("لبنان", "بَيْرُوت", "بيروت"),
+        ("لبنان", "بيـــروت", "بيروت"),
+        ("لبنان", "beirut", "بيروت"),
+        ("الأردن", "عمان", "عمّان"),  # الاسم المعتمد هو اسم القائمة
+    ],
+)
+def test_spelling_variants_match_exactly(country, text, expected):
+    assert pb.gazetteer.match(country, text) == [(expected, 1.0)]
+    assert pb.gazetteer.correct(country, text) == expected
+
+
+@pytest.mark.parametrize(
+    "country, text, expected",
+    [
+        ("لبنان", "بيروتت", "بيروت"),
+        ("لبنان", "Tripolli", "طرابلس"),
+    ],
+)
+def test_near_miss_is_corrected(country, text, expected):
+    score = pb.gazetteer.match(country, text)[0][1]
+    assert pb.GAZETTEER_ACCEPT_SCORE <= score < 1.0
+    assert pb.gazetteer.correct(country, text) == expected
+
+
+def test_weaker_match_is_only_suggested():
+    assert pb.gazetteer.match("لبنان", "طرابلوس")[0][0] == "طرابلس"
+    assert pb.gazetteer.correct("لبنان", "طرابلوس") is None
+
+
+@pytest.mark.parametrize(
+    "country, text, lookalike",
+    [
+        ("السعودية", "مدينة حمد", "المدينة"),  # مدينة في البحرين، ثلاثياتها تشبه "المدينة"
+        ("البحرين", "المدينة", "مدينة حمد"),
+        ("مصر", "الإسماعيلية الجديدة", "الإسماعيلية"),  # مدينة أخرى قريبة
+    ],
+)
+def test_other_place_is_not_silently_corrected(country, text, lookalike):
+    # الدرجة تتجاوز حد القبول، لكنه اسم بعدد كلمات مختلف: نقترح ولا نصحح
+    matches = pb.gazetteer.match(country, text)
+    assert matches[0][0] == lookalike
+    assert matches[0][1] >= pb.GAZETTEER_ACCEPT_SCORE
+    assert pb.gazetteer.correct(country, text) is None
+
+
+@pytest.mark.parametrize("text", ["نيويورك", "xyz", "123"])
+def test_unrelated_name_is_rejected(text):
+    assert pb.gazetteer.match("لبنان", text) == []
+    assert pb.gazetteer.correct("لبنان", text) is None
+
+
+def test_unknown_country_has_no_matches():
+    assert pb.gazetteer.match("أطلانطس", "بيروت") == []
+    assert pb.gazetteer.correct("أطلانطس", "بيروت") is None
@@ -0,0 +1,103 @@
+"""المواقع (GPS): اسم أقرب مدينة، والمنطقة الزمنية من Aladhan لا من تلك المدينة."""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import prayer_bot as pb
+
+EILAT = (29.5577, 34.9519)  # أقرب مدينة معروفة: العقبة (Asia/Amman)
+EGYPTIAN_RAFAH = (31.2790, 34.2370)  # أقرب مدينة معروفة: رفح غزة (Asia/Gaza)
+
+
+class FakeAladhan:
+    def __init__(self, timezone):
+        self.timezone = timezone
+        self.calls = 0
+        self.down = False
+
+    async def fetch(self, lat, lon):
+        self.calls += 1
+        if self.down:
+            return None
+        day = datetime.now(pb._tz(self.timezone)).date()
+        times = pb.compute_prayer_times(lat, lon, self.timezone, day)
+        times.update(
+            {
+                "gregorian": pb.gregorian_readable(day),
+                "hijri": pb.hijri_date(day),
+                "timezone": self.timezone,
+                "country_ar": "حسب موقعك",
+                "city_ar": "موقعك الحالي",
+                "source": "api",
+            }
+        )
+        return times
+
+
+def _install(monkeypatch, timezone):
+    fake = FakeAladhan(timezone)
+    monkeypatch.setattr(pb, "_fetch_prayer_times_by_coords", fake.fetch)
+    return fake
+
+
+def _forget_cached_day(lat, lon):
+    base_key = pb._lookup_key({"lat": lat, "lon": lon})
+    day = pb._local_date(pb._timezone_hints[base_key])
+    pb.prayer_cache._entries.pop(base_key + (day,), None)
+
+
+def test_nearest_city_is_only_a_label_guess():
+    country_ar, city_ar, tz_name = pb.resolve_location(*pb.snap_coords(*EILAT))
+    assert "العقبة" in city_ar
+    assert tz_name == "Asia/Amman"
+
+
+def test_border_location_takes_timezone_from_aladhan(monkeypatch):
+    aladhan = _install(monkeypatch, "Asia/Jerusalem")
+
+    times = asyncio.run(pb.get_prayer_times_by_coords(*EILAT))
+    assert aladhan.calls == 1
+    assert times["timezone"] == "Asia/Jerusalem"
+    assert "العقبة" in times["city_ar"]
+
+    # اليوم التالي (أو بعد خروجه من الكاش): حساب محلي بنفس المنطقة، بدون Aladhan
+    _forget_cached_day(*pb.snap_coords(*EILAT))
+    times = asyncio.run(pb.get_prayer_times_by_coords(*EILAT))
+    assert aladhan.calls == 1
+    assert times["source"] == "local"
+    assert times["timezone"] == "Asia/Jerusalem"
+    assert "العقبة" in times["city_ar"]
+
+
+def test_nearest_city_timezone_is_only_a_fallback(monkeypatch):
+    aladhan = _install(monkeypatch, "Africa/Cairo")
+    aladhan.down = True
+    lat, lon = pb.snap_coords(*EGYPTIAN_RAFAH)
+    base_key = pb._lookup_key({"lat": lat, "lon": lon})
+
+    times = asyncio.run(pb.get_prayer_times_by_coords(*EGYPTIAN_RAFAH))
+    assert times["timezone"] == "Asia/Gaza"
+    assert base_key not in pb._timezone_hints
+
+    aladhan.down = False
+    times = asyncio.run(pb.get_prayer_times_by_coords(*EGYPTIAN_RAFAH))
+    assert aladhan.calls == 2
+    assert times["timezone"] == "Africa/Cairo"
+    assert pb._timezone_hints[base_key] == "Africa/Cairo"
+
+
+@pytest.mark.parametrize(
+    "lat, lon, expected",
+    [
+        (33.8938, 35.5018, "بيروت"),
+        (33.89, 35.33, "بالقرب من بيروت"),
+        (0.0, 0.0, None),
+    ],
+)
+def test_resolve_location_label(lat, lon, expected):
+    found = pb.resolve_location(lat, lon)
+    if expected is None:
+        assert found is None
+    else:
+        assert expected in found[1]
@@ -0,0 +1,104 @@
+"""طلبات متزامنة لمفتاح بارد واحد = طلب واحد لـ Aladhan، بمهلة المستخدم أو بدونها."""
+import asyncio
+import itertools
+from datetime import datetime
+
+import pytest
+
+import prayer_bot as pb
+
+TZ_NAME = "Asia/Beirut"
+_cities = itertools.count()
+
+
+class FakeAladhan:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def fetch(self, country_ar, city_ar):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        await self.gate.wait()
+        day = datetime.now(pb._tz(TZ_NAME)).date()
+        return {
+            "Fajr": "04:30",
+            "Dhuhr": "12:00",
+            "Asr": "15:30",
+            "Maghrib": "18:00",
+            "Isha": "19:30",
+            "gregorian": pb.gregorian_readable(day),
+            "hijri": pb.hijri_date(day),
+            "timezone": TZ_NAME,
+            "country_ar": country_ar,
+            "city_ar": city_ar,
+            "source": "api",
+        }
+
+
+@pytest.fixture
+def aladhan(monkeypatch):
+    fake = FakeAladhan()
+    monkeypatch.setattr(pb, "_fetch_prayer_times", fake.fetch)
+    return fake
+
+
+def _cold_city():
+    # مدينة غير معروفة محليًا، ومفتاح جديد في كل اختبار (الكاش عام على مستوى الوحدة)
+    return "لبنان", f"قرية اختبار {next(_cities)}"
+
+
+async def _lookup(city, interactive):
+    if interactive:
+        pb._interactive.set(True)  # لكل مهمة سياقها، فلا يتسرب للاختبارات الأخرى
+    return await pb.get_prayer_times(*city)
+
+
+@pytest.mark.parametrize("interactive", [False, True], ids=["background", "deadline"])
+def test_concurrent_cold_lookups_share_one_upstream_call(aladhan, interactive):
+    aladhan.delay = 0.05
+    city = _cold_city()
+
+    async def main():
+        return await asyncio.gather(*(_lookup(city, interactive) for _ in range(50)))
+
+    results = asyncio.run(main())
+    assert aladhan.calls == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_caller_that_missed_just_before_the_flight_finished(aladhan):
+    """الطلب المتأخر يبدأ مهمته بعد انتهاء الطلب الأول: يجد النتيجة في الكاش."""
+    city = _cold_city()
+    aladhan.gate.clear()
+
+    async def main():
+        first = asyncio.create_task(_lookup(city, True))
+        while aladhan.calls == 0:
+            await asyncio.sleep(0)
+        late = asyncio.create_task(_lookup(city, True))
+        # يفوت late الكاش ثم تبدأ مهمته المنفصلة بعد أن ينهي first الجلب
+        aladhan.gate.set()
+        return await asyncio.gather(first, late)
+
+    first, late = asyncio.run(main())
+    assert aladhan.calls == 1
+    assert late is first
+
+
+def test_deadline_then_cached(aladhan, monkeypatch):
+    monkeypatch.setattr(pb, "LOOKUP_DEADLINE", 0.01)
+    aladhan.delay = 0.1
+    city = _cold_city()
+
+    async def main():
+        waiting = await asyncio.gather(*(_lookup(city, True) for _ in range(20)), return_exceptions=True)
+        assert all(isinstance(e, pb.Overloaded) and e.reason == "deadline" for e in waiting)
+        await asyncio.sleep(0.2)  # الطلب يكمل في الخلفية
+        return await _lookup(city, True)
+
+    assert asyncio.run(main())["source"] == "api"
+    assert aladhan.calls == 1
@@ -0,0 +1,118 @@
+"""الحساب المحلي مقابل مواقيت مرجعية، والجدول السنوي مقابل الحساب المفرد."""
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import prayer_bot as pb
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+with open(os.path.join(DATA, "prayer_reference.json"), encoding="utf-8") as f:
+    REFERENCE = json.load(f)
+
+
+def _case_id(case):
+    return f"{case['city']}-{case['date']}-m{case['method']}-s{case['school']}"
+
+
+@pytest.mark.parametrize("case", REFERENCE, ids=_case_id)
+def test_matches_reference(case):
+    times = pb.compute_prayer_times(
+        case["lat"],
+        case["lon"],
+        case["timezone"],
+        date.fromisoformat(case["date"]),
+        case["method"],
+        case["school"],
+    )
+    assert times == case["times"]
+
+
+def test_reference_covers_every_method_and_school():
+    covered = {(case["method"], case["school"]) for case in REFERENCE}
+    assert covered >= {(method, school) for method in pb.CALCULATION_METHODS for school in (0, 1)}
+
+
+def _minutes(hhmm):
+    hours, minutes = map(int, hhmm.split(":"))
+    return hours * 60 + minutes
+
+
+def test_umm_al_qura_isha_two_hours_after_maghrib_in_ramadan():
+    lat, lon, tz_name = pb.CITY_COORDS["Mecca"]
+    ramadan, shawwal = date(2025, 3, 15), date(2025, 4, 15)
+    assert pb.hijri_date(ramadan).split("-")[1] == "09"
+    assert pb.hijri_date(shawwal).split("-")[1] != "09"
+
+    during = pb.compute_prayer_times(lat, lon, tz_name, ramadan, 4, 0)
+    after = pb.compute_prayer_times(lat, lon, tz_name, shawwal, 4, 0)
+    assert _minutes(during["Isha"]) - _minutes(during["Maghrib"]) == 120
+    assert _minutes(after["Isha"]) - _minutes(after["Maghrib"]) == 90
+
+
+def test_high_latitude_has_every_prayer_all_year():
+    # أوسلو صيفًا: الشمس لا تنزل 15° فالفجر والعشاء من تعديل Angle Based (القيم في المرجع)
+    for offset in range(365):
+        day = date(2025, 1, 1) + timedelta(days=offset)
+        times = pb.compute_prayer_times(59.9139, 10.7522, "Europe/Oslo", day, 2, 0)
+        assert all(times[key] for key in pb.PRAYER_KEYS), day
+
+
+# التقويم الهجري الحسابي (Calendrical Calculations، بدء التاريخ 16 يوليو 622 يولياني)
+ISLAMIC_EPOCH = date(622, 7, 19).toordinal()
+
+
+def _fixed_from_islamic(year, month, day):
+    return day + 29 * (month - 1) + (6 * month - 1) // 11 + (year - 1) * 354 + (3 + 11 * year) // 30 + ISLAMIC_EPOCH - 1
+
+
+def _islamic_from_fixed(fixed):
+    year = (30 * (fixed - ISLAMIC_EPOCH) + 10646) // 10631
+    month = min(12, (11 * (fixed - _fixed_from_islamic(year, 1, 1)) + 330) // 325)
+    return fixed - _fixed_from_islamic(year, month, 1) + 1, month, year
+
+
+@pytest.mark.parametrize(
+    "day, expected",
+    [
+        (date(622, 7, 19), "01-01-1"),
+        (date(2025, 3, 1), "01-09-1446"),
+        (date(2025, 3, 31), "01-10-1446"),
+    ],
+)
+def test_hijri_date(day, expected):
+    assert pb.hijri_date(day) == expected
+
+
+def test_hijri_matches_arithmetic_calendar():
+    start = date(2000, 1, 1).toordinal()
+    for fixed in range(start, start + 366 * 40):
+        assert pb._hijri_parts(date.fromordinal(fixed)) == _islamic_from_fixed(fixed)
+
+
+def test_hijri_adjustment_shifts_the_date(monkeypatch):
+    monkeypatch.setattr(pb, "HIJRI_ADJUSTMENT", -1)
+    assert pb.hijri_date(date(2025, 3, 1)) == "29-08-1446"
+
+
+def _assert_table_matches_scalar(year, method, school, step):
+    table = pb.compute_year_timetable(year, method, school)
+    first = date(year, 1, 1)
+    for day in (first + timedelta(days=i) for i in range(0, (date(year + 1, 1, 1) - first).days, step)):
+        hijri = pb.hijri_date(day)
+        for city, (lat, lon, tz_name) in pb.CITY_COORDS.items():
+            expected = dict(pb.compute_prayer_times(lat, lon, tz_name, day, method, school), hijri=hijri)
+            assert table.lookup(city, day) == expected, (city, day)
+
+
+def test_yearly_table_matches_scalar_engine_every_day():
+    # كل يوم من سنة كبيسة: الانتقال للتوقيت الصيفي ورمضان (عشاء أم القرى) ورأس السنة
+    _assert_table_matches_scalar(2024, 4, 0, 1)
+
+
+@pytest.mark.parametrize("method", sorted(pb.CALCULATION_METHODS))
+@pytest.mark.parametrize("school", (0, 1))
+def test_yearly_table_matches_scalar_engine(method, school):
+    _assert_table_matches_scalar(2025, method, school, 11)
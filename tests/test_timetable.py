@@ -0,0 +1,102 @@
+"""ملف الجدول الثنائي: الكتابة والتحميل، ورفض الملفات التالفة أو القديمة."""
+import struct
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import prayer_bot as pb
+
+YEAR = 2025
+METHOD, SCHOOL = pb.PRAYER_METHOD, pb.PRAYER_SCHOOL
+
+
+@pytest.fixture(scope="module")
+def table():
+    return pb.compute_year_timetable(YEAR, METHOD, SCHOOL)
+
+
+@pytest.fixture
+def timetable_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pb, "TIMETABLE_DIR", str(tmp_path))
+    monkeypatch.setattr(pb, "_timetables", {})
+    return tmp_path
+
+
+def _written(table, path):
+    pb.write_timetable(table, str(path))
+    return path
+
+
+def _patch_header(path, offset, fmt, value):
+    data = bytearray(path.read_bytes())
+    struct.pack_into(fmt, data, offset, value)
+    path.write_bytes(bytes(data))
+
+
+def test_round_trip(table, tmp_path):
+    path = _written(table, tmp_path / "t.bin")
+    loaded = pb.load_timetable(str(path), YEAR, METHOD, SCHOOL)
+    assert loaded is not None
+    assert loaded.cities == table.cities
+    assert np.array_equal(loaded.minutes, table.minutes)
+    assert np.array_equal(loaded.offsets, table.offsets)
+    assert np.array_equal(loaded.hijri, table.hijri)
+    assert loaded.lookup("Beirut", date(YEAR, 3, 15)) == table.lookup("Beirut", date(YEAR, 3, 15))
+
+
+def test_missing_file(tmp_path):
+    assert pb.load_timetable(str(tmp_path / "missing.bin"), YEAR, METHOD, SCHOOL) is None
+
+
+@pytest.mark.parametrize("keep", [0, 10, pb.TIMETABLE_HEADER.size + 2, -1])
+def test_truncated_file_is_rejected(table, tmp_path, keep):
+    path = _written(table, tmp_path / "t.bin")
+    path.write_bytes(path.read_bytes()[:keep])
+    assert pb.load_timetable(str(path), YEAR, METHOD, SCHOOL) is None
+
+
+def test_bad_crc_is_rejected(table, tmp_path):
+    path = _written(table, tmp_path / "t.bin")
+    _patch_header(path, 18, "<I", pb._timetable_checksum() ^ 1)
+    assert pb.load_timetable(str(path), YEAR, METHOD, SCHOOL) is None
+
+
+def test_version_mismatch_is_rejected(table, tmp_path):
+    path = _written(table, tmp_path / "t.bin")
+    _patch_header(path, 4, "<H", pb.TIMETABLE_VERSION - 1)
+    assert pb.load_timetable(str(path), YEAR, METHOD, SCHOOL) is None
+
+
+def test_other_year_or_method_is_rejected(table, tmp_path):
+    path = _written(table, tmp_path / "t.bin")
+    assert pb.load_timetable(str(path), YEAR + 1, METHOD, SCHOOL) is None
+    assert pb.load_timetable(str(path), YEAR, METHOD, 1 - SCHOOL) is None
+
+
+def test_hijri_adjustment_change_invalidates_file(table, tmp_path, monkeypatch):
+    path = _written(table, tmp_path / "t.bin")
+    monkeypatch.setattr(pb, "HIJRI_ADJUSTMENT", pb.HIJRI_ADJUSTMENT + 1)
+    assert pb.load_timetable(str(path), YEAR, METHOD, SCHOOL) is None
+
+
+def test_invalid_file_falls_back_to_computing(table, timetable_dir):
+    path = _written(table, Path(pb.timetable_path(YEAR)))
+    path.write_bytes(path.read_bytes()[:-100])
+
+    loaded = pb.get_timetable(date(YEAR, 6, 1))
+    assert loaded is not None
+    assert np.array_equal(loaded.minutes, table.minutes)
+
+
+def test_invalid_file_is_rebuilt(table, timetable_dir, monkeypatch):
+    # كما يفعل main قبل تشغيل العمال: ملف غير صالح -> يُكتب من جديد
+    path = _written(table, Path(pb.timetable_path(YEAR)))
+    monkeypatch.setattr(pb, "HIJRI_ADJUSTMENT", pb.HIJRI_ADJUSTMENT + 1)
+    assert pb.load_timetable(str(path), YEAR) is None
+
+    pb.build_timetable_files([YEAR])
+    loaded = pb.load_timetable(str(path), YEAR)
+    assert loaded is not None
+    assert loaded.lookup("Mecca", date(YEAR, 3, 1))["hijri"] == pb.hijri_date(date(YEAR, 3, 1))
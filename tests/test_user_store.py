@@ -0,0 +1,33 @@
+"""واجهة UserStore وتنفيذاها (الذاكرة و SQLite)."""
+import pytest
+
+import prayer_bot as pb
+
+
+def test_incomplete_store_fails_on_creation():
+    class NoSubscriptions(pb.UserStore):
+        def load(self, user_id):
+            return None
+
+        def save_many(self, rows):
+            pass
+
+    with pytest.raises(TypeError, match="delete_subscription"):
+        NoSubscriptions()
+
+
+@pytest.mark.parametrize("url", ["memory://", "sqlite:///{tmp}/users.db"])
+def test_store_round_trip(url, tmp_path):
+    store = pb.open_user_store(url.format(tmp=tmp_path))
+    try:
+        store.save_many([(1, {"saved_country": "لبنان", "saved_city": "بيروت", "alerts_on": True})])
+        assert store.load(1)["saved_city"] == "بيروت"
+        assert store.load(1)["alerts_on"] is True
+        assert store.load(2) is None
+
+        store.save_subscription(1, {"country": "لبنان", "city": "بيروت"})
+        assert list(store.load_subscriptions()) == [1]
+        store.delete_subscription(1)
+        assert store.load_subscriptions() == {}
+    finally:
+        store.close()